@@ -114,7 +114,8 @@ def load_balancer() -> None:
     Put this component between a driver and a set of models, or between
     a macro model and a set of micro models. It will let the driver or
     macro-model submit as many calls as it wants, and divide them over
-    the available (micro)model instances in a round-robin fashion.
+    the available (micro)model instances, giving the next call to
+    whichever instance finishes first.
 
     Assumes a fixed number of micro-model instances.
 
@@ -135,20 +136,26 @@ def load_balancer() -> None:
     while instance.reuse_instance(False):
         # F_INIT
         started = 0     # number started and index of next to start
-        done = 0        # number done and index of next to return
+        working = dict()    # index of the call each worker is doing
 
         num_calls = instance.get_port_length('front_in')
         num_workers = instance.get_port_length('back_out')
 
         instance.set_port_length('front_out', num_calls)
-        while done < num_calls:
-            while started - done < num_workers and started < num_calls:
+        while started < min(num_calls, num_workers):
+            msg = instance.receive_with_settings('front_in', started)
+            instance.send('back_out', msg, started)
+            working[started] = started
+            started += 1
+
+        while working:
+            worker, msg = instance.receive_any_with_settings('back_in')
+            instance.send('front_out', msg, working.pop(worker))
+            if started < num_calls:
                 msg = instance.receive_with_settings('front_in', started)
-                instance.send('back_out', msg, started % num_workers)
+                instance.send('back_out', msg, worker)
+                working[worker] = started
                 started += 1
-            msg = instance.receive_with_settings('back_in', done % num_workers)
-            instance.send('front_out', msg, done)
-            done += 1
 
 
 def qmc_driver() -> None:
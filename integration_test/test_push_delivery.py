@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from ymmsl import (Component, Conduit, Configuration, Model, Operator,
+                   Settings)
+
+from libmuscle import Instance, Message
+from libmuscle.runner import run_simulation
+
+
+def macro():
+    """Macro model implementation.
+    """
+    instance = Instance({
+            Operator.O_I: ['out[]'],
+            Operator.S: ['in[]']})
+
+    while instance.reuse_instance():
+        for step in range(3):
+            for slot in range(5):
+                data = np.full(1000, step, np.float64)
+                instance.send('out', Message(step, None, data), slot)
+
+            state = np.zeros(1000)
+            instance.set_receive_buffer('in', state, 4)
+            for slot in range(5):
+                msg = instance.receive('in', slot)
+                assert msg.timestamp == step
+                assert msg.data.array[0] == step + slot
+            assert msg.data.array is state
+
+
+def micro():
+    """Micro model implementation.
+    """
+    instance = Instance({
+            Operator.F_INIT: ['in'],
+            Operator.O_F: ['out']})
+
+    while instance.reuse_instance():
+        msg = instance.receive('in')
+        result = msg.data.array + instance._index[0]
+        instance.send('out', Message(msg.timestamp, None, result))
+
+
+def test_push_delivery(log_file_in_tmpdir):
+    """Runs a simulation with messages pushed to receivers.
+    """
+    elements = [
+            Component('macro', 'macro_impl'),
+            Component('micro', 'micro_impl', [5])]
+
+    conduits = [
+            Conduit('macro.out', 'micro.in'),
+            Conduit('micro.out', 'macro.in')]
+
+    model = Model('test_model', elements, conduits)
+    settings = Settings({'muscle_push_delivery': True})
+
+    configuration = Configuration(model, settings)
+
+    implementations = {'macro_impl': macro, 'micro_impl': micro}
+    run_simulation(configuration, implementations)
+
+
+def test_prefetch(log_file_in_tmpdir):
+    """Runs a simulation with prefetching receivers.
+    """
+    elements = [
+            Component('macro', 'macro_impl'),
+            Component('micro', 'micro_impl', [5])]
+
+    conduits = [
+            Conduit('macro.out', 'micro.in'),
+            Conduit('micro.out', 'macro.in')]
+
+    model = Model('test_model', elements, conduits)
+    settings = Settings({'muscle_prefetch_ports': 'in'})
+
+    configuration = Configuration(model, settings)
+
+    implementations = {'macro_impl': macro, 'micro_impl': micro}
+    run_simulation(configuration, implementations)
+
+
+def test_async_send(log_file_in_tmpdir):
+    """Runs a simulation with messages sent in the background.
+    """
+    elements = [
+            Component('macro', 'macro_impl'),
+            Component('micro', 'micro_impl', [5])]
+
+    conduits = [
+            Conduit('macro.out', 'micro.in'),
+            Conduit('micro.out', 'macro.in')]
+
+    model = Model('test_model', elements, conduits)
+    settings = Settings({'muscle_async_send': True})
+
+    configuration = Configuration(model, settings)
+
+    implementations = {'macro_impl': macro, 'micro_impl': micro}
+    run_simulation(configuration, implementations)
+
+
+@pytest.mark.parametrize('when_full', ['block', 'spill'])
+def test_outbox_limit(log_file_in_tmpdir, when_full):
+    """Runs a simulation with senders waiting for receivers, or
+    spilling to disk.
+    """
+    elements = [
+            Component('macro', 'macro_impl'),
+            Component('micro', 'micro_impl', [5])]
+
+    conduits = [
+            Conduit('macro.out', 'micro.in'),
+            Conduit('micro.out', 'macro.in')]
+
+    model = Model('test_model', elements, conduits)
+    settings = Settings({
+        'muscle_outbox_limit': 10000,
+        'muscle_outbox_port_limit': 1000,
+        'muscle_outbox_full': when_full})
+
+    configuration = Configuration(model, settings)
+
+    implementations = {'macro_impl': macro, 'micro_impl': micro}
+    run_simulation(configuration, implementations)
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+from ymmsl import (Component, Conduit, Configuration, Model, Operator,
+                   Settings)
+
+from libmuscle import Instance, Message
+from libmuscle.runner import run_simulation
+
+
+def macro():
+    """Macro model implementation.
+    """
+    instance = Instance({
+            Operator.O_I: ['out[]'],
+            Operator.S: ['in[]']})
+
+    while instance.reuse_instance():
+        for step in range(2):
+            for slot in range(5):
+                instance.send('out', Message(step, None, slot), slot)
+
+            order = list()
+            for _ in range(5):
+                slot, msg = instance.receive_any('in')
+                assert msg.timestamp == step
+                assert msg.data == slot * 2
+                assert msg.settings is None
+                order.append(slot)
+
+            assert sorted(order) == list(range(5))
+            # slot 0 is the slowest, so it shouldn't hold up the others
+            assert order[-1] == 0
+
+
+def micro():
+    """Micro model implementation.
+    """
+    instance = Instance({
+            Operator.F_INIT: ['in'],
+            Operator.O_F: ['out']})
+
+    while instance.reuse_instance():
+        msg = instance.receive('in')
+        if msg.data == 0:
+            time.sleep(0.5)
+        instance.send('out', Message(msg.timestamp, None, msg.data * 2))
+
+
+@pytest.mark.parametrize('push_delivery', [False, True])
+def test_receive_any(log_file_in_tmpdir, push_delivery):
+    """Runs a simulation receiving results in the order they arrive.
+    """
+    elements = [
+            Component('macro', 'macro_impl'),
+            Component('micro', 'micro_impl', [5])]
+
+    conduits = [
+            Conduit('macro.out', 'micro.in'),
+            Conduit('micro.out', 'macro.in')]
+
+    model = Model('test_model', elements, conduits)
+    settings = Settings({'muscle_push_delivery': push_delivery})
+
+    configuration = Configuration(model, settings)
+
+    implementations = {'macro_impl': macro, 'micro_impl': micro}
+    run_simulation(configuration, implementations)
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+from ymmsl import (Component, Conduit, Configuration, Model, Operator,
+                   Settings)
+
+from libmuscle import Instance, Message
+from libmuscle.runner import run_simulation
+
+
+def macro():
+    """Macro model implementation.
+    """
+    instance = Instance({
+            Operator.O_I: ['out'],
+            Operator.S: ['in']})
+
+    while instance.reuse_instance():
+        for step in range(4):
+            instance.send('out', Message(step, None, step))
+
+            # overlap local work with waiting for the result
+            work = 0
+            if step % 2 == 0:
+                while not instance.probe('in'):
+                    work += 1
+                    time.sleep(0.01)
+                msg = instance.receive('in')
+            else:
+                result = instance.receive_async('in')
+                while not result.done():
+                    work += 1
+                    time.sleep(0.01)
+                msg = result.result()
+
+            assert work > 0
+            assert msg.timestamp == step
+            assert msg.data == step * 2
+            assert msg.settings is None
+
+
+def micro():
+    """Micro model implementation.
+    """
+    instance = Instance({
+            Operator.F_INIT: ['in'],
+            Operator.O_F: ['out']})
+
+    while instance.reuse_instance():
+        assert instance.probe('in')
+        msg = instance.receive_async('in').result()
+        time.sleep(0.2)
+        instance.send('out', Message(msg.timestamp, None, msg.data * 2))
+
+
+@pytest.mark.parametrize('push_delivery', [False, True])
+def test_receive_async(log_file_in_tmpdir, push_delivery):
+    """Runs a simulation receiving in the background.
+    """
+    elements = [
+            Component('macro', 'macro_impl'),
+            Component('micro', 'micro_impl')]
+
+    conduits = [
+            Conduit('macro.out', 'micro.in'),
+            Conduit('micro.out', 'macro.in')]
+
+    model = Model('test_model', elements, conduits)
+    settings = Settings({'muscle_push_delivery': push_delivery})
+
+    configuration = Configuration(model, settings)
+
+    implementations = {'macro_impl': macro, 'micro_impl': micro}
+    run_simulation(configuration, implementations)
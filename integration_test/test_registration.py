@@ -37,9 +37,7 @@ def test_wiring(log_file_in_tmpdir, mmp_server_process):
     assert peer_dims[Reference('macro')] == []
     assert peer_locations['macro'] == ['direct:macro']
 
-    with patch('libmuscle.mmp_client.PEER_TIMEOUT', 0.1), \
-            patch('libmuscle.mmp_client.PEER_INTERVAL_MIN', 0.01), \
-            patch('libmuscle.mmp_client.PEER_INTERVAL_MAX', 0.1):
+    with patch('libmuscle.mmp_client.PEER_TIMEOUT', 0.1):
         with pytest.raises(RuntimeError):
             client.request_peers(Reference('macro'))
 
@@ -48,9 +46,7 @@ def test_wiring(log_file_in_tmpdir, mmp_server_process):
         location = 'direct:{}'.format(instance)
         client.register_instance(instance, [location], [])
 
-    with patch('libmuscle.mmp_client.PEER_TIMEOUT', 0.1), \
-            patch('libmuscle.mmp_client.PEER_INTERVAL_MIN', 0.01), \
-            patch('libmuscle.mmp_client.PEER_INTERVAL_MAX', 0.1):
+    with patch('libmuscle.mmp_client.PEER_TIMEOUT', 0.1):
         with pytest.raises(RuntimeError):
             client.request_peers(Reference('macro'))
 
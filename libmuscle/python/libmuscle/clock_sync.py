@@ -0,0 +1,75 @@
+from typing import Optional, Tuple  # noqa
+
+
+MIN_DRIFT_INTERVAL = 10.0
+"""Minimum time between measurements to estimate drift from, in s."""
+
+
+class ClockSync:
+    """Estimates the difference between our clock and the manager's.
+
+    Clock offsets are measured NTP-style, by asking the manager for the
+    time and assuming that the answer was produced halfway the round
+    trip. The error in this is at most half the round trip time, so
+    out of several measurements the one with the shortest round trip
+    should be used.
+
+    If measurements are far enough apart, the drift between the clocks
+    is estimated as well, from the first and the latest measurement,
+    and used to extrapolate the offset from the latest measurement.
+    To keep the extrapolation short and the drift estimate accurate,
+    measurements should be added regularly throughout the run.
+    """
+    def __init__(self) -> None:
+        """Create a ClockSync.
+
+        Until the first measurement is added, the offset is zero.
+        """
+        self._first = None  # type: Optional[Tuple[float, float]]
+        # Reference time, offset at that time, and drift
+        self._model = (0.0, 0.0, 0.0)
+
+    def add_measurement(
+            self, t_send: float, t_manager: float, t_receive: float
+            ) -> None:
+        """Adds a measurement of the clock offset.
+
+        Args:
+            t_send: Local time at which the request was sent.
+            t_manager: Manager time at which it was handled.
+            t_receive: Local time at which the response was received.
+        """
+        local_time = (t_send + t_receive) * 0.5
+        offset = t_manager - local_time
+
+        drift = 0.0
+        if self._first is None:
+            self._first = (local_time, offset)
+        else:
+            first_time, first_offset = self._first
+            interval = local_time - first_time
+            if interval >= MIN_DRIFT_INTERVAL:
+                drift = (offset - first_offset) / interval
+
+        # assign at once, so that to_manager_time() can run concurrently
+        self._model = (local_time, offset, drift)
+
+    def offset(self) -> float:
+        """Returns the most recently measured offset, in seconds.
+
+        This is the amount to add to a local time to obtain the
+        corresponding manager time.
+        """
+        return self._model[1]
+
+    def to_manager_time(self, t: float) -> float:
+        """Converts a local time to the manager's clock.
+
+        Args:
+            t: A local time, in seconds since the epoch.
+
+        Returns:
+            The corresponding manager time, in seconds since the epoch.
+        """
+        ref_time, offset, drift = self._model
+        return t + offset + drift * (t - ref_time)
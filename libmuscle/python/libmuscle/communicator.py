@@ -1,15 +1,27 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 import logging
-from typing import Any, Dict, List, Optional, Tuple, cast
+from pathlib import Path
+from queue import Queue
+from typing import (  # noqa
+        Any, Callable, Deque, Dict, List, Optional, Set, Tuple, Union, cast)
+
+import numpy as np
 from ymmsl import Conduit, Identifier, Operator, Reference, Settings
 
 from libmuscle.endpoint import Endpoint
-from libmuscle.mpp_message import ClosePort, MPPMessage
+from libmuscle.inbox import Inbox
+from libmuscle.mpp_message import ClosePort, MPPMessage, OverlayCache  # noqa
 from libmuscle.mpp_client import MPPClient
-from libmuscle.mcp.transport_server import TransportServer
+from libmuscle.mcp.protocol import MPPFeature
+from libmuscle.mcp.transport_server import ServerNotSupported, TransportServer
 from libmuscle.mcp.type_registry import transport_server_types
+from libmuscle.multi_prefetcher import MultiPrefetcher, PrefetchedEndpoint
 from libmuscle.peer_manager import PeerManager
 from libmuscle.post_office import PostOffice
 from libmuscle.port import Port
+from libmuscle.prefetcher import Prefetcher
 from libmuscle.profiler import Profiler
 from libmuscle.profiling import ProfileEventType
 
@@ -20,6 +32,47 @@ _logger = logging.getLogger(__name__)
 MessageObject = Any
 
 
+# Maximum number of instances receive_messages() receives from at once
+_MAX_RECEIVE_THREADS = 16
+
+
+_ReceiveBuffersType = Dict[Tuple[str, Optional[int]], np.ndarray]
+
+_Fetcher = Union[Prefetcher, PrefetchedEndpoint]
+
+_Source = Union[Inbox, _Fetcher]
+
+
+class _Link:
+    """Addresses for sending or receiving on a port slot.
+
+    Working these out means creating several Endpoints and References,
+    which takes longer than sending a small message does, so we do it
+    once for each port and slot and keep the result.
+
+    Attributes:
+        ref (Reference): Our endpoint.
+        peer_ref (Reference): The connected endpoint.
+        peer_instance (Reference): The instance that is connected to.
+        ref_str (str): Our endpoint as it is sent in messages.
+        peer_ref_str (str): The connected endpoint as it is sent in
+                messages.
+    """
+    def __init__(self, endpoint: Endpoint, peer_endpoint: Endpoint
+                 ) -> None:
+        """Create a _Link.
+
+        Args:
+            endpoint: Our endpoint.
+            peer_endpoint: The endpoint it is connected to.
+        """
+        self.ref = endpoint.ref()
+        self.peer_ref = peer_endpoint.ref()
+        self.peer_instance = peer_endpoint.instance()
+        self.ref_str = str(self.ref)
+        self.peer_ref_str = str(self.peer_ref)
+
+
 class Message:
     """A message to be sent or received.
 
@@ -90,12 +143,44 @@ class Communicator:
         # indexed by remote instance id
         self._clients = dict()  # type: Dict[Reference, MPPClient]
 
+        # last received settings overlays, shared by all clients and
+        # indexed by receiving endpoint
+        self._overlays = dict()  # type: Dict[Reference, OverlayCache]
+
         for server_type in transport_server_types:
-            server = server_type(self._post_office)
-            self._servers.append(server)
+            try:
+                server = server_type(self._post_office)
+                self._servers.append(server)
+            except ServerNotSupported as e:
+                _logger.debug('Not using {}: {}'.format(
+                    server_type.__name__, e))
 
         self._ports = dict()   # type: Dict[str, Port]
 
+        # indexed by port name and slot, None if not connected
+        self._links = dict(
+                )   # type: Dict[Tuple[str, Optional[int]], Optional[_Link]]
+
+        self._receive_buffers = dict()  # type: _ReceiveBuffersType
+
+        self._push_delivery = False
+        self._inboxes = dict()  # type: Dict[Reference, Optional[Inbox]]
+
+        self._prefetch_ports = set()  # type: Set[str]
+        self._prefetchers = dict()  # type: Dict[Reference, _Fetcher]
+
+        # slots that receive_any_message() fetches from in the background
+        self._watched = dict()  # type: Dict[Tuple[str, int], _Source]
+        self._ready_slots = dict()  # type: Dict[str, Queue[int]]
+
+        # sends in progress, see set_async_send()
+        self._sender = None     # type: Optional[ThreadPoolExecutor]
+        self._pending_sends = deque()  # type: Deque[Future[None]]
+
+        # one thread per slot for receive_message_async()
+        self._async_receivers = dict(
+                )   # type: Dict[Tuple[str, Optional[int]], ThreadPoolExecutor]
+
     def get_locations(self) -> List[str]:
         """Returns a list of locations that we can be reached at.
 
@@ -138,6 +223,15 @@ class Communicator:
 
         self._muscle_settings_in = self.__settings_in_port(conduits)
 
+        self._links.clear()
+        for port_name, port in self._ports.items():
+            if port.is_vector():
+                for slot in range(port.get_length()):
+                    self.__get_link(port_name, slot)
+            else:
+                self.__get_link(port_name, None)
+        self.__get_link('muscle_settings_in', None)
+
     def settings_in_connected(self) -> bool:
         """Returns True iff muscle_settings_in is connected.
         """
@@ -174,6 +268,60 @@ class Communicator:
         """
         return self._ports[port_name]
 
+    def set_receive_buffer(
+            self, port_name: str, slot: Optional[int],
+            array: Optional[np.ndarray]) -> None:
+        """Sets an array to receive grids on a port into.
+
+        See :meth:`libmuscle.Instance.set_receive_buffer`.
+
+        Args:
+            port_name: The port to receive on.
+            slot: The slot to receive on, if any.
+            array: The array to receive into, or None to stop doing so.
+        """
+        if array is None:
+            self._receive_buffers.pop((port_name, slot), None)
+        else:
+            self._receive_buffers[(port_name, slot)] = array
+
+    def set_push_delivery(self, enabled: bool) -> None:
+        """Enables or disables push delivery of received messages.
+
+        With push delivery, we subscribe to the messages for each of
+        our receiving endpoints the first time we receive on it. The
+        sender then sends them to us as soon as they are available,
+        on a separate connection per endpoint, and they are kept in an
+        Inbox until they are received. Peers that do not support this
+        are received from as usual.
+
+        This affects only endpoints that have not been received on yet.
+
+        Args:
+            enabled: Whether to use push delivery.
+        """
+        self._push_delivery = enabled
+
+    def set_prefetch(self, port_name: str, enabled: bool) -> None:
+        """Enables or disables prefetching of messages on a port.
+
+        When prefetching, we request the next message on each slot of
+        the port as soon as the previous one has been received, on a
+        separate connection per slot, so that it is available
+        immediately when it is received. This is ignored for slots that
+        use push delivery, which does the same and more.
+
+        This affects only slots that have not been received on yet.
+
+        Args:
+            port_name: The port to prefetch on.
+            enabled: Whether to prefetch.
+        """
+        if enabled:
+            self._prefetch_ports.add(port_name)
+        else:
+            self._prefetch_ports.discard(port_name)
+
     def send_message(
             self, port_name: str, message: Message,
             slot: Optional[int] = None) -> None:
@@ -189,10 +337,8 @@ class Communicator:
         """
         if slot is None:
             _logger.debug('Sending message on {}'.format(port_name))
-            slot_list = []  # type: List[int]
         else:
             _logger.debug('Sending message on {}[{}]'.format(port_name, slot))
-            slot_list = [slot]
             slot_length = self._ports[port_name].get_length()
             if slot_length <= slot:
                 raise RuntimeError(('Slot out of bounds. You are sending on'
@@ -200,33 +346,124 @@ class Communicator:
                                     ' {}, so that slot does not exist'
                                     ).format(slot, port_name, slot_length))
 
-        snd_endpoint = self.__get_endpoint(port_name, slot_list)
-        if not self._peer_manager.is_connected(snd_endpoint.port):
+        link = self.__get_link(port_name, slot)
+        if link is None:
             # log sending on disconnected port
             return
 
         port = self._ports[port_name]
-        profile_event = self._profiler.start(ProfileEventType.SEND, port,
-                                             None, slot, None)
-
-        recv_endpoint = self._peer_manager.get_peer_endpoint(
-                snd_endpoint.port, slot_list)
+        profile_start = self._profiler.start()
 
         port_length = None
-        if self._ports[port_name].is_resizable():
-            port_length = self._ports[port_name].get_length()
+        if port.is_resizable():
+            port_length = port.get_length()
 
-        mcp_message = MPPMessage(snd_endpoint.ref(), recv_endpoint.ref(),
+        mcp_message = MPPMessage(link.ref, link.peer_ref,
                                  port_length,
                                  message.timestamp, message.next_timestamp,
                                  cast(Settings, message.settings),
                                  message.data)
-        encoded_message = mcp_message.encoded()
-        self._post_office.deposit(recv_endpoint.ref(), encoded_message)
-        profile_event.stop()
-        if port.is_vector():
-            profile_event.port_length = port.get_length()
-        profile_event.message_size = len(encoded_message)
+        self.__in_order(
+                self.__deposit, port,
+                port.get_length() if port.is_vector() else None, slot,
+                link, mcp_message, profile_start)
+
+    def broadcast_message(self, port_name: str, message: Message) -> None:
+        """Send a message to all slots of a vector port.
+
+        This does the same as calling :meth:`send_message` for each
+        slot, but encodes the message only once, and shares the
+        encoded data between all the receivers.
+
+        Args:
+            port_name: The port on which this message is to be sent.
+            message: The message to be sent.
+        """
+        port = self._ports[port_name]
+        if not port.is_vector():
+            self.send_message(port_name, message)
+            return
+
+        _logger.debug('Sending message on all slots of {}'.format(port_name))
+        port_length = port.get_length()
+        if port_length == 0:
+            return
+
+        if self.__get_link(port_name, 0) is None:
+            # log sending on disconnected port
+            return
+
+        profile_start = self._profiler.start()
+
+        resizable_length = port_length if port.is_resizable() else None
+        links = [
+                cast(_Link, self.__get_link(port_name, slot))
+                for slot in range(port_length)]
+
+        mcp_message = MPPMessage(
+                links[0].ref, links[0].peer_ref, resizable_length,
+                message.timestamp, message.next_timestamp,
+                cast(Settings, message.settings), message.data)
+
+        self.__in_order(
+                self.__deposit_all, port, port_length, links,
+                mcp_message, profile_start)
+
+    def set_outbox_limits(
+            self, limit: Optional[int], port_limit: Optional[int],
+            block: bool, spill_dir: Optional[Path] = None) -> None:
+        """Limits the amount of sent data waiting to be received.
+
+        See :meth:`PostOffice.set_limits`.
+
+        Args:
+            limit: Maximum total size of all messages in bytes, or
+                    None for no limit.
+            port_limit: Maximum total size in bytes of the messages
+                    sent on any single port, or None for no limit.
+            block: Whether to wait for space when sending, rather than
+                    raising a RuntimeError.
+            spill_dir: Directory to write messages that do not fit to,
+                    or None to block or raise instead.
+        """
+        self._post_office.set_limits(limit, port_limit, block, spill_dir)
+
+    def set_async_send(self, enabled: bool) -> None:
+        """Enables or disables sending in the background.
+
+        Normally, messages are encoded and put into the outbox before
+        send_message() returns. With asynchronous sending, this is done
+        by a background thread instead, so that the caller can carry on
+        while large messages are encoded. Messages are still sent in
+        the order in which send_message() was called.
+
+        The background thread refers to the data being sent rather
+        than copying it, so any sent objects must not be changed until
+        flush() has been called. Errors encoding a message are raised
+        by the next call to send_message() or flush().
+
+        Args:
+            enabled: Whether to send in the background.
+        """
+        if enabled and self._sender is None:
+            self._sender = ThreadPoolExecutor(max_workers=1)
+        elif not enabled and self._sender is not None:
+            self.flush()
+            self._sender.shutdown()
+            self._sender = None
+
+    def flush(self) -> None:
+        """Waits until all messages have been sent.
+
+        This does nothing unless asynchronous sending is enabled, see
+        set_async_send().
+
+        Raises:
+            Exception: Whatever went wrong sending a message, if
+                anything.
+        """
+        while self._pending_sends:
+            self._pending_sends.popleft().result()
 
     def receive_message(self, port_name: str, slot: Optional[int] = None,
                         default: Optional[Message] = None
@@ -258,15 +495,13 @@ class Communicator:
         """
         if slot is None:
             _logger.debug('Waiting for message on {}'.format(port_name))
-            slot_list = []      # type: List[int]
         else:
             _logger.debug('Waiting for message on {}[{}]'.format(
                 port_name, slot))
-            slot_list = [slot]
 
-        recv_endpoint = self.__get_endpoint(port_name, slot_list)
+        link = self.__get_link(port_name, slot)
 
-        if not self._peer_manager.is_connected(recv_endpoint.port):
+        if link is None:
             if default is None:
                 raise RuntimeError(('Tried to receive on port "{}", which is'
                                     ' disconnected, and no default value was'
@@ -286,42 +521,219 @@ class Communicator:
             # built-in automatic ports.
             port = self._muscle_settings_in
 
-        profile_event = self._profiler.start(ProfileEventType.RECEIVE, port,
-                                             None, slot, None)
+        profile_start = self._profiler.start()
+        return self.__receive(port_name, port, slot, link, profile_start)
 
-        snd_endpoint = self._peer_manager.get_peer_endpoint(
-                recv_endpoint.port, slot_list)
-        client = self.__get_client(snd_endpoint.instance())
-        mcp_message_bytes = client.receive(recv_endpoint.ref())
-        mcp_message = MPPMessage.from_bytes(mcp_message_bytes)
+    def probe_message(self, port_name: str, slot: Optional[int] = None
+                      ) -> bool:
+        """Checks whether a message is available on a port.
 
-        if mcp_message.port_length is not None:
-            if port.is_resizable():
-                port.set_length(mcp_message.port_length)
+        The first call for a given slot starts fetching its messages
+        in the background, like prefetching does, so that later calls
+        can tell whether the next one has arrived without blocking.
 
-        if isinstance(mcp_message.data, ClosePort):
-            port.set_closed(slot)
+        Args:
+            port_name: The port to check.
+            slot: The slot to check, if any.
 
-        message = Message(
-                mcp_message.timestamp, mcp_message.next_timestamp,
-                mcp_message.data, mcp_message.settings_overlay)
+        Returns:
+            True iff a subsequent receive_message() will not block.
 
-        profile_event.stop()
-        if port.is_vector():
-            profile_event.port_length = port.get_length()
-        profile_event.message_size = len(mcp_message_bytes)
+        Raises:
+            RuntimeError: If the port is not connected.
+        """
+        if self.__get_link(port_name, slot) is None:
+            raise RuntimeError(('Tried to probe port "{}", which is'
+                                ' disconnected. Please connect a sending'
+                                ' component to this port.'
+                                ).format(port_name))
 
-        if slot is None:
-            _logger.debug('Received message on {}'.format(port_name))
-            if isinstance(mcp_message.data, ClosePort):
-                _logger.debug('Port {} is now closed'.format(port_name))
+        return self.__get_source(port_name, slot).available()
+
+    def receive_message_async(
+            self, port_name: str, slot: Optional[int] = None,
+            default: Optional[Message] = None) -> 'Future[Message]':
+        """Receive a message in the background.
+
+        This works like receive_message(), except that it returns
+        immediately with a Future, which will hold the message once it
+        has been received. Messages are fetched on a separate
+        connection per slot, like prefetching does, and receives on
+        the same slot complete in order.
+
+        Do not call receive_message() on the same slot while the
+        Future is not done yet.
+
+        Args:
+            port_name: The endpoint on which a message is to be
+                    received.
+            slot: The slot to receive the message on, if any.
+            default: A message to return if this port is not connected.
+
+        Returns:
+            A Future producing the received message, with
+            message.settings holding the settings overlay.
+
+        Raises:
+            RuntimeError: If no default was given and the port is not
+                connected.
+        """
+        link = self.__get_link(port_name, slot)
+        if link is None:
+            future = Future()   # type: Future[Message]
+            future.set_result(
+                    self.receive_message(port_name, slot, default))
+            return future
+
+        port = self._ports.get(port_name, self._muscle_settings_in)
+        self.__get_source(port_name, slot)
+
+        key = (port_name, slot)
+        if key not in self._async_receivers:
+            self._async_receivers[key] = ThreadPoolExecutor(max_workers=1)
+
+        profile_start = self._profiler.start()
+        return self._async_receivers[key].submit(
+                self.__receive, port_name, port, slot, link, profile_start)
+
+    def receive_messages(
+            self, slots: List[Tuple[str, Optional[int]]],
+            callback: Optional[
+                Callable[[Tuple[str, Optional[int]], Message], None]] = None
+            ) -> Dict[Tuple[str, Optional[int]], Message]:
+        """Receive one message on each of several port slots.
+
+        This works like calling receive_message() for each slot in
+        turn, except that slots connected to different instances are
+        received concurrently, so that we wait for the slowest sender
+        rather than for each sender in turn. Slots connected to the
+        same instance are received one after the other over the
+        existing connection to it.
+
+        The threads used for this are stopped before this function
+        returns, so unlike receive_message_async(), this does not
+        leave any background receivers behind.
+
+        If a callback is given, then it is called with the port and
+        slot and the message as soon as each message has arrived, from
+        the thread that received it. That way, the messages that did
+        arrive are not lost if receiving another one fails.
+
+        Args:
+            slots: The ports and slots to receive on. All of them must
+                    be connected.
+            callback: A function to pass each message to on arrival.
+
+        Returns:
+            The received messages, by port and slot.
+
+        Raises:
+            RuntimeError: If one of the ports is not connected.
+        """
+        by_peer = dict(
+                )   # type: Dict[Reference, List[Tuple[str, Optional[int]]]]
+        for port_name, slot in slots:
+            link = self.__get_link(port_name, slot)
+            if link is None:
+                self.receive_message(port_name, slot)
+                continue
+            # connect here, so that the threads below don't race to do it
+            inbox = self.__get_inbox(link.peer_instance, link.ref)
+            if inbox is None and port_name not in self._prefetch_ports:
+                self.__get_client(link.peer_instance)
+            by_peer.setdefault(link.peer_instance, []).append(
+                    (port_name, slot))
+
+        def receive_from_peer(peer_slots: List[Tuple[str, Optional[int]]]
+                              ) -> List[Message]:
+            messages = list()   # type: List[Message]
+            for slot in peer_slots:
+                messages.append(self.receive_message(*slot))
+                if callback is not None:
+                    callback(slot, messages[-1])
+            return messages
+
+        groups = list(by_peer.values())
+        if len(groups) <= 1:
+            received = [receive_from_peer(group) for group in groups]
         else:
-            _logger.debug('Received message on {}[{}]'.format(port_name, slot))
-            if isinstance(mcp_message.data, ClosePort):
-                _logger.debug('Port {}[{}] is now closed'.format(
-                    port_name, slot))
+            workers = min(len(groups), _MAX_RECEIVE_THREADS)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                received = list(pool.map(receive_from_peer, groups))
+
+        return {
+                slot: message
+                for peer_slots, messages in zip(groups, received)
+                for slot, message in zip(peer_slots, messages)}
+
+    def receive_any_message(self, port_name: str) -> Tuple[int, Message]:
+        """Receive the first message to arrive on any slot of a port.
+
+        This requests the next message on each open slot of the given
+        vector port in the background, like prefetching does, and
+        returns the first one to arrive, so that a slow sender does
+        not hold up messages from the others. Slots that receive from
+        the same peer share a single connection to it, if the peer
+        supports this. Slots that receive push delivery are watched
+        through their Inbox instead.
+
+        Slots are watched from the first call on, so any messages
+        received on them using receive_message() are fetched in the
+        background as well.
 
-        return message
+        Args:
+            port_name: The vector port to receive on.
+
+        Returns:
+            The slot the message was received on, and the message, with
+            message.settings holding the settings overlay.
+
+        Raises:
+            RuntimeError: If the port is not a connected vector port,
+                or if all its slots are closed.
+        """
+        _logger.debug('Waiting for message on any slot of {}'.format(
+            port_name))
+
+        link = self.__get_link(port_name, 0)
+        port = self._ports.get(port_name)
+        if port is None or not port.is_vector():
+            raise RuntimeError(('Tried to receive on any slot of port "{}",'
+                                ' which is not a vector port.'
+                                ).format(port_name))
+        if link is None:
+            raise RuntimeError(('Tried to receive on any slot of port "{}",'
+                                ' which is disconnected. Please connect a'
+                                ' sending component to this port.'
+                                ).format(port_name))
+
+        profile_start = self._profiler.start()
+
+        if port_name not in self._ready_slots:
+            self._ready_slots[port_name] = Queue()
+        ready = self._ready_slots[port_name]
+
+        open_slots = [
+                slot for slot in range(port.get_length())
+                if port.is_open(slot)]
+        if not open_slots:
+            raise RuntimeError(('Tried to receive on any slot of port "{}",'
+                                ' but all of its slots are closed.'
+                                ).format(port_name))
+
+        self.__watch_slots(port_name, open_slots, ready)
+
+        while True:
+            # messages received using receive_message() leave stale
+            # entries behind, so check that there's really one there
+            slot = ready.get()
+            if port.is_open(slot) and self._watched[(port_name, slot)
+                                                    ].available():
+                break
+
+        link = cast(_Link, self.__get_link(port_name, slot))
+        return slot, self.__receive(
+                port_name, port, slot, link, profile_start)
 
     def close_port(self, port_name: str, slot: Optional[int] = None
                    ) -> None:
@@ -344,6 +756,19 @@ class Communicator:
     def shutdown(self) -> None:
         """Shuts down the Communicator, closing connections.
         """
+        self.set_async_send(False)
+
+        for inbox in self._inboxes.values():
+            if inbox is not None:
+                inbox.close()
+
+        for prefetcher in self._prefetchers.values():
+            prefetcher.close()
+
+        # any receives still waiting fail now that their source is closed
+        for executor in self._async_receivers.values():
+            executor.shutdown()
+
         for client in self._clients.values():
             client.close()
 
@@ -443,10 +868,286 @@ class Communicator:
         if instance not in self._clients:
             locations = self._peer_manager.get_peer_locations(instance)
             _logger.info(f'Connecting to peer {instance} at {locations}')
-            self._clients[instance] = MPPClient(locations)
+            self._clients[instance] = MPPClient(locations, self._overlays)
 
         return self._clients[instance]
 
+    def __receive(
+            self, port_name: str, port: Port, slot: Optional[int],
+            link: _Link, profile_start: float) -> Message:
+        """Receives a message on a connected port.
+
+        This implements the part of receive_message() and
+        receive_any_message() after the slot has been chosen.
+
+        Args:
+            port_name: The port to receive on.
+            port: The corresponding Port object.
+            slot: The slot to receive on, if any.
+            link: The corresponding addresses.
+            profile_start: When we started receiving.
+
+        Returns:
+            The received message.
+        """
+        mcp_message, message_size = self.__fetch_message(
+                port_name, slot, link.peer_instance, link.ref)
+
+        if mcp_message.port_length is not None:
+            if port.is_resizable():
+                port.set_length(mcp_message.port_length)
+
+        if isinstance(mcp_message.data, ClosePort):
+            port.set_closed(slot)
+
+        message = Message(
+                mcp_message.timestamp, mcp_message.next_timestamp,
+                mcp_message.data, mcp_message.settings_overlay)
+
+        self._profiler.record(
+                ProfileEventType.RECEIVE, profile_start, port,
+                port.get_length() if port.is_vector() else None, slot,
+                message_size)
+
+        if slot is None:
+            _logger.debug('Received message on {}'.format(port_name))
+            if isinstance(mcp_message.data, ClosePort):
+                _logger.debug('Port {} is now closed'.format(port_name))
+        else:
+            _logger.debug('Received message on {}[{}]'.format(port_name, slot))
+            if isinstance(mcp_message.data, ClosePort):
+                _logger.debug('Port {}[{}] is now closed'.format(
+                    port_name, slot))
+
+        return message
+
+    def __in_order(self, function: Callable[..., None], *args: Any
+                   ) -> None:
+        """Calls a function now, or in the background if sending async.
+
+        Functions passed to this are called in order, see
+        set_async_send().
+
+        Args:
+            function: The function to call.
+            args: Arguments to pass to it.
+        """
+        if self._sender is None:
+            function(*args)
+            return
+
+        while self._pending_sends and self._pending_sends[0].done():
+            # raises any errors, so that they don't go unnoticed
+            self._pending_sends.popleft().result()
+        self._pending_sends.append(self._sender.submit(function, *args))
+
+    def __deposit(
+            self, port: Port, port_length: Optional[int],
+            slot: Optional[int], link: _Link, mcp_message: MPPMessage,
+            profile_start: float) -> None:
+        """Encodes a message and puts it into the outbox.
+
+        Args:
+            port: The port it is sent on.
+            port_length: Its length, if it is a vector port.
+            slot: The slot it is sent on, if any.
+            link: The addresses of the slot.
+            mcp_message: The message to send.
+            profile_start: When we started sending.
+        """
+        encoded_message = next(mcp_message.encoded_frames([(
+            link.ref_str, link.peer_ref_str, mcp_message.port_length)]))
+        self._post_office.deposit(
+                mcp_message.receiver, encoded_message, str(port.name))
+        self._profiler.record(
+                ProfileEventType.SEND, profile_start, port, port_length,
+                slot, encoded_message.size, self._post_office.size())
+
+    def __deposit_all(
+            self, port: Port, port_length: int, links: List[_Link],
+            mcp_message: MPPMessage, profile_start: float) -> None:
+        """Encodes a message to all slots and puts it into the outboxes.
+
+        Args:
+            port: The vector port it is sent on.
+            port_length: Its length.
+            links: The addresses of each slot.
+            mcp_message: The message to send.
+            profile_start: When we started sending.
+        """
+        port_name = str(port.name)
+        encoded_messages = mcp_message.encoded_frames(
+                (link.ref_str, link.peer_ref_str, mcp_message.port_length)
+                for link in links)
+        for slot, encoded_message in enumerate(encoded_messages):
+            self._post_office.deposit(
+                    links[slot].peer_ref, encoded_message, port_name)
+            self._profiler.record(
+                    ProfileEventType.SEND, profile_start, port, port_length,
+                    slot, encoded_message.size, self._post_office.size())
+            profile_start = self._profiler.start()
+
+    def __watch_slots(
+            self, port_name: str, slots: List[int], ready: 'Queue[int]'
+            ) -> None:
+        """Makes sure that slots' messages are fetched in the background.
+
+        The slot number is put into the given queue once for every
+        message that arrives on it.
+
+        Slots that are not fetched from in the background yet and that
+        receive from the same peer get a MultiPrefetcher if the peer
+        supports it, so that they share one connection and thread.
+
+        Args:
+            port_name: The receiving port.
+            slots: The receiving slots.
+            ready: The queue to put the slot numbers into.
+        """
+        slots = [
+                slot for slot in slots
+                if (port_name, slot) not in self._watched]
+
+        receivers = dict()  # type: Dict[Reference, List[Reference]]
+        for slot in slots:
+            link = cast(_Link, self.__get_link(port_name, slot))
+            if link.ref in self._prefetchers:
+                continue
+            if self.__get_inbox(link.peer_instance, link.ref) is None:
+                receivers.setdefault(link.peer_instance, []).append(link.ref)
+
+        for instance, peer_receivers in receivers.items():
+            if len(peer_receivers) < 2:
+                continue
+            if not self.__get_client(instance).supports(MPPFeature.ANY):
+                continue
+            locations = self._peer_manager.get_peer_locations(instance)
+            _logger.debug(f'Fetching from {len(peer_receivers)} slots of'
+                          f' {port_name} at {instance}')
+            prefetcher = MultiPrefetcher(MPPClient(locations), peer_receivers)
+            for receiver in peer_receivers:
+                self._prefetchers[receiver] = prefetcher.endpoint(receiver)
+
+        for slot in slots:
+            source = self.__get_source(port_name, slot)
+            source.notify(partial(ready.put, slot))
+            self._watched[(port_name, slot)] = source
+
+    def __get_source(self, port_name: str, slot: Optional[int]) -> _Source:
+        """Get or create a background receiver for a slot.
+
+        This returns the Inbox of the slot's receiving endpoint if it
+        uses push delivery, its PrefetchedEndpoint if it has one, or a
+        Prefetcher otherwise, creating one if needed.
+
+        Args:
+            port_name: The receiving port.
+            slot: The receiving slot, if any.
+
+        Returns:
+            An Inbox, PrefetchedEndpoint or Prefetcher receiving the
+            slot's messages.
+        """
+        link = cast(_Link, self.__get_link(port_name, slot))
+        instance = link.peer_instance
+        receiver = link.ref
+
+        source = self.__get_inbox(
+                instance, receiver)   # type: Optional[_Source]
+        if source is None:
+            if receiver not in self._prefetchers:
+                locations = self._peer_manager.get_peer_locations(instance)
+                self._prefetchers[receiver] = Prefetcher(
+                        MPPClient(locations, self._overlays), receiver)
+            source = self._prefetchers[receiver]
+        return source
+
+    def __fetch_message(
+            self, port_name: str, slot: Optional[int], instance: Reference,
+            receiver: Reference) -> Tuple[MPPMessage, int]:
+        """Gets the next message for a receiving endpoint.
+
+        This gets it from an Inbox or Prefetcher if we have one, or
+        requests it from the sending instance otherwise.
+
+        Args:
+            port_name: The receiving port.
+            slot: The receiving slot, if any.
+            instance: The sending instance.
+            receiver: The receiving endpoint.
+
+        Returns:
+            The message and its size in bytes.
+        """
+        destination = self._receive_buffers.get((port_name, slot))
+
+        inbox = self.__get_inbox(instance, receiver)
+        if inbox is not None:
+            mcp_message, message_size = inbox.retrieve()
+            return mcp_message.store_into(destination), message_size
+
+        if port_name in self._prefetch_ports:
+            if receiver not in self._prefetchers:
+                locations = self._peer_manager.get_peer_locations(instance)
+                self._prefetchers[receiver] = Prefetcher(
+                        MPPClient(locations, self._overlays), receiver)
+
+        if receiver in self._prefetchers:
+            mcp_message, message_size = self._prefetchers[receiver].retrieve()
+            return mcp_message.store_into(destination), message_size
+
+        return self.__get_client(instance).receive_into(receiver, destination)
+
+    def __get_inbox(self, instance: Reference, receiver: Reference
+                    ) -> Optional[Inbox]:
+        """Get or create an inbox for a receiving endpoint.
+
+        Args:
+            instance: The sending instance.
+            receiver: The receiving endpoint.
+
+        Returns:
+            An Inbox, or None if push delivery is disabled or the
+            sender does not support it.
+        """
+        if receiver not in self._inboxes:
+            if not self._push_delivery:
+                return None
+
+            inbox = None
+            if self.__get_client(instance).supports(MPPFeature.PUSH):
+                locations = self._peer_manager.get_peer_locations(instance)
+                _logger.debug(f'Subscribing to {receiver} at {instance}')
+                inbox = Inbox(MPPClient(locations, self._overlays), receiver)
+            self._inboxes[receiver] = inbox
+
+        return self._inboxes[receiver]
+
+    def __get_link(self, port_name: str, slot: Optional[int]
+                   ) -> Optional[_Link]:
+        """Get the addresses for sending or receiving on a port slot.
+
+        These are worked out the first time they are needed, and kept
+        until we are connected again.
+
+        Args:
+            port_name: Name of the port to send or receive on.
+            slot: Slot to send or receive on, if any.
+
+        Returns:
+            The addresses, or None if the port is not connected.
+        """
+        key = (port_name, slot)
+        if key not in self._links:
+            slot_list = [] if slot is None else [slot]
+            endpoint = self.__get_endpoint(port_name, slot_list)
+            link = None     # type: Optional[_Link]
+            if self._peer_manager.is_connected(endpoint.port):
+                link = _Link(endpoint, self._peer_manager.get_peer_endpoint(
+                    endpoint.port, slot_list))
+            self._links[key] = link
+        return self._links[key]
+
     def __get_endpoint(self, port_name: str, slot: List[int]) -> Endpoint:
         """Determines the endpoint on our side.
 
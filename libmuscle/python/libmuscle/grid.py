@@ -9,10 +9,12 @@ class Grid:
     Note that for received grids, the array of data is a read-only
     NumPy array. If you have another array that you want to put the
     received data into, use ``np.copyto(dest, source)`` to copy the
-    contents of the received array across into your destination array.
-    If you don't have an array yet and want a writable version of the
-    received array, use ``array.copy()`` to create a writable copy.
-    See the tutorial for examples.
+    contents of the received array across into your destination array,
+    or register it with :meth:`libmuscle.Instance.set_receive_buffer`
+    to have MUSCLE3 receive directly into it. If you don't have an
+    array yet and want a writable version of the received array, use
+    ``array.copy()`` to create a writable copy. See the tutorial for
+    examples.
 
     Attributes:
         array (np.ndarray): An array of data
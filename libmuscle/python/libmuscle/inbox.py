@@ -0,0 +1,125 @@
+from queue import Queue
+from threading import Lock, Thread
+from typing import Callable, Optional, Tuple, Union  # noqa
+
+from ymmsl import Reference
+
+from libmuscle.mpp_client import MPPClient
+from libmuscle.mpp_message import MPPMessage
+
+
+_Item = Union[Tuple[MPPMessage, int], Exception]
+
+
+class MessageQueue:
+    """Stores messages received in the background, until they're received.
+
+    This is the part of an Inbox that holds the messages for a single
+    receiving endpoint. Filling it is up to the subclass.
+    """
+    def __init__(self) -> None:
+        """Create an empty MessageQueue.
+        """
+        self._queue = Queue()   # type: Queue[_Item]
+        self._lock = Lock()
+        self._callback = None  # type: Optional[Callable[[], None]]
+
+    def notify(self, callback: Callable[[], None]) -> None:
+        """Calls a function whenever a message arrives.
+
+        The callback is called once for each message that is already
+        in the queue right away, and once for each new message in the
+        background thread after that.
+
+        Args:
+            callback: The function to call.
+        """
+        with self._lock:
+            self._callback = callback
+            waiting = self._queue.qsize()
+        for _ in range(waiting):
+            callback()
+
+    def available(self) -> bool:
+        """Returns whether retrieve() will return without blocking.
+        """
+        return not self._queue.empty()
+
+    def retrieve(self) -> Tuple[MPPMessage, int]:
+        """Retrieve the next message from the queue.
+
+        Blocks until a message is available.
+
+        Returns:
+            The next message, and its size in bytes.
+
+        Raises:
+            RuntimeError: If the connection to the peer failed.
+        """
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            # make sure any later calls fail as well
+            self._queue.put(item)
+            raise RuntimeError(
+                    'Lost connection to the sending peer') from item
+        return item
+
+    def _put(self, item: _Item) -> None:
+        """Adds an item to the queue and calls the callback, if any.
+        """
+        with self._lock:
+            self._queue.put(item)
+            callback = self._callback
+        if callback is not None:
+            callback()
+
+
+class Inbox(MessageQueue):
+    """Stores messages pushed to us by a peer, until they're received.
+
+    An Inbox has its own connection to the sending peer, on which it
+    subscribes to the messages for one of our receiving endpoints. A
+    background thread receives them as soon as they are sent, so that
+    they are available locally when the receiver asks for them.
+    """
+    def __init__(self, client: MPPClient, receiver: Reference) -> None:
+        """Create an Inbox and start receiving.
+
+        Args:
+            client: A client connected to the sending peer, which
+                    supports push delivery. The Inbox takes ownership.
+            receiver: The receiving endpoint to subscribe to.
+        """
+        super().__init__()
+        self._client = client
+        self._closing = False
+        self._thread = Thread(
+                target=self._receive, args=(receiver,), daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Closes the connection to the peer.
+
+        Any messages that have not been received yet are lost.
+        """
+        self._closing = True
+        self._client.close()
+        self._thread.join()
+        # wake up anyone still waiting in retrieve()
+        self._put(ConnectionAbortedError('The Inbox was closed'))
+
+    def _receive(self, receiver: Reference) -> None:
+        """Receives messages into the queue.
+
+        This runs in a background thread, until a ClosePort message
+        was received or the Inbox is closed.
+
+        Args:
+            receiver: The receiving endpoint to subscribe to.
+        """
+        try:
+            for item in self._client.subscribe(receiver):
+                self._put(item)
+        except Exception as e:
+            if not self._closing:
+                self._put(e)
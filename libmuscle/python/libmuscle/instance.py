@@ -1,9 +1,13 @@
+from concurrent.futures import Future
 from copy import copy
+from functools import partial
 import logging
 import os
+from pathlib import Path
 import sys
-from typing import cast, Dict, List, Optional, Tuple
+from typing import Any, cast, Dict, List, Optional, Tuple
 
+import numpy as np
 from ymmsl import (Identifier, Operator, SettingValue, Port, Reference,
                    Settings)
 
@@ -72,6 +76,11 @@ class Instance:
         self._connect()
         self._set_local_log_level()
         self._set_remote_log_level()
+        self._set_push_delivery()
+        self._set_prefetch_ports()
+        self._set_async_send()
+        self._set_outbox_limits()
+        self._set_profiling()
 
     def reuse_instance(self, apply_overlay: bool = True) -> bool:
         """Decide whether to run this instance again.
@@ -106,6 +115,15 @@ class Instance:
                 did need to specify False, MUSCLE3 will tell you about
                 it in an error message and you can add it still.
         """
+        # messages sent in the background must be on their way before
+        # the user can change the data they refer to
+        try:
+            self._communicator.flush()
+        except Exception as e:
+            err_msg = 'Error sending a message: {}'.format(e)
+            self.__shutdown(err_msg)
+            raise
+
         do_reuse = self.__receive_settings()
 
         # TODO: _f_init_cache should be empty here, or the user didn't
@@ -178,6 +196,28 @@ class Instance:
         return self._settings_manager.get_setting(
                 self._instance_name(), Reference(name), typ)
 
+    def get_settings(self, prefix: Optional[str] = None) -> Settings:
+        """Returns the values of all model settings.
+
+        This returns the value that :meth:`get_setting` would return
+        for each setting, in a single call. For example, if the
+        configuration sets ``micro.solver.tol`` and
+        ``solver.max_iter``, then for the ``micro`` instance
+        ``get_settings('solver')`` returns a Settings object with
+        ``solver.tol`` and ``solver.max_iter``.
+
+        Args:
+            prefix: If given, return only settings whose names start
+                    with this, e.g. ``solver`` for ``solver.tol``.
+
+        Returns:
+            A new Settings object holding the values, by setting name
+            without any instance prefix.
+        """
+        prefix_ref = None if prefix is None else Reference(prefix)
+        return self._settings_manager.get_settings(
+                self._instance_name(), prefix_ref)
+
     def list_ports(self) -> Dict[Operator, List[str]]:
         """Returns a description of the ports that this CE has.
 
@@ -262,6 +302,33 @@ class Instance:
         """
         self._communicator.get_port(port).set_length(length)
 
+    def set_receive_buffer(
+            self, port_name: str, array: Optional[np.ndarray],
+            slot: Optional[int] = None) -> None:
+        """Receive grids on a port directly into an existing array.
+
+        Normally, received grids contain a new, read-only array, which
+        you then copy into your model's state. If you receive the same
+        kind of grid every time, then you can register your state array
+        here instead, and MUSCLE3 will store received data directly
+        into it, without allocating any new memory.
+
+        This applies to messages whose data is a single grid or array
+        with the same data type and shape as the given array. The
+        ``data`` attribute of the received message will then be a
+        :class:`Grid` with the given array, which is overwritten with
+        each message received on this port. Other messages are received
+        as usual.
+
+        Args:
+            port_name: The port to receive on.
+            array: A writable array to receive into, or None to go back
+                    to receiving into new arrays.
+            slot: The slot to receive on, if any.
+        """
+        self.__check_port(port_name)
+        self._communicator.set_receive_buffer(port_name, slot, array)
+
     def send(self, port_name: str, message: Message,
              slot: Optional[int] = None) -> None:
         """Send a message to the outside world.
@@ -269,6 +336,14 @@ class Instance:
         Sending is non-blocking, a copy of the message will be made
         and stored until the receiver is ready to receive it.
 
+        If the ``muscle_async_send`` setting is True, then the message
+        is encoded in a background thread instead, so that this returns
+        immediately, and messages are sent in the order in which this
+        function was called. In that case, no copy is made when this
+        returns, only a reference to the data is kept, so the data in
+        the message must not be changed until the next call to
+        :meth:`reuse_instance`, which waits for it to have been sent.
+
         Args:
             port_name: The port on which this message is to be sent.
             message: The message to be sent.
@@ -281,6 +356,28 @@ class Instance:
 
         self._communicator.send_message(port_name, message, slot)
 
+    def send_all(self, port_name: str, message: Message) -> None:
+        """Send a message to all slots of a vector port.
+
+        This sends the same message on every slot of the port. It is
+        equivalent to calling :meth:`send` for each slot, but the
+        message is encoded only once, which saves a lot of time and
+        memory when sending large data to many receivers.
+
+        If the port is not a vector port, this is the same as
+        :meth:`send`.
+
+        Args:
+            port_name: The port on which this message is to be sent.
+            message: The message to be sent.
+        """
+        self.__check_port(port_name)
+        if message.settings is None:
+            message = copy(message)
+            message.settings = self._settings_manager.overlay
+
+        self._communicator.broadcast_message(port_name, message)
+
     def receive(self, port_name: str, slot: Optional[int] = None,
                 default: Optional[Message] = None
                 ) -> Message:
@@ -350,34 +447,157 @@ class Instance:
         """
         return self.__receive_message(port_name, slot, default, True)
 
+    def probe(self, port_name: str, slot: Optional[int] = None) -> bool:
+        """Check whether a message is available on a port.
+
+        This does not block, so it can be used to do some other work
+        while waiting for a message, and receive it once it is there.
+        The first call for a given port and slot starts receiving
+        messages on it in the background.
+
+        Args:
+            port_name: The port to check.
+            slot: The slot to check, if any.
+
+        Returns:
+            True iff a subsequent call to :meth:`receive` on this port
+            and slot will return without waiting.
+
+        Raises:
+            RuntimeError: If the given port is not connected.
+        """
+        self.__check_port(port_name)
+
+        port = self._communicator.get_port(port_name)
+        if port.operator == Operator.F_INIT:
+            # these have all been received already by reuse_instance()
+            return (port_name, slot) in self._f_init_cache
+        return self._communicator.probe_message(port_name, slot)
+
+    def receive_async(self, port_name: str, slot: Optional[int] = None,
+                      default: Optional[Message] = None
+                      ) -> 'Future[Message]':
+        """Receive a message from the outside world in the background.
+
+        This works like :meth:`receive`, but returns immediately with a
+        :class:`concurrent.futures.Future`, so that you can do other
+        work while the message is on its way. Call its ``result()``
+        method to get the message, which will wait for it if needed.
+
+        Multiple receives on the same port and slot will complete in
+        order, but you should not call :meth:`receive` on it while the
+        Future is not done yet.
+
+        Args:
+            port_name: The endpoint on which a message is to be
+                    received.
+            slot: The slot to receive the message on, if any.
+            default: A default value to return if this port is not
+                    connected.
+
+        Returns:
+            A Future producing the received message. The settings
+            attribute of the received message will be None.
+
+        Raises:
+            RuntimeError: If the given port is not connected and no
+                    default value was given.
+        """
+        self.__check_port(port_name)
+
+        result = Future()   # type: Future[Message]
+        port = self._communicator.get_port(port_name)
+        if port.operator == Operator.F_INIT:
+            result.set_result(self.__receive_message(
+                port_name, slot, default, False))
+            return result
+
+        receiving = self._communicator.receive_message_async(
+                port_name, slot, default)
+        receiving.add_done_callback(partial(
+            self.__finish_receive_async, port_name, slot, result))
+        return result
+
+    def receive_any(self, port_name: str) -> Tuple[int, Message]:
+        """Receive the first message to arrive on any slot of a port.
+
+        Use this on a vector port to process messages in the order in
+        which they arrive, rather than in the order of the slots, so
+        that a slow peer does not hold up the others. For example, a
+        load balancer can give a new task to whichever worker finishes
+        first.
+
+        Receiving is a blocking operation. If no message is available
+        on any slot yet, then this waits for the first one to arrive.
+
+        Args:
+            port_name: The vector port to receive on.
+
+        Returns:
+            The slot that the message was received on, and the
+            message. The settings attribute of the received message
+            will be None.
+
+        Raises:
+            RuntimeError: If the given port is not a connected vector
+                    port.
+        """
+        return self.__receive_any_message(port_name, False)
+
+    def receive_any_with_settings(self, port_name: str
+                                  ) -> Tuple[int, Message]:
+        """Receive the first message to arrive, with settings overlay.
+
+        This function should not be used in submodels. It is intended
+        for use by special component that are ensemble-aware and
+        have to pass on overlay settings explicitly.
+
+        See :meth:`receive_any` for details.
+
+        Args:
+            port_name: The vector port to receive on.
+
+        Returns:
+            The slot that the message was received on, and the
+            message. The settings attribute will contain the received
+            Settings, and will not be None.
+
+        Raises:
+            RuntimeError: If the given port is not a connected vector
+                    port.
+        """
+        return self.__receive_any_message(port_name, True)
+
     def _register(self) -> None:
         """Register this instance with the manager.
         """
-        register_event = self._profiler.start(ProfileEventType.REGISTER)
+        register_start = self._profiler.start()
         locations = self._communicator.get_locations()
         port_list = self.__list_declared_ports()
         self.__manager.register_instance(self._instance_name(), locations,
                                          port_list)
-        register_event.stop()
+        self._profiler.record(ProfileEventType.REGISTER, register_start)
+        self.__manager.sync_clock()
         _logger.info('Registered with the manager')
 
     def _connect(self) -> None:
         """Connect this instance to the given peers / conduits.
         """
-        connect_event = self._profiler.start(ProfileEventType.CONNECT)
+        connect_start = self._profiler.start()
         conduits, peer_dims, peer_locations = self.__manager.request_peers(
                 self._instance_name())
         self._communicator.connect(conduits, peer_dims, peer_locations)
         self._settings_manager.base = self.__manager.get_settings()
-        connect_event.stop()
+        self._profiler.record(ProfileEventType.CONNECT, connect_start)
+        self.__manager.sync_clock()
         _logger.info('Received peer locations and base settings')
 
     def _deregister(self) -> None:
         """Deregister this instance from the manager.
         """
-        deregister_event = self._profiler.start(ProfileEventType.DEREGISTER)
+        deregister_start = self._profiler.start()
         self.__manager.deregister_instance(self._instance_name())
-        deregister_event.stop()
+        self._profiler.record(ProfileEventType.DEREGISTER, deregister_start)
         # this is the last thing we'll profile, so flush messages
         self._profiler.shutdown()
         _logger.info('Deregistered from the manager')
@@ -471,17 +691,88 @@ class Instance:
         else:
             msg = self._communicator.receive_message(
                     port_name, slot, default)
-            if port.is_connected and not port.is_open(slot):
-                err_msg = (('Port {} was closed while trying to'
-                            ' receive on it, did the peer crash?'
+            self.__check_received(port_name, slot, msg, with_settings)
+        return msg
+
+    def __receive_any_message(
+            self, port_name: str, with_settings: bool
+            ) -> Tuple[int, Message]:
+        """Receives the first message to arrive on a vector port.
+
+        This implements receive_any and receive_any_with_settings, see
+        the description of those.
+        """
+        self.__check_port(port_name)
+
+        port = self._communicator.get_port(port_name)
+        if port.operator == Operator.F_INIT:
+            # these have all been received already by reuse_instance()
+            slots = [
+                    slot for name, slot in self._f_init_cache
+                    if name == port_name and slot is not None]
+            if not slots:
+                err_msg = (('Tried to receive on any slot of port "{}",'
+                            ' but all slots have been received on'
+                            ' already. Did you forget to call'
+                            ' reuse_instance() in your reuse loop?'
                             ).format(port_name))
                 self.__shutdown(err_msg)
                 raise RuntimeError(err_msg)
-            if port.is_connected and not with_settings:
-                self.__check_compatibility(port_name, msg.settings)
-            if not with_settings:
-                msg.settings = None
-        return msg
+            slot = min(slots)
+            return slot, self.__receive_message(
+                    port_name, slot, None, with_settings)
+
+        try:
+            slot, msg = self._communicator.receive_any_message(port_name)
+        except RuntimeError as e:
+            self.__shutdown(str(e))
+            raise
+        self.__check_received(port_name, slot, msg, with_settings)
+        return slot, msg
+
+    def __finish_receive_async(
+            self, port_name: str, slot: Optional[int],
+            result: 'Future[Message]', receiving: 'Future[Message]'
+            ) -> None:
+        """Checks a message received in the background and passes it on.
+
+        This is called when receiving is done, usually in a background
+        thread.
+
+        Args:
+            port_name: The port the message was received on.
+            slot: The slot it was received on, if any.
+            result: The Future to pass the message or an error on to.
+            receiving: The Future that received the message.
+        """
+        try:
+            msg = receiving.result()
+            self.__check_received(port_name, slot, msg, False)
+        except Exception as e:
+            result.set_exception(e)
+        else:
+            result.set_result(msg)
+
+    def __check_received(
+            self, port_name: str, slot: Optional[int], msg: Message,
+            with_settings: bool) -> None:
+        """Checks a message received on a non-F_INIT port.
+
+        This shuts down if the port was closed, checks the settings
+        overlay unless with_settings is True, and removes it from the
+        message in that case.
+        """
+        port = self._communicator.get_port(port_name)
+        if port.is_connected and not port.is_open(slot):
+            err_msg = (('Port {} was closed while trying to'
+                        ' receive on it, did the peer crash?'
+                        ).format(port_name))
+            self.__shutdown(err_msg)
+            raise RuntimeError(err_msg)
+        if port.is_connected and not with_settings:
+            self.__check_compatibility(port_name, msg.settings)
+        if not with_settings:
+            msg.settings = None
 
     def __make_full_name(self
                          ) -> Tuple[Reference, List[int]]:
@@ -582,31 +873,63 @@ class Instance:
         """Receives on all ports connected to F_INIT.
 
         This receives all incoming messages on F_INIT and stores them
-        in self._f_init_cache.
+        in self._f_init_cache as they arrive. If there are several,
+        then those from different senders are received concurrently,
+        see Communicator.receive_messages(). Resizable vector ports
+        get their length from the message on slot 0, so their other
+        slots are received once that has arrived.
         """
-        def pre_receive(port_name: str, slot: Optional[int]) -> None:
-            msg = self._communicator.receive_message(port_name, slot)
-            self._f_init_cache[(port_name, slot)] = msg
+        def store(slot: Tuple[str, Optional[int]], msg: Message) -> None:
+            self._f_init_cache[slot] = msg
+
+        def pre_receive(port_name: str, slot: Optional[int], msg: Message
+                        ) -> None:
             if apply_overlay:
                 self.__apply_overlay(msg)
                 self.__check_compatibility(port_name, msg.settings)
                 msg.settings = None
 
         self._f_init_cache = dict()
+        port_names = list()     # type: List[str]
+        slots = list()      # type: List[Tuple[str, Optional[int]]]
+        resizable = list()  # type: List[str]
         ports = self._communicator.list_ports()
         for port_name in ports.get(Operator.F_INIT, []):
             _logger.debug('Pre-receiving on port {}'.format(port_name))
             port = self._communicator.get_port(port_name)
             if not port.is_connected():
                 continue
+            port_names.append(port_name)
             if not port.is_vector():
-                pre_receive(port_name, None)
+                slots.append((port_name, None))
+            elif port.is_resizable():
+                slots.append((port_name, 0))
+                resizable.append(port_name)
             else:
-                pre_receive(port_name, 0)
-                # The above receives the length, if needed, so now we can
-                # get the rest.
-                for slot in range(1, port.get_length()):
-                    pre_receive(port_name, slot)
+                slots.extend(
+                        (port_name, slot)
+                        for slot in range(port.get_length()))
+
+        self._communicator.receive_messages(slots, store)
+
+        # Slot 0 gave us the length of the resizable ports, now get the rest
+        more_slots = [
+                (port_name, slot) for port_name in resizable
+                for slot in range(
+                    1, self._communicator.get_port(port_name).get_length())
+                ]   # type: List[Tuple[str, Optional[int]]]
+        self._communicator.receive_messages(more_slots, store)
+
+        for port_name in port_names:
+            port = self._communicator.get_port(port_name)
+            if not port.is_vector():
+                pre_receive(
+                        port_name, None, self._f_init_cache[(port_name, None)])
+            else:
+                for slot in range(port.get_length()):
+                    pre_receive(
+                            port_name, slot,
+                            self._f_init_cache[(port_name, slot)])
 
     def _set_remote_log_level(self) -> None:
         """Sets the remote log level.
@@ -675,6 +998,145 @@ class Instance:
             # muscle_remote_log_level not set, do nothing and keep the default
             pass
 
+    def _set_push_delivery(self) -> None:
+        """Enables push delivery if requested.
+
+        This reads the muscle_push_delivery setting, and if it is True,
+        has senders push messages to us as soon as they are sent,
+        rather than sending them when we ask for them.
+        """
+        try:
+            enabled = cast(
+                    bool, self.get_setting('muscle_push_delivery', 'bool'))
+        except KeyError:
+            # muscle_push_delivery not set, keep the default
+            return
+
+        self._communicator.set_push_delivery(enabled)
+
+    def _set_prefetch_ports(self) -> None:
+        """Enables prefetching on ports listed in the settings.
+
+        This reads the muscle_prefetch_ports setting, which contains
+        the names of the ports to enable prefetching on, separated by
+        spaces or commas.
+        """
+        try:
+            port_names = cast(
+                    str, self.get_setting('muscle_prefetch_ports', 'str'))
+        except KeyError:
+            # muscle_prefetch_ports not set, do nothing
+            return
+
+        for port_name in port_names.replace(',', ' ').split():
+            if not self._communicator.port_exists(port_name):
+                _logger.warning(
+                        ('muscle_prefetch_ports contains {}, which is not'
+                         ' a port of this component').format(port_name))
+                continue
+            self._communicator.set_prefetch(port_name, True)
+
+    def _set_async_send(self) -> None:
+        """Enables sending in the background if requested.
+
+        This reads the muscle_async_send setting, and if it is True,
+        encodes sent messages in a background thread, so that send()
+        returns immediately. Data that has been sent must then not be
+        modified until the next call to reuse_instance().
+        """
+        try:
+            enabled = cast(
+                    bool, self.get_setting('muscle_async_send', 'bool'))
+        except KeyError:
+            # muscle_async_send not set, keep the default
+            return
+
+        self._communicator.set_async_send(enabled)
+
+    def _set_outbox_limits(self) -> None:
+        """Limits the amount of sent data waiting to be received.
+
+        This reads the muscle_outbox_limit and muscle_outbox_port_limit
+        settings, which give the maximum size in bytes of the messages
+        waiting to be received overall and per port, respectively. If
+        sending a message would exceed them, then send() waits until
+        enough messages have been received, or raises a RuntimeError if
+        muscle_outbox_full is set to 'error' rather than 'block'. If it
+        is set to 'spill', then messages that do not fit are written to
+        disk in the working directory instead, from where they are read
+        back when they are received.
+        """
+        def get(name: str, typ: str) -> Any:
+            try:
+                return self.get_setting(name, typ)
+            except KeyError:
+                return None
+
+        limit = cast(Optional[int], get('muscle_outbox_limit', 'int'))
+        port_limit = cast(
+                Optional[int], get('muscle_outbox_port_limit', 'int'))
+        when_full = cast(Optional[str], get('muscle_outbox_full', 'str'))
+
+        block = True
+        spill_dir = None    # type: Optional[Path]
+        if when_full is not None:
+            if when_full.lower() == 'error':
+                block = False
+            elif when_full.lower() == 'spill':
+                spill_dir = Path.cwd()
+            elif when_full.lower() != 'block':
+                _logger.warning(
+                    ('muscle_outbox_full is set to {}, which is not a'
+                     ' valid value. Please use BLOCK, ERROR or SPILL'
+                     ).format(when_full))
+
+        if limit is not None or port_limit is not None:
+            self._communicator.set_outbox_limits(
+                    limit, port_limit, block, spill_dir)
+
+    def _set_profiling(self) -> None:
+        """Configures the profiler from the settings.
+
+        This reads the muscle_profile_level setting, which can be
+        'none' to disable profiling, 'all' to record every event, or
+        'sampled' to record only one out of every
+        muscle_profile_sample_interval sends and receives on each port
+        and slot. Sends can only be matched to receives in the analysis
+        if the sending and receiving instances use the same interval,
+        as they do if it is set globally. Events are
+        sent to the manager every muscle_profile_flush_interval
+        seconds, or as soon as muscle_profile_batch_size of them are
+        waiting.
+        """
+        def get(name: str, typ: str, default: Any) -> Any:
+            try:
+                return self.get_setting(name, typ)
+            except KeyError:
+                return default
+
+        level = cast(str, get('muscle_profile_level', 'str', 'all'))
+        sample_interval = cast(
+                int, get('muscle_profile_sample_interval', 'int', 100))
+        flush_interval = cast(
+                float, get('muscle_profile_flush_interval', 'float', 10.0))
+        batch_size = cast(int, get('muscle_profile_batch_size', 'int', 1000))
+
+        try:
+            if level.lower() == 'none':
+                self._profiler.set_level(False)
+            elif level.lower() == 'all':
+                self._profiler.set_level(True)
+            elif level.lower() == 'sampled':
+                self._profiler.set_level(True, sample_interval)
+            else:
+                _logger.warning(
+                    ('muscle_profile_level is set to {}, which is not a'
+                     ' valid profile level. Please use one of NONE, ALL,'
+                     ' or SAMPLED').format(level))
+            self._profiler.set_flush_policy(flush_interval, batch_size)
+        except ValueError as e:
+            _logger.warning('Invalid profiling settings: {}'.format(e))
+
     def __apply_overlay(self, message: Message) -> None:
         """Sets local overlay if we don't already have one.
 
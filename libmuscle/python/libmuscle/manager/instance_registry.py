@@ -1,10 +1,13 @@
 from threading import Condition
-from typing import Dict  # noqa
+from typing import Callable, Dict  # noqa
 from typing import List
 
 from ymmsl import Port, Reference
 
 
+_Callback = Callable[[], None]
+
+
 class AlreadyRegistered(RuntimeError):
     pass
 
@@ -21,6 +24,7 @@ class InstanceRegistry:
         self._locations = dict()  # type: Dict[Reference, List[str]]
         self._ports = dict()  # type: Dict[Reference, List[Port]]
         self._startup = True
+        self._callbacks = dict()  # type: Dict[Reference, List[_Callback]]
 
     def add(self, name: Reference, locations: List[str], ports: List[Port]
             ) -> None:
@@ -43,6 +47,47 @@ class InstanceRegistry:
             self._locations[name] = locations
             self._ports[name] = ports
             self._startup = False
+            callbacks = self._callbacks.pop(name, [])
+
+        for callback in callbacks:
+            callback()
+
+    def when_registered(
+            self, name: Reference, callback: _Callback) -> None:
+        """Calls a function once an instance has been registered.
+
+        If the instance is registered already, the function is called
+        immediately. Otherwise, it is called by :meth:`add` when the
+        instance registers, on the thread that registers it.
+
+        Args:
+            name: Name of the instance to wait for.
+            callback: Function to call.
+        """
+        with self._deregistered_one:
+            if name not in self._locations:
+                self._callbacks.setdefault(name, list()).append(callback)
+                return
+
+        callback()
+
+    def cancel_when_registered(
+            self, name: Reference, callback: _Callback) -> None:
+        """Stops waiting for an instance to register.
+
+        This removes a callback added with :meth:`when_registered`, if
+        it has not been called yet.
+
+        Args:
+            name: Name of the instance that was waited for.
+            callback: The function that was passed.
+        """
+        with self._deregistered_one:
+            callbacks = self._callbacks.get(name, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self._callbacks[name]
 
     def get_locations(self, name: Reference) -> List[str]:
         """Retrieves the locations of a registered instance.
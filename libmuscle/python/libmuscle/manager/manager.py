@@ -10,6 +10,7 @@ from libmuscle.manager.instance_registry import InstanceRegistry
 from libmuscle.manager.logger import Logger
 from libmuscle.manager.mmp_server import MMPServer
 from libmuscle.manager.instance_manager import InstanceManager
+from libmuscle.manager.profile_store import ProfileStore
 from libmuscle.manager.run_dir import RunDir
 from libmuscle.manager.topology_store import TopologyStore
 
@@ -17,6 +18,20 @@ from libmuscle.manager.topology_store import TopologyStore
 _logger = logging.getLogger(__name__)
 
 
+def _unused_path(directory: Path, stem: str, suffix: str) -> Path:
+    """Returns the path of a file in directory that does not exist.
+
+    This is directory/<stem><suffix> if that does not exist, otherwise
+    a number is added to the stem to find a name that is not in use.
+    """
+    path = directory / (stem + suffix)
+    i = 1
+    while path.exists():
+        path = directory / f'{stem}_{i}{suffix}'
+        i += 1
+    return path
+
+
 class Manager:
     """The MUSCLE3 manager.
 
@@ -40,6 +55,13 @@ class Manager:
         self._run_dir = run_dir
         log_dir = self._run_dir.path if self._run_dir else Path.cwd()
         self._logger = Logger(log_dir, log_level)
+        if self._run_dir:
+            # the run dir is ours, so we replace any old database
+            self._profile_store = ProfileStore(
+                    self._run_dir.path / 'muscle_stats.sqlite', True)
+        else:
+            self._profile_store = ProfileStore(
+                    _unused_path(Path.cwd(), 'muscle_stats', '.sqlite'))
         self._topology_store = TopologyStore(configuration)
         self._instance_registry = InstanceRegistry()
 
@@ -58,7 +80,8 @@ class Manager:
             pass
 
         self._server = MMPServer(
-                self._logger, self._configuration.settings,
+                self._logger, self._profile_store,
+                self._configuration.settings,
                 self._instance_registry, self._topology_store)
 
         if self._instance_manager:
@@ -91,6 +114,7 @@ class Manager:
         """Shuts down the manager."""
         # self._server.stop()
         self._server.stop()
+        self._profile_store.close()
         self._logger.close()
 
     def wait(self) -> bool:
@@ -1,6 +1,12 @@
 import errno
+from functools import lru_cache
+import heapq
 import logging
-from typing import Any, cast, Generator, List
+from queue import Queue
+import threading
+import time
+from typing import (  # noqa
+        Any, Callable, cast, Dict, Generator, List, Optional, Tuple)
 
 import msgpack
 from ymmsl import Conduit, Identifier, Operator, Port, Reference, Settings
@@ -9,10 +15,13 @@ from libmuscle.logging import LogLevel
 from libmuscle.manager.instance_registry import (
         AlreadyRegistered, InstanceRegistry)
 from libmuscle.manager.logger import Logger
+from libmuscle.manager.profile_store import ProfileStore
 from libmuscle.manager.topology_store import TopologyStore
 from libmuscle.mcp.protocol import RequestType, ResponseType
 from libmuscle.mcp.tcp_transport_server import TcpTransportServer
-from libmuscle.mcp.transport_server import RequestHandler
+from libmuscle.mcp.transport_server import (
+        NonBlockingRequestHandler, Responder)
+from libmuscle.profiling import ProfileEvent, ProfileEventType
 from libmuscle.timestamp import Timestamp
 from libmuscle.util import generate_indices, instance_indices
 
@@ -27,7 +36,33 @@ def decode_operator(data: str) -> Operator:
 
 def decode_port(data: List[str]) -> Port:
     """Create a Port from a MsgPack-compatible value."""
-    return Port(Identifier(data[0]), decode_operator(data[1]))
+    return _decode_port(data[0], data[1])
+
+
+@lru_cache(maxsize=1024)
+def _decode_port(name: str, operator: str) -> Port:
+    """Create a Port from its name and operator.
+
+    Instances of the same component all have the same ports, so we
+    cache the results to avoid parsing them again and again.
+    """
+    return Port(Identifier(name), decode_operator(operator))
+
+
+def decode_profile_event(
+        data: List[Any], instance: Reference) -> ProfileEvent:
+    """Create a ProfileEvent from a MsgPack-compatible value.
+
+    The instance is passed separately, so that we don't need to parse
+    its name again for every event. The outbox size is optional, as
+    older clients do not send it.
+    """
+    port = decode_port(data[4]) if data[4] is not None else None
+    outbox_size = data[8] if len(data) > 8 else None
+    return ProfileEvent(
+            instance, Timestamp(data[1]), Timestamp(data[2]),
+            ProfileEventType(data[3]), port, data[5], data[6], data[7],
+            outbox_size)
 
 
 def encode_conduit(conduit: Conduit) -> List[str]:
@@ -35,11 +70,136 @@ def encode_conduit(conduit: Conduit) -> List[str]:
     return [str(conduit.sender), str(conduit.receiver)]
 
 
-class MMPRequestHandler(RequestHandler):
-    """Handles Manager requests."""
+def encode_response(response: Any) -> bytes:
+    """Encode a response to be sent to a client."""
+    return cast(bytes, msgpack.packb(response, use_bin_type=True))
+
+
+class _Timer:
+    """Calls functions after a delay.
+
+    This uses a single background thread for all the functions, which
+    is started when the first one is scheduled.
+    """
+    def __init__(self) -> None:
+        """Create a _Timer."""
+        self._cv = threading.Condition()
+        self._queue = list()    # type: List[Tuple[float, int, Callable]]
+        self._count = 0
+        self._thread = None     # type: Optional[threading.Thread]
+
+    def call_later(self, delay: float, function: Callable[[], None]) -> None:
+        """Calls a function after a delay.
+
+        Args:
+            delay: Time to wait, in seconds.
+            function: The function to call, on the background thread.
+        """
+        with self._cv:
+            deadline = time.monotonic() + delay
+            heapq.heappush(self._queue, (deadline, self._count, function))
+            self._count += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cv.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cv:
+                now = time.monotonic()
+                while not self._queue or self._queue[0][0] > now:
+                    timeout = self._queue[0][0] - now if self._queue else None
+                    self._cv.wait(timeout)
+                    now = time.monotonic()
+                _, _, function = heapq.heappop(self._queue)
+            try:
+                function()
+            except Exception:
+                _logger.exception('Error in timer callback')
+
+
+class _PeerWaiter:
+    """Waits for the peers of an instance to register.
+
+    The peers are checked in order. Each time we find one that has not
+    registered yet, we ask the registry to call us back when it does,
+    and then continue where we left off. If the time runs out first,
+    we return PENDING instead.
+    """
+    def __init__(
+            self, registry: InstanceRegistry, peers: List[Reference],
+            on_done: Callable[[Dict[str, List[str]]], None],
+            on_timeout: Callable[[Reference], None]) -> None:
+        """Create a _PeerWaiter.
+
+        Args:
+            registry: The registry to get the peers' locations from.
+            peers: The peers to wait for.
+            on_done: Called with the peer locations when they are
+                    all available.
+            on_timeout: Called with the peer we were waiting for if
+                    we time out.
+        """
+        self._registry = registry
+        self._peers = peers
+        self._on_done = on_done
+        self._on_timeout = on_timeout
+        self._next = 0
+        self._locations = dict()    # type: Dict[str, List[str]]
+        # reentrant, as when_registered() may call check() immediately
+        self._lock = threading.RLock()
+        self._finished = False
+
+    def check(self) -> None:
+        """Checks for registered peers, and finishes if they all are.
+        """
+        with self._lock:
+            if self._finished:
+                return
+
+            while self._next < len(self._peers):
+                peer = self._peers[self._next]
+                try:
+                    self._locations[str(peer)] = (
+                            self._registry.get_locations(peer))
+                except KeyError:
+                    self._registry.when_registered(peer, self.check)
+                    return
+                self._next += 1
+
+            self._finished = True
+
+        self._on_done(self._locations)
+
+    def time_out(self) -> None:
+        """Finishes with a timeout, unless we're done already.
+
+        This stops waiting for the peer we were waiting for, so that
+        the registry does not keep us around until it registers.
+        """
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            peer = self._peers[self._next]
+            self._registry.cancel_when_registered(peer, self.check)
+
+        self._on_timeout(peer)
+
+
+class MMPRequestHandler(NonBlockingRequestHandler):
+    """Handles Manager requests.
+
+    None of the requests require blocking, so they can all be handled
+    directly on the server's I/O thread. Instances asking for their
+    peers may ask us to wait until the peers are available; we then
+    respond once the last of them has registered.
+    """
     def __init__(
             self,
             logger: Logger,
+            profile_store: ProfileStore,
             settings: Settings,
             instance_registry: InstanceRegistry,
             topology_store: TopologyStore):
@@ -47,31 +207,77 @@ class MMPRequestHandler(RequestHandler):
 
         Args:
             logger: The Logger component to log messages to.
+            profile_store: The database to store profile events in.
             settings: The global settings to serve to instances.
             instance_registry: The database for instances.
             topology_store: Keeps track of how to connect things.
         """
         self._logger = logger
+        self._profile_store = profile_store
         self._settings = settings
         self._instance_registry = instance_registry
         self._topology_store = topology_store
+        self._registered = list()   # type: List[str]
+        self._timer = _Timer()
 
     def handle_request(self, request: bytes) -> bytes:
         """Handles a manager request.
 
+        This blocks if the request asks us to wait for something.
+
         Args:
             request: The encoded request
 
         Returns:
             response: An encoded response
         """
+        responses = Queue()     # type: Queue[bytes]
+        self.handle_request_async(
+                request, lambda response, last: responses.put(
+                    cast(bytes, response)))
+        self.requests_handled()
+        return responses.get()
+
+    def handle_request_async(
+            self, request: bytes, respond: Responder) -> None:
+        """Handles a manager request without blocking.
+
+        Args:
+            request: The encoded request
+            respond: Function to call with the encoded response
+        """
         req_list = msgpack.unpackb(request, raw=False)
+        response = self._handle_request(req_list, respond)
+        if response is not None:
+            respond(encode_response(response), True)
+
+    def requests_handled(self) -> None:
+        """Logs the instances registered by the handled requests.
+
+        When many instances start at the same time, their registration
+        requests arrive together, and we log them in a single message
+        rather than one line each.
+        """
+        self._log_registrations()
+
+    def _handle_request(self, req_list: List[Any], respond: Responder) -> Any:
+        """Handles a decoded manager request.
+
+        Args:
+            req_list: The request
+            respond: Function to call with the encoded response, if it
+                    is not available immediately
+
+        Returns:
+            The response, to be encoded, or None if it will be passed
+            to respond later
+        """
         req_type = req_list[0]
         req_args = req_list[1:]
         if req_type == RequestType.REGISTER_INSTANCE.value:
             response = self._register_instance(*req_args)
         elif req_type == RequestType.GET_PEERS.value:
-            response = self._get_peers(*req_args)
+            response = self._get_peers(respond, *req_args)
         elif req_type == RequestType.DEREGISTER_INSTANCE.value:
             response = self._deregister_instance(*req_args)
         elif req_type == RequestType.GET_SETTINGS.value:
@@ -80,8 +286,10 @@ class MMPRequestHandler(RequestHandler):
             response = self._submit_log_message(*req_args)
         elif req_type == RequestType.SUBMIT_PROFILE_EVENTS.value:
             response = self._submit_profile_events(*req_args)
+        elif req_type == RequestType.GET_TIME.value:
+            response = self._get_time()
 
-        return cast(bytes, msgpack.packb(response, use_bin_type=True))
+        return response
 
     def _register_instance(
             self, instance_id: str, locations: List[str],
@@ -104,7 +312,7 @@ class MMPRequestHandler(RequestHandler):
             self._instance_registry.add(
                 Reference(instance_id), locations, port_objs)
 
-            _logger.info(f'Registered instance {instance_id}')
+            self._registered.append(instance_id)
             return [ResponseType.SUCCESS.value]
         except AlreadyRegistered:
             return [
@@ -113,11 +321,21 @@ class MMPRequestHandler(RequestHandler):
                     ' registered. Did you start a non-MPI component using'
                     ' mpirun?']
 
-    def _get_peers(self, instance_id: str) -> Any:
+    def _get_peers(
+            self, respond: Responder, instance_id: str,
+            timeout: Optional[float] = None) -> Any:
         """Handle a get peers request.
 
+        If a timeout is given and not all peers have registered yet,
+        then we wait for them for at most that long, rather than
+        returning PENDING immediately. The response is then passed to
+        respond when they are all there, or when the time is up.
+
         Args:
+            respond: Function to call with the encoded response, if
+                    we're waiting
             instance_id: ID of the instance requesting peers
+            timeout: Time to wait for peers to register, in seconds
 
         Returns:
             A list containing the following values on success:
@@ -138,6 +356,8 @@ class MMPRequestHandler(RequestHandler):
 
             status (ResponseType): PENDING
             status_msg (str): A message on what we're waiting for.
+
+            Or None, if the response will be passed to respond later.
         """
         # get info from yMMSL
         instance = Reference(instance_id)
@@ -151,20 +371,36 @@ class MMPRequestHandler(RequestHandler):
         peer_dims = self._topology_store.get_peer_dimensions(component)
         mmp_dimensions = {str(name): dims for name, dims in peer_dims.items()}
 
+        def success(instance_locations: Dict[str, List[str]]) -> Any:
+            _logger.debug(f'Sent peers to {instance_id}')
+            return [
+                    ResponseType.SUCCESS.value,
+                    mmp_conduits, mmp_dimensions, instance_locations]
+
+        def pending(peer: Reference) -> Any:
+            return [
+                    ResponseType.PENDING.value,
+                    f'Waiting for component {peer}']
+
         # generate instances
+        peers = list(self._generate_peer_instances(instance))
+        if timeout is not None:
+            waiter = _PeerWaiter(
+                    self._instance_registry, peers,
+                    lambda locs: respond(encode_response(success(locs)), True),
+                    lambda peer: respond(encode_response(pending(peer)), True))
+            self._timer.call_later(timeout, waiter.time_out)
+            waiter.check()
+            return None
+
         try:
             instance_locations = {
                     str(peer): self._instance_registry.get_locations(peer)
-                    for peer in self._generate_peer_instances(instance)}
+                    for peer in peers}
         except KeyError as e:
-            return [
-                    ResponseType.PENDING.value,
-                    f'Waiting for component {e.args[0]}']
+            return pending(e.args[0])
 
-        _logger.debug(f'Sent peers to {instance_id}')
-        return [
-                ResponseType.SUCCESS.value,
-                mmp_conduits, mmp_dimensions, instance_locations]
+        return success(instance_locations)
 
     def _deregister_instance(self, instance_id: str) -> Any:
         """Handle a deregister instance request.
@@ -204,6 +440,20 @@ class MMPRequestHandler(RequestHandler):
                 ResponseType.SUCCESS.value,
                 self._settings.as_ordered_dict()]
 
+    def _get_time(self) -> Any:
+        """Handle a get time request.
+
+        Instances use this to estimate the offset between their clock
+        and ours, so that all times are recorded on the same clock.
+
+        Returns:
+            A list containing the following values:
+
+            status (ResponseType): SUCCESS
+            time (float): The current time in seconds since the epoch
+        """
+        return [ResponseType.SUCCESS.value, time.time()]
+
     def _submit_log_message(
             self, instance_id: str, timestamp: float, level: int, text: str
             ) -> Any:
@@ -227,15 +477,35 @@ class MMPRequestHandler(RequestHandler):
     def _submit_profile_events(self, events: List[List[Any]]) -> Any:
         """Handle a submit profile events request.
 
-        Not implemented yet.
+        Args:
+            events: The encoded events
 
         Returns:
             A list containing the following values on success:
 
             status (ResponseType): SUCCESS
         """
+        instances = dict()  # type: Dict[str, Reference]
+        decoded_events = list()     # type: List[ProfileEvent]
+        for event in events:
+            instance = instances.get(event[0])
+            if instance is None:
+                instance = instances[event[0]] = Reference(event[0])
+            decoded_events.append(decode_profile_event(event, instance))
+
+        self._profile_store.add_events(decoded_events)
         return [ResponseType.SUCCESS.value]
 
+    def _log_registrations(self) -> None:
+        """Logs the instances registered since the last call.
+        """
+        if len(self._registered) == 1:
+            _logger.info(f'Registered instance {self._registered[0]}')
+        elif self._registered:
+            _logger.info('Registered instances {}'.format(
+                ', '.join(self._registered)))
+        self._registered.clear()
+
     def _generate_peer_instances(
             self, instance: Reference) -> Generator[Reference, None, None]:
         """Generates the names of all peer instances of an instance.
@@ -272,6 +542,7 @@ class MMPServer:
     def __init__(
             self,
             logger: Logger,
+            profile_store: ProfileStore,
             settings: Settings,
             instance_registry: InstanceRegistry,
             topology_store: TopologyStore
@@ -280,18 +551,21 @@ class MMPServer:
 
         This starts a TCP Transport server and connects it to an
         MMPRequestHandler, which uses the given components to service
-        the requests. By default, we listen on port 9000, unless it's
+        the requests. The server handles all connections on a single
+        thread. By default, we listen on port 9000, unless it's
         not available in which case we use a random other one.
 
         Args:
             logger: Logger to send log messages to
+            profile_store: Database to store profile events in
             settings: Settings component to get settings from
             instance_registry: To register instances with and get
                 peer locations from
             topology_store: To get peers and conduits from
         """
         self._handler = MMPRequestHandler(
-                logger, settings, instance_registry, topology_store)
+                logger, profile_store, settings, instance_registry,
+                topology_store)
         try:
             self._server = TcpTransportServer(self._handler, 9000)
         except OSError as e:
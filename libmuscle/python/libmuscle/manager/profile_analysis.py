@@ -0,0 +1,403 @@
+from pathlib import Path
+import sqlite3
+from typing import List, Optional, Tuple  # noqa
+
+import numpy as np
+from ymmsl import Identifier, Model, Reference
+
+from libmuscle.profiling import ProfileEventType
+from libmuscle.util import instance_indices
+
+
+# Events as loaded from the database. Missing ports, slots and sizes
+# are encoded as -1, -1 and 0 respectively.
+EVENT_DTYPE = np.dtype([
+    ('instance', np.int32), ('type', np.int8), ('start', np.float64),
+    ('stop', np.float64), ('port', np.int32), ('slot', np.int32),
+    ('size', np.int64)])
+
+
+# Number of events to fetch from the database at once
+_FETCH_SIZE = 65536
+
+
+_SEND = ProfileEventType.SEND.value
+_RECEIVE = ProfileEventType.RECEIVE.value
+
+
+class ProfileData:
+    """Profile events from a profile database, as NumPy arrays.
+
+    Attributes:
+        instances: Instance names, indexed by instance oid.
+        port_instances: Instance oid of each port, indexed by port oid.
+        port_names: Port names, indexed by port oid.
+        events: All events, sorted by start time, as an array of
+                EVENT_DTYPE.
+    """
+    def __init__(self, db_file: Path) -> None:
+        """Load profile data from a database.
+
+        Args:
+            db_file: The database to load from.
+        """
+        conn = sqlite3.connect('file:{}?mode=ro'.format(db_file), uri=True)
+        try:
+            max_instance = conn.execute(
+                    'SELECT IFNULL(MAX(oid), 0) FROM instances').fetchone()[0]
+            self.instances = [''] * (max_instance + 1)
+            for oid, name in conn.execute('SELECT oid, name FROM instances'):
+                self.instances[oid] = name
+
+            max_port = conn.execute(
+                    'SELECT IFNULL(MAX(oid), 0) FROM ports').fetchone()[0]
+            self.port_instances = np.full(max_port + 1, -1, np.int32)
+            self.port_names = [''] * (max_port + 1)
+            for oid, instance_oid, name in conn.execute(
+                    'SELECT oid, instance_oid, name FROM ports'):
+                self.port_instances[oid] = instance_oid
+                self.port_names[oid] = name
+
+            count = conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+            cur = conn.execute(
+                    'SELECT instance_oid, event_type_oid, start_time,'
+                    '    stop_time, IFNULL(port_oid, -1), IFNULL(slot, -1),'
+                    '    IFNULL(message_size, 0)'
+                    ' FROM events ORDER BY start_time')
+            self.events = np.empty(count, EVENT_DTYPE)
+            loaded = 0
+            rows = cur.fetchmany(_FETCH_SIZE)
+            while rows:
+                self.events[loaded:loaded + len(rows)] = np.array(
+                        rows, EVENT_DTYPE)
+                loaded += len(rows)
+                rows = cur.fetchmany(_FETCH_SIZE)
+        finally:
+            conn.close()
+
+
+class InstanceTimes:
+    """Where each instance spent its time.
+
+    All attributes are arrays indexed by instance oid, in seconds.
+
+    Attributes:
+        total: Time from the start of the first to the end of the last
+                event.
+        send: Time spent sending messages.
+        receive: Time spent receiving messages, including waiting for
+                them to arrive.
+        overhead: Time spent registering, connecting and deregistering.
+        compute: The remaining time, which is spent by the model.
+    """
+    def __init__(self, data: ProfileData) -> None:
+        """Calculate times from profile data.
+
+        Args:
+            data: The data to analyse.
+        """
+        events = data.events
+        n = len(data.instances)
+        inst = events['instance']
+        duration = events['stop'] - events['start']
+
+        first = np.full(n, np.inf)
+        np.minimum.at(first, inst, events['start'])
+        last = np.full(n, -np.inf)
+        np.maximum.at(last, inst, events['stop'])
+        self.total = np.where(np.isfinite(first), last - first, 0.0)
+
+        def sum_of(event_type: int) -> np.ndarray:
+            sel = events['type'] == event_type
+            return np.bincount(inst[sel], duration[sel], n)
+
+        self.send = sum_of(_SEND)
+        self.receive = sum_of(_RECEIVE)
+        self.overhead = np.bincount(inst, duration, n) - self.send - \
+            self.receive
+        self.compute = self.total - self.send - self.receive - self.overhead
+
+
+class Conduits:
+    """Links the profile data to the model's conduits.
+
+    Send events are matched to the receive events for the same
+    messages. Messages are received in the order they were sent, so
+    the n-th message sent to a particular port and slot of an instance
+    is the n-th message received there. This also holds for sampled
+    profiles, as long as the sender and receiver used the same sample
+    interval, since the profiler samples each port and slot separately.
+
+    Attributes:
+        names: Description of each conduit, indexed by conduit number.
+        send_conduit: For each event, the number of the conduit it
+                sent on, or -1 if it is not a send event on a conduit.
+        matching_send: For each event, the index of the matching send
+                event if it is a receive event, otherwise -1.
+    """
+    def __init__(self, data: ProfileData, model: Model) -> None:
+        """Match sends and receives.
+
+        Args:
+            data: The profile data to analyse.
+            model: The model that was run.
+        """
+        events = data.events
+        self.names = [
+                '{} -> {}'.format(c.sender, c.receiver)
+                for c in model.conduits]
+        self.send_conduit = np.full(len(events), -1, np.int32)
+        self.matching_send = np.full(len(events), -1, np.int64)
+
+        port_oids = {
+                (data.instances[i], name): oid
+                for oid, (i, name) in enumerate(
+                    zip(data.port_instances, data.port_names))
+                if i >= 0}
+
+        # Channels are identified by (receiving port oid, slot)
+        sends = np.flatnonzero(events['type'] == _SEND)
+        channels, inverse = np.unique(
+                np.stack((events['port'][sends], events['slot'][sends])),
+                axis=1, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        receiving_channels = np.full((2, channels.shape[1]), -1, np.int64)
+        channel_conduits = np.full(channels.shape[1], -1, np.int32)
+        for i, (port, slot) in enumerate(channels.T):
+            sender = Reference(data.instances[data.port_instances[port]])
+            target = find_receiver(
+                    model, sender, Identifier(data.port_names[port]),
+                    int(slot) if slot >= 0 else None)
+            if target is None:
+                continue
+            receiving_port = port_oids.get((str(target[1]), str(target[2])))
+            if receiving_port is not None:
+                channel_conduits[i] = target[0]
+                receiving_channels[:, i] = (
+                        receiving_port,
+                        target[3] if target[3] is not None else -1)
+
+        self.send_conduit[sends] = channel_conduits[inverse]
+        send_keys = receiving_channels[:, inverse]
+        valid = send_keys[0] >= 0
+        sends = sends[valid]
+        send_keys = send_keys[:, valid]
+
+        receives = np.flatnonzero(events['type'] == _RECEIVE)
+        receive_keys = np.stack(
+                (events['port'][receives], events['slot'][receives]))
+
+        # Events are sorted by start time, so ranking them within each
+        # channel in order gives the sequence number of each message.
+        send_ranks, send_keys = _rank(send_keys)
+        receive_ranks, receive_keys = _rank(receive_keys)
+
+        all_keys = np.concatenate((send_keys, receive_keys), axis=1)
+        all_ranks = np.concatenate((send_ranks, receive_ranks))
+        all_events = np.concatenate((sends, receives))
+        is_receive = np.concatenate((
+            np.zeros(len(sends), bool), np.ones(len(receives), bool)))
+
+        # sort so that each send is directly followed by its receive
+        order = np.lexsort((is_receive, all_ranks, all_keys[1], all_keys[0]))
+        all_keys = all_keys[:, order]
+        all_ranks = all_ranks[order]
+        all_events = all_events[order]
+        is_receive = is_receive[order]
+
+        matched = (
+                is_receive[1:] & ~is_receive[:-1] &
+                (all_ranks[1:] == all_ranks[:-1]) &
+                np.all(all_keys[:, 1:] == all_keys[:, :-1], axis=0))
+        matched_pos = np.flatnonzero(matched)
+        self.matching_send[all_events[matched_pos + 1]] = all_events[
+                matched_pos]
+
+
+def find_receiver(
+        model: Model, sender: Reference, port: Identifier,
+        slot: Optional[int]
+        ) -> Optional[Tuple[int, Reference, Identifier, Optional[int]]]:
+    """Finds where messages sent on a port and slot arrive.
+
+    This mirrors PeerManager.get_peer_endpoint().
+
+    Args:
+        model: The model that was run.
+        sender: The sending instance.
+        port: The port that was sent on.
+        slot: The slot that was sent on, if any.
+
+    Returns:
+        The number of the conduit the message was sent on, the
+        receiving instance, the receiving port and the receiving slot,
+        or None if the port is not connected.
+    """
+    sending_port = sender.without_trailing_ints() + port
+    for i, conduit in enumerate(model.conduits):
+        if conduit.sender == sending_port:
+            break
+    else:
+        return None
+
+    receiving_component = conduit.receiving_component()
+    receiver_dims = [
+            c.multiplicity for c in model.components
+            if c.name == receiving_component][0]
+    total_index = instance_indices(sender)
+    if slot is not None:
+        total_index.append(slot)
+    receiver = receiving_component
+    for index in total_index[:len(receiver_dims)]:
+        receiver += index
+    receiver_slot = total_index[len(receiver_dims):]
+
+    return (
+            i, receiver, conduit.receiving_port(),
+            receiver_slot[0] if receiver_slot else None)
+
+
+def _rank(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Numbers items within groups with the same key.
+
+    Items keep their relative order within each group.
+
+    Args:
+        keys: Array of shape (2, n) with the key of each item.
+
+    Returns:
+        The rank of each item within its group, and the keys.
+    """
+    if keys.shape[1] == 0:
+        return np.zeros(0, np.int64), keys
+
+    order = np.lexsort((np.arange(keys.shape[1]), keys[1], keys[0]))
+    sorted_keys = keys[:, order]
+    new_group = np.ones(keys.shape[1], bool)
+    new_group[1:] = np.any(sorted_keys[:, 1:] != sorted_keys[:, :-1], axis=0)
+    group_start = np.maximum.accumulate(
+            np.where(new_group, np.arange(keys.shape[1]), 0))
+    ranks = np.empty(keys.shape[1], np.int64)
+    ranks[order] = np.arange(keys.shape[1]) - group_start
+    return ranks, keys
+
+
+class ConduitTraffic:
+    """Traffic on each conduit.
+
+    All attributes are arrays indexed by conduit number.
+
+    Attributes:
+        messages: Number of messages sent.
+        bytes: Total size of the messages sent.
+        transfer_time: Total time messages spent being transferred,
+                from the moment both sender and receiver were ready
+                until the message was received, in seconds.
+    """
+    def __init__(self, data: ProfileData, conduits: Conduits) -> None:
+        """Calculate traffic from profile data.
+
+        Args:
+            data: The profile data to analyse.
+            conduits: Conduit information for the data.
+        """
+        events = data.events
+        n = len(conduits.names)
+        sends = conduits.send_conduit >= 0
+        conduit = conduits.send_conduit[sends]
+        self.messages = np.bincount(conduit, minlength=n)
+        self.bytes = np.bincount(
+                conduit, events['size'][sends], n).astype(np.int64)
+
+        receives = np.flatnonzero(conduits.matching_send >= 0)
+        matching = conduits.matching_send[receives]
+        ready = np.maximum(
+                events['stop'][matching], events['start'][receives])
+        transfer = np.maximum(events['stop'][receives] - ready, 0.0)
+        self.transfer_time = np.bincount(
+                conduits.send_conduit[matching], transfer, n)
+
+    def throughput(self) -> np.ndarray:
+        """Returns the throughput of each conduit in bytes per second.
+
+        This is NaN if nothing was transferred.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(
+                    self.transfer_time > 0.0,
+                    self.bytes / self.transfer_time, np.nan)
+
+
+class CriticalPath:
+    """The longest chain of dependent work through the run.
+
+    This is found by walking backwards from the end of the last
+    instance to finish. Whenever the instance we're on had to wait for
+    a message, the path continues at the sender at the time it sent
+    the message, otherwise it continues on the same instance.
+
+    Attributes:
+        length: Length of the path in seconds.
+        compute: For each instance, the time it spent on the path, in
+                seconds.
+        communication: Time spent transferring messages on the path,
+                in seconds.
+        hops: Instances on the path, in order.
+    """
+    def __init__(self, data: ProfileData, conduits: Conduits) -> None:
+        """Find the critical path.
+
+        Args:
+            data: The profile data to analyse.
+            conduits: Conduit information for the data.
+        """
+        events = data.events
+        n = len(data.instances)
+        self.compute = np.zeros(n)
+        self.communication = 0.0
+        self.length = 0.0
+        self.hops = list()  # type: List[int]
+        if len(events) == 0:
+            return
+
+        inst = events['instance']
+        first = np.full(n, np.inf)
+        np.minimum.at(first, inst, events['start'])
+
+        # receives for which the receiver waited for the sender
+        receives = np.flatnonzero(conduits.matching_send >= 0)
+        senders = conduits.matching_send[receives]
+        waited = events['stop'][senders] > events['start'][receives]
+        receives = receives[waited]
+        senders = senders[waited]
+
+        # group them by instance, sorted by stop time
+        order = np.lexsort((events['stop'][receives], inst[receives]))
+        receives = receives[order]
+        senders = senders[order]
+        receive_inst = inst[receives]
+        receive_stop = events['stop'][receives]
+        bounds = np.searchsorted(receive_inst, np.arange(n + 1))
+
+        end = int(np.argmax(events['stop']))
+        current = int(inst[end])
+        t = events['stop'][end]
+        self.length = t - events['start'].min()
+        self.hops.append(current)
+
+        for _ in range(len(receives) + 1):
+            lo, hi = bounds[current], bounds[current + 1]
+            j = lo + np.searchsorted(receive_stop[lo:hi], t, 'right') - 1
+            if j < lo:
+                break
+
+            sender = senders[j]
+            self.compute[current] += t - receive_stop[j]
+            self.communication += receive_stop[j] - events['stop'][sender]
+            t = events['stop'][sender]
+            current = int(inst[sender])
+            if current != self.hops[-1]:
+                self.hops.append(current)
+
+        self.compute[current] += max(t - first[current], 0.0)
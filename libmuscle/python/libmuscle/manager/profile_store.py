@@ -0,0 +1,245 @@
+import logging
+from pathlib import Path
+from queue import Empty, Queue
+import sqlite3
+import threading
+from typing import cast, Dict, Iterable, List, Optional, Tuple  # noqa
+
+from ymmsl import Port, Reference
+
+from libmuscle.profiling import ProfileEvent, ProfileEventType
+
+
+_logger = logging.getLogger(__name__)
+
+
+_SCHEMA = [
+        'CREATE TABLE muscle3_format ('
+        '    major_version INTEGER NOT NULL,'
+        '    minor_version INTEGER NOT NULL)',
+
+        'CREATE TABLE instances ('
+        '    oid INTEGER PRIMARY KEY,'
+        '    name TEXT NOT NULL UNIQUE)',
+
+        'CREATE TABLE ports ('
+        '    oid INTEGER PRIMARY KEY,'
+        '    instance_oid INTEGER NOT NULL REFERENCES instances(oid),'
+        '    name TEXT NOT NULL,'
+        '    operator TEXT NOT NULL,'
+        '    UNIQUE (instance_oid, name))',
+
+        'CREATE TABLE event_types ('
+        '    oid INTEGER PRIMARY KEY,'
+        '    name TEXT NOT NULL UNIQUE)',
+
+        'CREATE TABLE events ('
+        '    oid INTEGER PRIMARY KEY,'
+        '    instance_oid INTEGER NOT NULL REFERENCES instances(oid),'
+        '    event_type_oid INTEGER NOT NULL REFERENCES event_types(oid),'
+        '    start_time REAL NOT NULL,'
+        '    stop_time REAL NOT NULL,'
+        '    port_oid INTEGER REFERENCES ports(oid),'
+        '    port_length INTEGER,'
+        '    slot INTEGER,'
+        '    message_size INTEGER,'
+        '    outbox_size INTEGER)',
+
+        'CREATE INDEX events_instance_start_time'
+        '    ON events (instance_oid, start_time)',
+
+        'CREATE INDEX events_port ON events (port_oid)',
+
+        'CREATE INDEX events_event_type ON events (event_type_oid)',
+
+        'CREATE VIEW all_events AS'
+        '    SELECT'
+        '        e.oid AS oid, i.name AS instance, t.name AS type,'
+        '        e.start_time AS start_time, e.stop_time AS stop_time,'
+        '        p.name AS port, p.operator AS operator,'
+        '        e.port_length AS port_length, e.slot AS slot,'
+        '        e.message_size AS message_size,'
+        '        e.outbox_size AS outbox_size'
+        '    FROM events AS e'
+        '    JOIN instances AS i ON e.instance_oid = i.oid'
+        '    JOIN event_types AS t ON e.event_type_oid = t.oid'
+        '    LEFT JOIN ports AS p ON e.port_oid = p.oid']
+
+
+FORMAT_VERSION = (1, 1)
+
+
+class ProfileStore:
+    """The MUSCLE3 Manager profile database component.
+
+    The ProfileStore stores profile events sent by the instances into
+    an SQLite database. Events are written by a background thread in
+    large transactions, so that adding them is quick and does not
+    block the caller.
+
+    Event types are stored with their ProfileEventType value as the
+    oid, and instances and ports get an oid the first time they are
+    seen. The all_events view joins everything together for easy
+    querying.
+    """
+    def __init__(self, db_file: Path, overwrite: bool = False) -> None:
+        """Create a ProfileStore.
+
+        This creates a new database file.
+
+        Args:
+            db_file: Path of the database file to write.
+            overwrite: Whether to replace the file if it exists.
+
+        Raises:
+            FileExistsError: If the file exists and overwrite is False.
+        """
+        if db_file.exists():
+            if not overwrite:
+                raise FileExistsError(
+                        f'Profile database {db_file} already exists')
+            db_file.unlink()
+
+        self._conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        with self._conn:
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+            self._conn.execute(
+                    'INSERT INTO muscle3_format VALUES (?, ?)',
+                    FORMAT_VERSION)
+            self._conn.executemany(
+                    'INSERT INTO event_types (oid, name) VALUES (?, ?)',
+                    [(t.value, t.name) for t in ProfileEventType])
+
+        self._instances = dict()  # type: Dict[Reference, int]
+        self._ports = dict()  # type: Dict[Tuple[int, str], int]
+
+        self._queue = Queue()   # type: Queue[Optional[List[ProfileEvent]]]
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def add_events(self, events: Iterable[ProfileEvent]) -> None:
+        """Adds profile events to the database.
+
+        This returns immediately, the events are written to the
+        database in the background.
+
+        Args:
+            events: The events to add.
+        """
+        self._queue.put(list(events))
+
+    def close(self) -> None:
+        """Writes any remaining events and closes the database.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write(self) -> None:
+        """Writes events to the database as they come in.
+
+        This runs in a background thread. To keep the number of
+        transactions down, it writes all events waiting in the queue
+        in one go.
+        """
+        done = False
+        while not done:
+            batch = self._queue.get()
+            if batch is None:
+                break
+
+            events = batch
+            try:
+                while True:
+                    batch = self._queue.get_nowait()
+                    if batch is None:
+                        done = True
+                        break
+                    events.extend(batch)
+            except Empty:
+                pass
+
+            try:
+                self._store(events)
+            except Exception:
+                _logger.exception('Could not store profile events')
+                self._reload_oids()
+
+        self._conn.close()
+
+    def _store(self, events: List[ProfileEvent]) -> None:
+        """Stores a list of events in a single transaction.
+
+        Args:
+            events: The events to store.
+        """
+        with self._conn:
+            rows = [
+                    (
+                        self._instance_oid(e.instance_id),
+                        e.event_type.value,
+                        e.start_time.seconds, e.stop_time.seconds,
+                        self._port_oid(e.instance_id, e.port),
+                        e.port_length, e.slot, e.message_size,
+                        e.outbox_size)
+                    for e in events]
+
+            self._conn.executemany(
+                    'INSERT INTO events ('
+                    '    instance_oid, event_type_oid, start_time,'
+                    '    stop_time, port_oid, port_length, slot,'
+                    '    message_size, outbox_size)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def _reload_oids(self) -> None:
+        """Reloads the instance and port oids from the database.
+
+        This is needed after a transaction was rolled back, as some of
+        the oids we cached may have been rolled back with it.
+        """
+        self._instances = {
+                Reference(name): oid for oid, name in self._conn.execute(
+                    'SELECT oid, name FROM instances')}
+        self._ports = {
+                (instance_oid, name): oid
+                for oid, instance_oid, name in self._conn.execute(
+                    'SELECT oid, instance_oid, name FROM ports')}
+
+    def _instance_oid(self, instance: Reference) -> int:
+        """Returns the oid of an instance, adding it if needed.
+
+        Args:
+            instance: Name of the instance.
+        """
+        oid = self._instances.get(instance)
+        if oid is None:
+            cur = self._conn.execute(
+                    'INSERT INTO instances (name) VALUES (?)',
+                    (str(instance),))
+            oid = self._instances[instance] = cast(int, cur.lastrowid)
+        return oid
+
+    def _port_oid(
+            self, instance: Reference, port: Optional[Port]
+            ) -> Optional[int]:
+        """Returns the oid of a port, adding it if needed.
+
+        Args:
+            instance: Name of the instance the port belongs to.
+            port: The port, if any.
+        """
+        if port is None:
+            return None
+
+        instance_oid = self._instance_oid(instance)
+        key = (instance_oid, str(port.name))
+        oid = self._ports.get(key)
+        if oid is None:
+            cur = self._conn.execute(
+                    'INSERT INTO ports (instance_oid, name, operator)'
+                    ' VALUES (?, ?, ?)',
+                    (instance_oid, str(port.name), port.operator.name))
+            oid = self._ports[key] = cast(int, cur.lastrowid)
+        return oid
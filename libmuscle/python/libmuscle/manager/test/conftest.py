@@ -7,6 +7,7 @@ from ymmsl import (Component, Conduit, Configuration, Model, Reference,
 from libmuscle.manager.instance_registry import InstanceRegistry
 from libmuscle.manager.logger import Logger
 from libmuscle.manager.mmp_server import MMPRequestHandler
+from libmuscle.manager.profile_store import ProfileStore
 from libmuscle.manager.topology_store import TopologyStore
 
 
@@ -17,6 +18,13 @@ def logger(tmpdir):
     test_logger.close()
 
 
+@pytest.fixture
+def profile_store(tmpdir):
+    test_profile_store = ProfileStore(Path(str(tmpdir)) / 'test.sqlite')
+    yield test_profile_store
+    test_profile_store.close()
+
+
 @pytest.fixture
 def settings():
     return Settings()
@@ -45,9 +53,11 @@ def topology_store() -> TopologyStore:
 
 
 @pytest.fixture
-def mmp_request_handler(logger, settings, instance_registry, topology_store):
+def mmp_request_handler(
+        logger, profile_store, settings, instance_registry, topology_store):
     return MMPRequestHandler(
-            logger, settings, instance_registry, topology_store)
+            logger, profile_store, settings, instance_registry,
+            topology_store)
 
 
 @pytest.fixture
@@ -63,9 +73,11 @@ def loaded_instance_registry(instance_registry):
 
 @pytest.fixture
 def registered_mmp_request_handler(
-        logger, settings, loaded_instance_registry, topology_store):
+        logger, profile_store, settings, loaded_instance_registry,
+        topology_store):
     return MMPRequestHandler(
-            logger, settings, loaded_instance_registry, topology_store)
+            logger, profile_store, settings, loaded_instance_registry,
+            topology_store)
 
 
 @pytest.fixture
@@ -109,6 +121,8 @@ def loaded_instance_registry2():
 
 @pytest.fixture
 def registered_mmp_request_handler2(
-        logger, settings, loaded_instance_registry2, topology_store2):
+        logger, profile_store, settings, loaded_instance_registry2,
+        topology_store2):
     return MMPRequestHandler(
-            logger, settings, loaded_instance_registry2, topology_store2)
+            logger, profile_store, settings, loaded_instance_registry2,
+            topology_store2)
@@ -51,3 +51,29 @@ def test_registry_remove(registry, port):
 
     with pytest.raises(KeyError):
         registry.remove('non-existant-instance')
+
+
+def test_registry_when_registered(registry, port):
+    called = list()
+    registry.when_registered('instance1', lambda: called.append(1))
+    assert called == []
+
+    registry.add('instance1', ['tcp://localhost:6253'], [port])
+    assert called == [1]
+
+    registry.when_registered('instance1', lambda: called.append(2))
+    assert called == [1, 2]
+
+
+def test_registry_cancel_when_registered(registry, port):
+    called = list()
+
+    def callback() -> None:
+        called.append(1)
+
+    registry.when_registered('instance1', callback)
+    registry.cancel_when_registered('instance1', callback)
+    assert registry._callbacks == {}
+
+    registry.add('instance1', ['tcp://localhost:6253'], [port])
+    assert called == []
@@ -1,14 +1,20 @@
+import time
+from unittest.mock import patch
+
 import msgpack
 from ymmsl import Operator, Reference
 
 from libmuscle.logging import LogLevel
 from libmuscle.manager.mmp_server import MMPRequestHandler
 from libmuscle.mcp.protocol import RequestType, ResponseType
+from libmuscle.profiling import ProfileEventType
 
 
-def test_create_servicer(logger, settings, instance_registry,
+def test_create_servicer(logger, profile_store, settings, instance_registry,
                          topology_store):
-    MMPRequestHandler(logger, settings, instance_registry, topology_store)
+    MMPRequestHandler(
+            logger, profile_store, settings, instance_registry,
+            topology_store)
 
 
 def test_log_message(mmp_request_handler, caplog):
@@ -31,6 +37,50 @@ def test_log_message(mmp_request_handler, caplog):
     assert caplog.records[0].message == 'Testing log message'
 
 
+def test_submit_profile_events(mmp_request_handler, profile_store):
+    request = [
+            RequestType.SUBMIT_PROFILE_EVENTS.value,
+            [
+                ['test_instance', 1.0, 2.0, ProfileEventType.REGISTER.value,
+                    None, None, None, None],
+                ['test_instance', 3.0, 3.5, ProfileEventType.SEND.value,
+                    ['out', 'O_I'], 10, 3, 1000, 5000]]]
+    encoded_request = msgpack.packb(request, use_bin_type=True)
+
+    with patch.object(profile_store, 'add_events') as add_events:
+        result = mmp_request_handler.handle_request(encoded_request)
+
+    decoded_result = msgpack.unpackb(result, raw=False)
+    assert decoded_result == [ResponseType.SUCCESS.value]
+
+    events = add_events.call_args[0][0]
+    assert len(events) == 2
+    assert events[0].instance_id == 'test_instance'
+    assert events[0].event_type == ProfileEventType.REGISTER
+    assert events[0].port is None
+    assert events[1].start_time.seconds == 3.0
+    assert events[1].port.name == 'out'
+    assert events[1].port.operator == Operator.O_I
+    assert events[1].slot == 3
+    assert events[1].message_size == 1000
+    # events from older clients have no outbox size
+    assert events[0].outbox_size is None
+    assert events[1].outbox_size == 5000
+
+
+def test_get_time(mmp_request_handler):
+    request = [RequestType.GET_TIME.value]
+    encoded_request = msgpack.packb(request, use_bin_type=True)
+
+    before = time.time()
+    result = mmp_request_handler.handle_request(encoded_request)
+    after = time.time()
+    decoded_result = msgpack.unpackb(result, raw=False)
+
+    assert decoded_result[0] == ResponseType.SUCCESS.value
+    assert before <= decoded_result[1] <= after
+
+
 def test_get_settings(settings, mmp_request_handler):
     request = [RequestType.GET_SETTINGS.value]
     encoded_request = msgpack.packb(request, use_bin_type=True)
@@ -106,6 +156,32 @@ def test_double_register_instance(mmp_request_handler):
     assert 'test_instance' in decoded_result[1]
 
 
+def test_register_instances_batch(
+        mmp_request_handler, instance_registry, caplog):
+    caplog.set_level('INFO')
+    requests = [
+            msgpack.packb([
+                RequestType.REGISTER_INSTANCE.value, name,
+                ['tcp://localhost:10000'], [['test_in', 'F_INIT']]],
+                use_bin_type=True)
+            for name in ['instance1', 'instance2', 'instance1']]
+
+    results = list()
+    for request in requests:
+        mmp_request_handler.handle_request_async(
+                request, lambda response, last: results.append(response))
+    mmp_request_handler.requests_handled()
+
+    decoded_results = [msgpack.unpackb(r, raw=False) for r in results]
+    assert decoded_results[0] == [ResponseType.SUCCESS.value]
+    assert decoded_results[1] == [ResponseType.SUCCESS.value]
+    assert decoded_results[2][0] == ResponseType.ERROR.value
+    assert len(instance_registry._locations) == 2
+
+    assert caplog.records[-1].message == (
+            'Registered instances instance1, instance2')
+
+
 def test_deregister_instance(
         registered_mmp_request_handler, instance_registry):
     assert Reference('macro') in instance_registry._locations
@@ -130,6 +206,39 @@ def test_get_peers_pending(mmp_request_handler):
     assert decoded_result[0] == ResponseType.PENDING.value
 
 
+def test_get_peers_wait(mmp_request_handler, instance_registry):
+    request = [RequestType.GET_PEERS.value, 'macro', 10.0]
+    encoded_request = msgpack.packb(request, use_bin_type=True)
+
+    results = list()
+    mmp_request_handler.handle_request_async(
+            encoded_request, lambda response, last: results.append(response))
+    assert results == []
+
+    for j in range(10):
+        for i in range(10):
+            assert results == []
+            name = Reference('micro') + j + i
+            instance_registry.add(name, [f'direct:{name}'], [])
+
+    assert len(results) == 1
+    decoded_result = msgpack.unpackb(results[0], raw=False)
+    assert decoded_result[0] == ResponseType.SUCCESS.value
+    assert decoded_result[3]['micro[9][9]'] == ['direct:micro[9][9]']
+
+
+def test_get_peers_wait_timeout(mmp_request_handler, instance_registry):
+    request = [RequestType.GET_PEERS.value, 'macro', 0.1]
+    encoded_request = msgpack.packb(request, use_bin_type=True)
+
+    result = mmp_request_handler.handle_request(encoded_request)
+    decoded_result = msgpack.unpackb(result, raw=False)
+
+    assert decoded_result[0] == ResponseType.PENDING.value
+    assert 'micro[0][0]' in decoded_result[1]
+    assert instance_registry._callbacks == {}
+
+
 def test_request_peers_fanout(registered_mmp_request_handler):
     request = [RequestType.GET_PEERS.value, 'macro']
     encoded_request = msgpack.packb(request, use_bin_type=True)
@@ -0,0 +1,112 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from ymmsl import Component, Conduit, Model, Operator, Port, Reference
+
+from libmuscle.manager.profile_analysis import (
+        ConduitTraffic, Conduits, CriticalPath, InstanceTimes, ProfileData)
+from libmuscle.manager.profile_store import ProfileStore
+from libmuscle.profiling import ProfileEvent, ProfileEventType
+from libmuscle.timestamp import Timestamp
+
+
+@pytest.fixture
+def model():
+    return Model(
+            'test_model',
+            [
+                Component('macro', 'macro'),
+                Component('micro', 'micro', [2])],
+            [
+                Conduit('macro.out', 'micro.in'),
+                Conduit('micro.out', 'macro.in')])
+
+
+@pytest.fixture
+def profile_data(tmpdir):
+    db_file = Path(str(tmpdir)) / 'muscle_stats.sqlite'
+    store = ProfileStore(db_file)
+
+    def event(instance, start, stop, event_type, port=None, slot=None,
+              size=None):
+        if port is not None:
+            operator = Operator.O_I if port == 'out' else Operator.S
+            port = Port(Reference(port), operator)
+        return ProfileEvent(
+                Reference(instance), Timestamp(start), Timestamp(stop),
+                event_type, port, None, slot, size)
+
+    reg = ProfileEventType.REGISTER
+    dereg = ProfileEventType.DEREGISTER
+    send = ProfileEventType.SEND
+    recv = ProfileEventType.RECEIVE
+
+    store.add_events([
+        event('macro', 0.0, 1.0, reg),
+        event('macro', 1.0, 1.1, send, 'out', 0, 1000),
+        event('macro', 1.1, 1.2, send, 'out', 1, 1000),
+        event('macro', 1.2, 4.0, recv, 'in', 0, 500),
+        event('macro', 4.0, 4.1, recv, 'in', 1, 500),
+        event('macro', 4.1, 4.2, dereg)])
+    store.add_events([
+        event('micro[0]', 0.0, 0.5, reg),
+        event('micro[0]', 0.5, 1.15, recv, 'in', None, 1000),
+        event('micro[0]', 3.0, 3.1, send, 'out', None, 500),
+        event('micro[0]', 3.1, 3.2, dereg),
+        event('micro[1]', 0.0, 0.5, reg),
+        event('micro[1]', 0.5, 1.25, recv, 'in', None, 1000),
+        event('micro[1]', 3.5, 3.6, send, 'out', None, 500),
+        event('micro[1]', 3.6, 3.7, dereg)])
+    store.close()
+
+    return ProfileData(db_file)
+
+
+def test_profile_data(profile_data):
+    assert sorted(profile_data.instances[1:]) == [
+            'macro', 'micro[0]', 'micro[1]']
+    assert len(profile_data.events) == 14
+    assert np.all(np.diff(profile_data.events['start']) >= 0.0)
+
+
+def test_instance_times(profile_data):
+    times = InstanceTimes(profile_data)
+    macro = profile_data.instances.index('macro')
+    micro0 = profile_data.instances.index('micro[0]')
+
+    assert times.total[macro] == pytest.approx(4.2)
+    assert times.send[macro] == pytest.approx(0.2)
+    assert times.receive[macro] == pytest.approx(2.9)
+    assert times.overhead[macro] == pytest.approx(1.1)
+    assert times.compute[macro] == pytest.approx(0.0)
+
+    assert times.total[micro0] == pytest.approx(3.2)
+    assert times.compute[micro0] == pytest.approx(1.85)
+
+
+def test_conduit_traffic(profile_data, model):
+    conduits = Conduits(profile_data, model)
+    assert conduits.names == ['macro.out -> micro.in', 'micro.out -> macro.in']
+    assert np.count_nonzero(conduits.matching_send >= 0) == 4
+
+    traffic = ConduitTraffic(profile_data, conduits)
+    assert list(traffic.messages) == [2, 2]
+    assert list(traffic.bytes) == [2000, 1000]
+    assert traffic.transfer_time == pytest.approx([0.1, 1.0])
+    assert traffic.throughput() == pytest.approx([20000.0, 1000.0])
+
+
+def test_critical_path(profile_data, model):
+    conduits = Conduits(profile_data, model)
+    path = CriticalPath(profile_data, conduits)
+    macro = profile_data.instances.index('macro')
+    micro0 = profile_data.instances.index('micro[0]')
+    micro1 = profile_data.instances.index('micro[1]')
+
+    assert path.length == pytest.approx(4.2)
+    assert path.communication == pytest.approx(0.95)
+    assert path.compute[macro] == pytest.approx(1.3)
+    assert path.compute[micro0] == pytest.approx(1.95)
+    assert path.compute[micro1] == 0.0
+    assert path.hops == [macro, micro0, macro]
@@ -0,0 +1,81 @@
+from pathlib import Path
+import sqlite3
+
+import pytest
+from ymmsl import Operator, Port, Reference
+
+from libmuscle.manager.profile_store import ProfileStore
+from libmuscle.profiling import ProfileEvent, ProfileEventType
+from libmuscle.timestamp import Timestamp
+
+
+def test_create_profile_store(tmpdir):
+    db_file = Path(str(tmpdir)) / 'test.sqlite'
+    store = ProfileStore(db_file)
+    store.close()
+
+    conn = sqlite3.connect(str(db_file))
+    assert conn.execute('SELECT * FROM muscle3_format').fetchall() == [
+            (1, 1)]
+    event_types = dict(conn.execute('SELECT oid, name FROM event_types'))
+    assert event_types[ProfileEventType.SEND.value] == 'SEND'
+    assert len(event_types) == len(ProfileEventType)
+    conn.close()
+
+
+def test_existing_profile_store(tmpdir):
+    db_file = Path(str(tmpdir)) / 'test.sqlite'
+    db_file.write_text('precious')
+
+    with pytest.raises(FileExistsError):
+        ProfileStore(db_file)
+    assert db_file.read_text() == 'precious'
+
+    store = ProfileStore(db_file, True)
+    store.close()
+
+    conn = sqlite3.connect(str(db_file))
+    assert conn.execute('SELECT * FROM muscle3_format').fetchall() == [
+            (1, 1)]
+    conn.close()
+
+
+def test_add_events(tmpdir):
+    db_file = Path(str(tmpdir)) / 'test.sqlite'
+    store = ProfileStore(db_file)
+
+    instance = Reference('macro')
+    port = Port(Reference('out'), Operator.O_I)
+    store.add_events([
+        ProfileEvent(
+            instance, Timestamp(1.0), Timestamp(2.0),
+            ProfileEventType.REGISTER)])
+    store.add_events([
+        ProfileEvent(
+            instance, Timestamp(3.0), Timestamp(3.5),
+            ProfileEventType.SEND, port, 10, 3, 1000, 1000),
+        ProfileEvent(
+            Reference('micro[3]'), Timestamp(3.1), Timestamp(3.6),
+            ProfileEventType.RECEIVE,
+            Port(Reference('in'), Operator.F_INIT), None, None, 1000),
+        ProfileEvent(
+            instance, Timestamp(4.0), Timestamp(4.5),
+            ProfileEventType.SEND, port, 10, 4, 2000, 3000)])
+    store.close()
+
+    conn = sqlite3.connect(str(db_file))
+    events = conn.execute(
+            'SELECT instance, type, start_time, stop_time, port, operator,'
+            ' port_length, slot, message_size, outbox_size'
+            ' FROM all_events ORDER BY start_time').fetchall()
+    assert events == [
+            ('macro', 'REGISTER', 1.0, 2.0, None, None, None, None, None,
+                None),
+            ('macro', 'SEND', 3.0, 3.5, 'out', 'O_I', 10, 3, 1000, 1000),
+            ('micro[3]', 'RECEIVE', 3.1, 3.6, 'in', 'F_INIT', None, None,
+                1000, None),
+            ('macro', 'SEND', 4.0, 4.5, 'out', 'O_I', 10, 4, 2000, 3000)]
+
+    assert conn.execute('SELECT COUNT(*) FROM instances').fetchone() == (2,)
+    assert conn.execute('SELECT COUNT(*) FROM ports').fetchone() == (2,)
+    conn.close()
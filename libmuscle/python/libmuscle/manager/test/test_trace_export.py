@@ -0,0 +1,71 @@
+from io import StringIO
+import json
+from pathlib import Path
+
+import pytest
+from ymmsl import Component, Conduit, Model, Operator, Port, Reference
+
+from libmuscle.manager.profile_store import ProfileStore
+from libmuscle.manager.trace_export import TraceExporter
+from libmuscle.profiling import ProfileEvent, ProfileEventType
+from libmuscle.timestamp import Timestamp
+
+
+def test_trace_export(tmpdir):
+    db_file = Path(str(tmpdir)) / 'muscle_stats.sqlite'
+    store = ProfileStore(db_file)
+    out_port = Port(Reference('out'), Operator.O_I)
+    in_port = Port(Reference('in'), Operator.F_INIT)
+    store.add_events([
+        ProfileEvent(
+            Reference('macro'), Timestamp(10.0), Timestamp(10.5),
+            ProfileEventType.REGISTER),
+        ProfileEvent(
+            Reference('macro'), Timestamp(11.0), Timestamp(11.1),
+            ProfileEventType.SEND, out_port, 2, 1, 1000, 3000),
+        ProfileEvent(
+            Reference('micro[1]'), Timestamp(10.5), Timestamp(11.2),
+            ProfileEventType.RECEIVE, in_port, None, None, 1000)])
+    store.close()
+
+    model = Model(
+            'test_model',
+            [Component('macro', 'macro'), Component('micro', 'micro', [2])],
+            [Conduit('macro.out', 'micro.in')])
+
+    out = StringIO()
+    TraceExporter(db_file, model).export(out)
+    events = json.loads(out.getvalue())['traceEvents']
+
+    names = {
+            e['tid']: e['args']['name'] for e in events
+            if e['name'] == 'thread_name'}
+    assert sorted(names.values()) == ['macro', 'micro[1]']
+
+    slices = [e for e in events if e['ph'] == 'X']
+    assert len(slices) == 3
+    send = [s for s in slices if s['cat'] == 'SEND'][0]
+    assert names[send['tid']] == 'macro'
+    assert send['name'] == 'SEND out[1]'
+    assert send['ts'] == pytest.approx(1000000.0)
+    assert send['dur'] == pytest.approx(100000.0)
+    assert send['args']['message_size'] == 1000
+
+    counters = [e for e in events if e['ph'] == 'C']
+    assert len(counters) == 1
+    assert counters[0]['name'] == 'outbox macro'
+    assert counters[0]['ts'] == pytest.approx(1100000.0)
+    assert counters[0]['args']['bytes'] == 3000
+
+    flow_start = [e for e in events if e['ph'] == 's']
+    flow_end = [e for e in events if e['ph'] == 'f']
+    assert len(flow_start) == 1
+    assert len(flow_end) == 1
+    assert flow_start[0]['id'] == flow_end[0]['id']
+    assert names[flow_start[0]['tid']] == 'macro'
+    assert names[flow_end[0]['tid']] == 'micro[1]'
+
+    out = StringIO()
+    TraceExporter(db_file, None).export(out)
+    events = json.loads(out.getvalue())['traceEvents']
+    assert not [e for e in events if e['ph'] in ('s', 'f')]
@@ -0,0 +1,196 @@
+import json
+from pathlib import Path
+import sqlite3
+from typing import Any, cast, Dict, List, Optional, TextIO, Tuple  # noqa
+
+from ymmsl import Identifier, Model, Reference
+
+from libmuscle.manager.profile_analysis import find_receiver
+from libmuscle.profiling import ProfileEventType
+
+
+_Channel = Tuple[str, str, Optional[int]]
+
+
+class TraceExporter:
+    """Converts a profile database to a Chrome trace.
+
+    The output is a JSON file in the Trace Event Format, which can be
+    viewed in Perfetto (https://ui.perfetto.dev) or in Chrome's
+    about:tracing. Each instance is shown as a separate track, and if
+    the model is known, each message is drawn as an arrow from the
+    SEND event to the corresponding RECEIVE event.
+
+    Events are read from the database and written out one at a time,
+    so that memory use does not grow with the size of the database.
+    Sends and receives are matched by counting messages per channel,
+    since messages on a channel arrive in the order they were sent.
+    This also works for sampled profiles, as long as the sender and
+    receiver used the same sample interval.
+    """
+    def __init__(self, db_file: Path, model: Optional[Model]) -> None:
+        """Create a TraceExporter.
+
+        Args:
+            db_file: The profile database to export.
+            model: The model that was run, if known. Without it,
+                    messages are not linked.
+        """
+        self._db_file = db_file
+        self._model = model
+        self._receivers = dict()  # type: Dict[_Channel, Optional[_Channel]]
+        self._channels = dict()  # type: Dict[_Channel, int]
+        self._sent = list()  # type: List[int]
+        self._received = list()  # type: List[int]
+
+    def export(self, out: TextIO) -> None:
+        """Writes the trace.
+
+        Args:
+            out: The file to write the trace to.
+        """
+        conn = sqlite3.connect(
+                'file:{}?mode=ro'.format(self._db_file), uri=True)
+        try:
+            t0 = conn.execute(
+                    'SELECT IFNULL(MIN(start_time), 0.0) FROM events'
+                    ).fetchone()[0]
+
+            out.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+            out.write(json.dumps({
+                'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0,
+                'args': {'name': 'muscle3'}}))
+
+            for oid, name in conn.execute('SELECT oid, name FROM instances'):
+                self._write(out, {
+                    'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': oid,
+                    'args': {'name': name}})
+                self._write(out, {
+                    'name': 'thread_sort_index', 'ph': 'M', 'pid': 1,
+                    'tid': oid, 'args': {'sort_index': oid}})
+
+            # databases from before format 1.1 don't have outbox sizes
+            outbox_size = 'NULL'
+            for column in conn.execute('PRAGMA table_info(events)'):
+                if column[1] == 'outbox_size':
+                    outbox_size = 'e.outbox_size'
+
+            cur = conn.execute(
+                    'SELECT e.instance_oid, i.name, e.event_type_oid,'
+                    '    e.start_time, e.stop_time, p.name, e.slot,'
+                    '    e.message_size, ' + outbox_size +
+                    ' FROM events AS e'
+                    ' JOIN instances AS i ON e.instance_oid = i.oid'
+                    ' LEFT JOIN ports AS p ON e.port_oid = p.oid'
+                    ' ORDER BY e.oid')
+            for row in cur:
+                self._write_event(out, t0, *row)
+
+            out.write('\n]}\n')
+        finally:
+            conn.close()
+
+    def _write_event(
+            self, out: TextIO, t0: float, instance_oid: int,
+            instance: str, event_type_oid: int, start: float, stop: float,
+            port: Optional[str], slot: Optional[int],
+            message_size: Optional[int], outbox_size: Optional[int]
+            ) -> None:
+        """Writes a single profile event to the trace.
+
+        If the event has an outbox size, then it is written to a
+        counter track for the instance as well.
+
+        Args:
+            out: The file to write to.
+            t0: Time to use as the origin of the trace.
+            instance_oid: Oid of the instance, used as its track id.
+            instance: Name of the instance.
+            event_type_oid: Value of the ProfileEventType.
+            start: Start time of the event, in seconds.
+            stop: Stop time of the event, in seconds.
+            port: Name of the port, if any.
+            slot: Slot sent or received on, if any.
+            message_size: Size of the message, if any.
+            outbox_size: Size of the sender's outboxes, if known.
+        """
+        event_type = ProfileEventType(event_type_oid)
+        ts = (start - t0) * 1e6
+        name = event_type.name
+        args = dict()   # type: Dict[str, Any]
+        if port is not None:
+            name += ' ' + port
+            if slot is not None:
+                name += '[{}]'.format(slot)
+            args['port'] = port
+            args['slot'] = slot
+            args['message_size'] = message_size
+
+        self._write(out, {
+            'name': name, 'cat': event_type.name, 'ph': 'X', 'pid': 1,
+            'tid': instance_oid, 'ts': ts, 'dur': (stop - start) * 1e6,
+            'args': args})
+
+        if outbox_size is not None:
+            self._write(out, {
+                'name': 'outbox ' + instance, 'ph': 'C', 'pid': 1,
+                'ts': (stop - t0) * 1e6, 'args': {'bytes': outbox_size}})
+
+        if port is None or self._model is None:
+            return
+
+        if event_type == ProfileEventType.SEND:
+            channel = self._receiving_channel(instance, port, slot)
+            if channel is None:
+                return
+            phase = 's'
+            counts = self._sent
+        elif event_type == ProfileEventType.RECEIVE:
+            channel = (instance, port, slot)
+            phase = 'f'
+            counts = self._received
+        else:
+            return
+
+        channel_id = self._channels.get(channel)
+        if channel_id is None:
+            channel_id = self._channels[channel] = len(self._channels)
+            self._sent.append(0)
+            self._received.append(0)
+
+        flow_id = '{}.{}'.format(channel_id, counts[channel_id])
+        counts[channel_id] += 1
+        self._write(out, {
+            'name': 'message', 'cat': 'message', 'ph': phase, 'bp': 'e',
+            'id': flow_id, 'pid': 1, 'tid': instance_oid, 'ts': ts})
+
+    def _receiving_channel(
+            self, sender: str, port: str, slot: Optional[int]
+            ) -> Optional[_Channel]:
+        """Returns the channel that a message sent arrives on.
+
+        Args:
+            sender: Name of the sending instance.
+            port: Name of the port sent on.
+            slot: Slot sent on, if any.
+
+        Returns:
+            The name of the receiving instance, the name of its port
+            and the slot, or None if the port is not connected.
+        """
+        key = (sender, port, slot)
+        if key not in self._receivers:
+            receiver = find_receiver(
+                    cast(Model, self._model), Reference(sender),
+                    Identifier(port), slot)
+            if receiver is None:
+                self._receivers[key] = None
+            else:
+                self._receivers[key] = (
+                        str(receiver[1]), str(receiver[2]), receiver[3])
+        return self._receivers[key]
+
+    def _write(self, out: TextIO, event: Dict[str, Any]) -> None:
+        """Writes a trace event, preceded by a separator."""
+        out.write(',\n')
+        out.write(json.dumps(event))
@@ -0,0 +1,172 @@
+import mmap
+import os
+from pathlib import Path
+import socket
+from typing import Optional
+import uuid
+
+from libmuscle.mcp.transport_server import Buffer
+
+
+_SHM_DIR = Path('/dev/shm')
+
+
+def local_node_id() -> str:
+    """Returns an identifier for the node we are running on.
+
+    Transports that only work between processes on the same machine
+    put this into their location strings, so that clients can tell
+    whether they're on the same node as the server. We use the kernel
+    boot id, which is unique per boot of a machine, and fall back to
+    the host name if it is not available.
+
+    Returns:
+        A string identifying the local node.
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return socket.gethostname()
+
+
+def shm_available() -> bool:
+    """Returns whether POSIX shared memory is available.
+    """
+    return _SHM_DIR.is_dir() and os.access(str(_SHM_DIR), os.W_OK)
+
+
+def shm_id() -> str:
+    """Returns an identifier for the local shared memory file system.
+
+    Containers on the same node may have their own /dev/shm, in which
+    case they cannot share memory segments even though they share a
+    kernel. This identifies the file system, so that we can detect
+    that situation.
+
+    Returns:
+        A string identifying the shared memory file system.
+    """
+    stat = _SHM_DIR.stat()
+    return '{}.{}'.format(stat.st_dev, stat.st_ino)
+
+
+def unique_name(prefix: str) -> str:
+    """Generates a name for a socket or segment that is unique.
+
+    Args:
+        prefix: A prefix to start the name with.
+
+    Returns:
+        The prefix, followed by the process id and a random string.
+    """
+    return '{}_{}_{}'.format(prefix, os.getpid(), uuid.uuid4().hex)
+
+
+class SharedMemorySegment:
+    """A POSIX shared memory segment, mapped into our address space.
+
+    Segments are files in /dev/shm, which are mapped into memory. They
+    stay mapped after they have been unlinked, so the usual pattern is
+    for one side to create a segment, the other side to open it and
+    then unlink it immediately, so that nothing is left behind even if
+    one of the processes crashes later.
+
+    Attributes:
+        name (str): The name of the segment.
+        size (int): The size of the segment in bytes.
+    """
+    def __init__(self, name: str, size: Optional[int] = None) -> None:
+        """Create or open a SharedMemorySegment.
+
+        If size is given, a new segment of that size is created,
+        otherwise an existing segment is opened.
+
+        Args:
+            name: Name of the segment.
+            size: Size of the segment to create, if any.
+
+        Raises:
+            OSError: If the segment could not be created or opened.
+        """
+        self.name = name
+        path = str(_SHM_DIR / name)
+        if size is not None:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+            try:
+                os.ftruncate(fd, size)
+            except OSError:
+                os.close(fd)
+                self.unlink()
+                raise
+        else:
+            fd = os.open(path, os.O_RDWR)
+            size = os.fstat(fd).st_size
+
+        try:
+            self.size = size
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def write(self, data: Buffer, offset: int = 0) -> None:
+        """Copies data into the segment.
+
+        Args:
+            data: The data to write.
+            offset: The position to write it at.
+        """
+        self._mmap[offset:offset + memoryview(data).nbytes] = data
+
+    def read(self, length: int, offset: int = 0) -> bytes:
+        """Copies data out of the segment.
+
+        Args:
+            length: Number of bytes to read.
+            offset: The position to read from.
+        """
+        return self._mmap[offset:offset + length]
+
+    def view(self, length: int, offset: int = 0) -> memoryview:
+        """Returns a view of part of the segment, without copying.
+
+        The view must be released before the segment is closed.
+
+        Args:
+            length: Number of bytes to view.
+            offset: The position to start at.
+        """
+        return memoryview(self._mmap)[offset:offset + length]
+
+    def read_into(self, buf: memoryview, offset: int = 0) -> None:
+        """Copies data out of the segment into a buffer.
+
+        Args:
+            buf: The buffer to fill.
+            offset: The position to read from.
+        """
+        buf = buf.cast('B')
+        with memoryview(self._mmap) as segment:
+            buf[:] = segment[offset:offset + buf.nbytes]
+
+    def unlink(self) -> None:
+        """Removes the segment's name from the system.
+
+        The segment remains mapped until it is closed. Does nothing if
+        the segment has already been unlinked.
+        """
+        try:
+            os.unlink(str(_SHM_DIR / self.name))
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        """Unmaps the segment.
+
+        If there are still views of the segment in use, it is unmapped
+        when the last of them is released instead.
+        """
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
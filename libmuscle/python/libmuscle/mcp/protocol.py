@@ -20,9 +20,40 @@ class RequestType(Enum):
     GET_SETTINGS = 4
     SUBMIT_LOG_MESSAGE = 5
     SUBMIT_PROFILE_EVENTS = 6
+    GET_TIME = 7
 
     # MUSCLE Peer Protocol
     GET_NEXT_MESSAGE = 21
+    NEGOTIATE_FEATURES = 22
+    SUBSCRIBE = 23
+    OPEN_CHANNEL = 24
+    GET_ANY_MESSAGE = 25
+
+
+class MPPFeature(Enum):
+    """Optional features of the MUSCLE Peer Protocol
+
+    Clients send a NEGOTIATE_FEATURES request with the features they
+    support after connecting, and the server replies with the subset it
+    supports as well. Servers that predate this mechanism close the
+    connection instead, in which case the client reconnects and does
+    without. Negotiated features are passed along with each
+    GET_NEXT_MESSAGE request, so that the server does not need to keep
+    track of connections.
+    """
+    # Grid data is sent as separate buffers after the message
+    OOB_GRIDS = 'oob_grids'
+    # Messages are pushed to a subscribed receiver as they are sent
+    PUSH = 'push'
+    # A settings overlay that is the same as the one sent to the
+    # receiver with the previous message is replaced by a reference
+    SETTINGS_REFS = 'settings_refs'
+    # Receivers are referred to by a number obtained with an
+    # OPEN_CHANNEL request, rather than by name
+    CHANNELS = 'channels'
+    # The next message for any of several receivers can be requested
+    # with a GET_ANY_MESSAGE request
+    ANY = 'any'
 
 
 class ResponseType(Enum):
@@ -0,0 +1,512 @@
+from collections import deque
+import logging
+from queue import Queue
+import selectors
+import socket
+import threading
+from typing import (  # noqa
+        Any, Callable, cast, Deque, List, Optional, Set, Tuple, Union)
+
+from libmuscle.mcp.transport_server import (
+        NonBlockingRequestHandler, RequestHandler, Responder, Response,
+        StreamedResponse)
+
+
+_logger = logging.getLogger(__name__)
+
+
+# Maximum number of buffers to pass to a single sendmsg() call.
+_MAX_IOV = 1024
+
+# Amount of data to try to receive at once
+_RECV_SIZE = 65536
+
+
+class _EndOfResponse:
+    """Marks the end of the last response to a request in a send queue.
+    """
+    pass
+
+
+_END_OF_RESPONSE = _EndOfResponse()
+
+
+_OutputItem = Union[memoryview, _EndOfResponse]
+
+
+class _Connection:
+    """A connection to a client.
+
+    Attributes:
+        socket: The socket connected to the client.
+        in_buf: Received data not yet handled.
+        out_buf: Data to be sent.
+        busy: Whether we are working on a request from this client.
+        streaming: Whether we are in the middle of a streamed response.
+        closed: Whether the connection has been closed.
+    """
+    def __init__(self, sock: socket.socket) -> None:
+        self.socket = sock
+        self.in_buf = bytearray()
+        self.out_buf = deque()  # type: Deque[_OutputItem]
+        self.busy = False
+        self.streaming = False
+        self.closed = False
+
+
+# A request waiting to be handled, with its connection and responder
+_BatchItem = Tuple[_Connection, bytes, Responder]
+
+
+class _WorkerPool:
+    """A pool of daemon threads for running blocking request handlers.
+
+    Threads are started when needed, optionally up to a maximum, and
+    are reused when they become idle. They are daemon threads, so that
+    handlers waiting for something that will never happen do not
+    prevent the program from exiting.
+    """
+    def __init__(self, max_workers: Optional[int]) -> None:
+        """Create a _WorkerPool.
+
+        Args:
+            max_workers: Maximum number of threads to start, or None
+                    for no limit.
+        """
+        self._max_workers = max_workers
+        self._tasks = Queue()   # type: Queue[Optional[Tuple[Callable, Tuple]]]
+        self._lock = threading.Lock()
+        self._num_workers = 0
+        self._num_idle = 0
+        self._num_pending = 0
+
+    def submit(self, fn: Callable, *args: Any) -> None:
+        """Runs fn(*args) on a worker thread.
+
+        Args:
+            fn: The function to run.
+            args: Arguments to pass.
+        """
+        with self._lock:
+            self._num_pending += 1
+            if (
+                    self._num_pending > self._num_idle and
+                    (self._max_workers is None or
+                     self._num_workers < self._max_workers)):
+                self._num_workers += 1
+                threading.Thread(target=self._work, daemon=True).start()
+        self._tasks.put((fn, args))
+
+    def shutdown(self) -> None:
+        """Stops the workers once they are done with their current task.
+        """
+        with self._lock:
+            for _ in range(self._num_workers):
+                self._tasks.put(None)
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                self._num_idle += 1
+            task = self._tasks.get()
+            with self._lock:
+                self._num_idle -= 1
+                if task is not None:
+                    self._num_pending -= 1
+
+            if task is None:
+                return
+            fn, args = task
+            fn(*args)
+
+
+class SelectorServer:
+    """An event-driven server for MCP connections.
+
+    This server handles all of its connections on a single I/O thread,
+    using a selector to see which ones are ready. Requests are passed
+    to a :class:`NonBlockingRequestHandler` on the I/O thread, or for
+    other handlers, to a pool of worker threads, so that handlers can
+    block without holding up other connections.
+
+    Requests that arrive on different connections at the same time are
+    handled one after the other, after which the non-blocking handler's
+    :meth:`NonBlockingRequestHandler.requests_handled` is called.
+
+    The API mirrors that of :class:`socketserver.BaseServer`.
+
+    Attributes:
+        server_address: The address the server listens on.
+    """
+    def __init__(
+            self, sock: socket.socket, handler: RequestHandler,
+            max_workers: Optional[int] = None) -> None:
+        """Create a SelectorServer.
+
+        Args:
+            sock: A bound and listening socket to accept connections on.
+            handler: The handler to pass requests to.
+            max_workers: Maximum number of worker threads to run
+                    blocking handlers on. Since handlers may wait for
+                    each other, the default is not to limit this.
+        """
+        self.server_address = sock.getsockname()
+        self._socket = sock
+        self._socket.setblocking(False)
+        self._handler = handler
+        self._workers = _WorkerPool(max_workers)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._socket, selectors.EVENT_READ, None)
+
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(
+                self._wakeup_recv, selectors.EVENT_READ, self._wakeup_recv)
+
+        self._lock = threading.Lock()
+        self._output = list(
+                )   # type: List[Tuple[_Connection, Optional[List], bool]]
+        self._connections = set()  # type: Set[_Connection]
+        self._batch = list()    # type: List[_BatchItem]
+        self._io_thread = None      # type: Optional[threading.Thread]
+        self._shutting_down = False
+        self._stopped = threading.Event()
+
+    def serve_forever(self) -> None:
+        """Handles connections until :meth:`shutdown` is called.
+        """
+        self._io_thread = threading.current_thread()
+        try:
+            while not self._shutting_down:
+                for key, mask in self._selector.select():
+                    if key.data is None:
+                        self._accept()
+                    elif key.data is self._wakeup_recv:
+                        self._wake_up()
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if mask & selectors.EVENT_WRITE:
+                            self._write(key.data)
+                self._dispatch_batch()
+        finally:
+            self._stopped.set()
+
+    def shutdown(self) -> None:
+        """Stops the server and waits until it has stopped.
+
+        Must be called from a different thread than the one running
+        :meth:`serve_forever`.
+        """
+        self._shutting_down = True
+        self._notify()
+        self._stopped.wait()
+
+    def server_close(self) -> None:
+        """Closes all connections and frees resources.
+        """
+        for conn in list(self._connections):
+            self._close(conn)
+        self._workers.shutdown()
+        self._selector.close()
+        self._socket.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def _accept(self) -> None:
+        """Accepts a new connection.
+        """
+        try:
+            sock, _ = self._socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = _Connection(sock)
+        self._connections.add(conn)
+        self._selector.register(sock, selectors.EVENT_READ, conn)
+
+    def _read(self, conn: _Connection) -> None:
+        """Receives data from a connection and handles it.
+
+        Args:
+            conn: The connection to read from.
+        """
+        try:
+            data = conn.socket.recv(_RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self._close(conn)
+            return
+
+        conn.in_buf += data
+        self._handle_input(conn)
+
+    def _handle_input(self, conn: _Connection) -> None:
+        """Handles the next request on a connection, if we can.
+
+        Requests on a connection are handled one at a time, so we only
+        start on the next request once the responses to the previous
+        one have been sent. Requests for a non-blocking handler are
+        added to the current batch, to be handled at the end of this
+        round.
+
+        Args:
+            conn: The connection to handle requests for.
+        """
+        if conn.busy or conn.closed or len(conn.in_buf) < 8:
+            return
+
+        length = int.from_bytes(conn.in_buf[:8], 'little')
+        if len(conn.in_buf) < 8 + length:
+            return
+
+        request = bytes(conn.in_buf[8:8 + length])
+        del conn.in_buf[:8 + length]
+        conn.busy = True
+
+        def respond(response: Optional[Response], last: bool = True) -> None:
+            self._respond(conn, response, last)
+
+        if isinstance(self._handler, NonBlockingRequestHandler):
+            self._batch.append((conn, request, respond))
+        else:
+            self._workers.submit(
+                    self._handle_blocking, conn, request, respond)
+
+    def _dispatch_batch(self) -> None:
+        """Passes batched requests to the non-blocking handler.
+
+        If handling a request fails, then there is no response to send,
+        so we close its connection to let the client know, and carry on
+        with the other requests.
+
+        Sending a response may make the next request on a connection
+        available, so we repeat until there are no more requests.
+        """
+        handler = cast(NonBlockingRequestHandler, self._handler)
+        while self._batch:
+            batch = self._batch
+            self._batch = list()
+            for conn, request, respond in batch:
+                try:
+                    handler.handle_request_async(request, respond)
+                except Exception:
+                    _logger.exception('Error handling request')
+                    self._close(conn)
+            try:
+                handler.requests_handled()
+            except Exception:
+                _logger.exception('Error after handling requests')
+
+    def _handle_blocking(
+            self, conn: _Connection, request: bytes,
+            respond: Responder) -> None:
+        """Handles a request using a blocking handler.
+
+        This runs on a worker thread. If the handler fails, we have no
+        response to send, so we close the connection to let the client
+        know instead of leaving it waiting.
+
+        Args:
+            conn: The connection the request came in on.
+            request: The request to handle.
+            respond: Function to call with the response(s).
+        """
+        try:
+            response = self._handler.handle_request(request)
+            if isinstance(response, StreamedResponse):
+                for part in response.responses:
+                    respond(part, False)
+                respond(None, True)
+            else:
+                respond(response, True)
+        except Exception:
+            _logger.exception('Error handling request')
+            self._post(conn, None, True)
+
+    def _respond(
+            self, conn: _Connection, response: Optional[Response],
+            last: bool) -> None:
+        """Queues a response to be sent.
+
+        This may be called from any thread.
+
+        Args:
+            conn: The connection to send on.
+            response: The response to send, if any.
+            last: Whether this is the last response to the request.
+        """
+        buffers = list()  # type: List[memoryview]
+        streamed = conn.streaming or not last
+        conn.streaming = not last
+        if response is not None:
+            if not isinstance(response, list):
+                response = [response]
+            buffers = self._frame(
+                    conn, [memoryview(buf).cast('B') for buf in response],
+                    streamed)
+        self._post(conn, buffers, last)
+
+    def _frame(
+            self, conn: _Connection, buffers: List[memoryview],
+            streamed: bool) -> List[memoryview]:
+        """Returns the data to send for a response.
+
+        This prefixes the response with its length. Subclasses may
+        override this to send responses in a different way.
+
+        This may be called from any thread.
+
+        Args:
+            conn: The connection the response will be sent on.
+            buffers: The buffers making up the response.
+            streamed: Whether the response is part of a streamed
+                    response.
+        """
+        length = sum(buf.nbytes for buf in buffers)
+        return [memoryview(length.to_bytes(8, 'little'))] + buffers
+
+    def _post(
+            self, conn: _Connection, buffers: Optional[List[memoryview]],
+            last: bool) -> None:
+        """Passes data to send to the I/O thread.
+
+        This may be called from any thread.
+
+        Args:
+            conn: The connection to send on.
+            buffers: The data to send, or None to close the connection.
+            last: Whether this ends the response to the current request.
+        """
+        if threading.current_thread() is self._io_thread:
+            self._queue_output(conn, buffers, last)
+        else:
+            with self._lock:
+                self._output.append((conn, buffers, last))
+            self._notify()
+
+    def _notify(self) -> None:
+        """Wakes up the I/O thread.
+        """
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            # buffer full, so it's going to wake up anyway, or the
+            # server has been closed and there's nothing to wake up
+            pass
+
+    def _wake_up(self) -> None:
+        """Handles output queued by other threads.
+        """
+        try:
+            while self._wakeup_recv.recv(_RECV_SIZE):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        with self._lock:
+            output = self._output
+            self._output = list()
+
+        for conn, buffers, last in output:
+            self._queue_output(conn, buffers, last)
+
+    def _queue_output(
+            self, conn: _Connection, buffers: Optional[List[memoryview]],
+            last: bool) -> None:
+        """Adds data to a connection's send queue, and tries to send it.
+
+        Args:
+            conn: The connection to send on.
+            buffers: The data to send, or None to close the connection.
+            last: Whether this ends the response to the current request.
+        """
+        if conn.closed:
+            return
+        if buffers is None:
+            self._close(conn)
+            return
+        conn.out_buf.extend(buf for buf in buffers if buf.nbytes > 0)
+        if last:
+            conn.out_buf.append(_END_OF_RESPONSE)
+        self._write(conn)
+
+    def _write(self, conn: _Connection) -> None:
+        """Sends as much queued data as possible on a connection.
+
+        Args:
+            conn: The connection to send on.
+        """
+        while conn.out_buf and not conn.closed:
+            if conn.out_buf[0] is _END_OF_RESPONSE:
+                conn.out_buf.popleft()
+                conn.busy = False
+                self._handle_input(conn)
+                continue
+
+            views = list()  # type: List[memoryview]
+            for item in conn.out_buf:
+                if not isinstance(item, memoryview) or len(views) == _MAX_IOV:
+                    break
+                views.append(item)
+
+            try:
+                sent = conn.socket.sendmsg(views)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self._close(conn)
+                return
+
+            while sent > 0:
+                first = conn.out_buf[0]
+                assert isinstance(first, memoryview)
+                if sent >= first.nbytes:
+                    sent -= first.nbytes
+                    conn.out_buf.popleft()
+                else:
+                    conn.out_buf[0] = first[sent:]
+                    sent = 0
+
+        if not conn.closed:
+            events = selectors.EVENT_READ
+            if conn.out_buf:
+                events |= selectors.EVENT_WRITE
+            self._selector.modify(conn.socket, events, conn)
+
+    def _close(self, conn: _Connection) -> None:
+        """Closes a connection.
+
+        Args:
+            conn: The connection to close.
+        """
+        if conn.closed:
+            return
+        conn.closed = True
+        conn.out_buf.clear()
+        self._connections.discard(conn)
+        try:
+            self._selector.unregister(conn.socket)
+        except (KeyError, ValueError):
+            pass
+        conn.socket.close()
+        self._closed(conn)
+
+    def _closed(self, conn: _Connection) -> None:
+        """Called after a connection has been closed.
+
+        Subclasses may override this to free any resources they keep
+        for the connection.
+
+        Args:
+            conn: The connection that was closed.
+        """
+        pass
@@ -0,0 +1,175 @@
+from typing import Optional  # noqa
+
+from libmuscle.mcp.local_util import (
+        local_node_id, shm_available, shm_id, SharedMemorySegment)
+from libmuscle.mcp.tcp_transport_client import SocketResponseReader
+from libmuscle.mcp.tcp_util import recv_all, recv_int64, send_int64
+from libmuscle.mcp.transport_client import ResponseReader
+from libmuscle.mcp.transport_server import Buffer
+from libmuscle.mcp.uds_transport_client import UdsTransportClient
+
+
+class SegmentResponseReader(ResponseReader):
+    """Reads a response from a shared memory segment.
+    """
+    def __init__(self, segment: SharedMemorySegment, length: int) -> None:
+        """Create a SegmentResponseReader.
+
+        Args:
+            segment: The segment holding the response.
+            length: Length of the response in bytes.
+        """
+        super().__init__(length)
+        self._segment = segment
+        self._offset = 0
+
+    def read_into(self, buf: memoryview) -> None:
+        """Reads the next part of the response into a given buffer.
+
+        Args:
+            buf: The buffer to read into, which will be filled.
+        """
+        self._segment.read_into(buf, self._offset)
+        self._offset += buf.nbytes
+
+
+class ShmTransportClient(UdsTransportClient):
+    """A client that connects to a ShmTransport server.
+    """
+    @staticmethod
+    def can_connect_to(location: str) -> bool:
+        """Whether this client class can connect to the given location.
+
+        This is only possible if the server is on the same node as we
+        are, and uses the same shared memory file system.
+
+        Args:
+            location: The location to potentially connect to.
+
+        Returns:
+            True iff this class can connect to this location.
+        """
+        if not location.startswith('shm:'):
+            return False
+        parts = location[4:].split(':')
+        if len(parts) != 3:
+            return False
+        return (
+                shm_available() and
+                parts[0] == local_node_id() and parts[1] == shm_id())
+
+    def __init__(self, location: str) -> None:
+        """Create a ShmTransportClient for a given location.
+
+        The client will connect to this location and be able to request
+        messages from any instance and port represented by it.
+
+        Args:
+            location: A location string for the peer.
+        """
+        super().__init__(location)
+        self._segment = None  # type: Optional[SharedMemorySegment]
+        self._view = None  # type: Optional[memoryview]
+
+    def call(self, request: bytes) -> Buffer:
+        """Send a request to the server and receive the response.
+
+        This is a blocking call. Responses sent through shared memory
+        are returned as a view of the segment rather than copied out
+        of it, so they are only valid until the next request.
+
+        Args:
+            request: The request to send
+
+        Returns:
+            The received response
+        """
+        self._release_view()
+        send_int64(self._socket, len(request))
+        self._socket.sendall(request)
+
+        length = recv_int64(self._socket)
+        name_length = recv_int64(self._socket)
+        if name_length == 0:
+            return recv_all(self._socket, length)
+
+        name = recv_all(self._socket, name_length).decode('ascii')
+        if self._segment is None or self._segment.name != name:
+            self._open_segment(name)
+        self._view = self._segment.view(length)     # type: ignore
+        return self._view
+
+    def call_stream(self, request: bytes) -> ResponseReader:
+        """Send a request to the server and start receiving the response.
+
+        This blocks until the response starts to arrive.
+
+        Args:
+            request: The request to send
+
+        Returns:
+            A reader for the response
+        """
+        self._release_view()
+        send_int64(self._socket, len(request))
+        self._socket.sendall(request)
+        return self.next_response()
+
+    def next_response(self) -> ResponseReader:
+        """Start receiving the next of a series of responses.
+
+        This is used if the server sends several responses to a single
+        request. It blocks until the response starts to arrive.
+
+        Returns:
+            A reader for the response
+        """
+        length = recv_int64(self._socket)
+        name_length = recv_int64(self._socket)
+        if name_length == 0:
+            return SocketResponseReader(self._socket, length)
+
+        name = recv_all(self._socket, name_length).decode('ascii')
+        if self._segment is None or self._segment.name != name:
+            self._open_segment(name)
+        return SegmentResponseReader(
+                self._segment, length)     # type: ignore
+
+    def close(self) -> None:
+        """Closes this client.
+
+        This closes any connections this client has and/or performs
+        other shutdown activities.
+        """
+        super().close()
+        self._release_view()
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _open_segment(self, name: str) -> None:
+        """Switches to a new segment sent by the server.
+
+        The server only switches to a new segment when the current one
+        is too small, so we can let go of the current one.
+
+        Args:
+            name: Name of the new segment.
+        """
+        if self._segment is not None:
+            self._segment.close()
+        self._segment = SharedMemorySegment(name)
+        self._segment.unlink()
+
+    def _release_view(self) -> None:
+        """Releases the view of the previous response, if any.
+
+        If the caller still uses it, then we leave that to the garbage
+        collector instead.
+        """
+        if self._view is not None:
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+            self._view = None
@@ -0,0 +1,180 @@
+import socket
+import threading
+from typing import Dict, List  # noqa
+
+from libmuscle.mcp.local_util import (
+        local_node_id, shm_available, shm_id, unique_name,
+        SharedMemorySegment)
+from libmuscle.mcp.selector_server import _Connection, SelectorServer
+from libmuscle.mcp.transport_server import RequestHandler, ServerNotSupported
+from libmuscle.mcp.uds_transport_server import UdsTransportServer
+
+
+# Responses up to this size are sent through the control socket
+INLINE_LIMIT = 65536
+
+# Minimum size of a shared memory segment
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+
+class ShmSelectorServer(SelectorServer):
+    """A SelectorServer that sends large responses via shared memory.
+
+    Requests come in over a Unix domain socket, with the same framing
+    as for TCP. Small responses are sent back over the socket as well,
+    while larger ones are written into a shared memory segment for the
+    client to pick up. Each connection has its own segment, which is
+    reused for subsequent responses.
+
+    Each response is sent as a length, followed by the length of the
+    name of the segment it is in, followed by the segment name. If
+    the segment name is empty, the response follows on the socket.
+
+    Parts of a streamed response are always sent inline, as the client
+    does not tell us when it is done with the shared memory segment,
+    so we cannot reuse it for the next part.
+    """
+    def __init__(self, sock: socket.socket, handler: RequestHandler) -> None:
+        """Create a ShmSelectorServer.
+
+        Args:
+            sock: A bound and listening socket to accept connections on.
+            handler: The handler to pass requests to.
+        """
+        super().__init__(sock, handler)
+        self._segments = dict()  # type: Dict[_Connection, SharedMemorySegment]
+        self._segments_lock = threading.Lock()
+
+    def unlink_segments(self) -> None:
+        """Unlinks any segments that have not been released yet.
+        """
+        with self._segments_lock:
+            for segment in self._segments.values():
+                segment.unlink()
+
+    def _frame(
+            self, conn: _Connection, buffers: List[memoryview],
+            streamed: bool) -> List[memoryview]:
+        """Returns the data to send for a response.
+
+        Args:
+            conn: The connection the response will be sent on.
+            buffers: The buffers making up the response.
+            streamed: Whether the response is part of a streamed
+                    response.
+        """
+        length = sum(buf.nbytes for buf in buffers)
+        header = length.to_bytes(8, 'little')
+
+        if streamed or length <= INLINE_LIMIT:
+            return [memoryview(header + bytes(8))] + buffers
+
+        segment = self._get_segment(conn, length)
+        offset = 0
+        for buf in buffers:
+            segment.write(buf, offset)
+            offset += buf.nbytes
+        name = segment.name.encode('ascii')
+        return [memoryview(header + len(name).to_bytes(8, 'little') + name)]
+
+    def _closed(self, conn: _Connection) -> None:
+        """Releases the connection's segment, if it has one.
+
+        Args:
+            conn: The connection that was closed.
+        """
+        with self._segments_lock:
+            segment = self._segments.pop(conn, None)
+        if segment is not None:
+            self._release_segment(segment)
+
+    def _get_segment(
+            self, conn: _Connection, size: int) -> SharedMemorySegment:
+        """Returns a segment of at least the given size.
+
+        If the connection's current segment is too small, a new one is
+        created and the old one is released.
+
+        Args:
+            conn: The connection to get a segment for.
+            size: The required size in bytes.
+        """
+        with self._segments_lock:
+            segment = self._segments.get(conn)
+        if segment is not None and segment.size >= size:
+            return segment
+
+        new_size = max(size, MIN_SEGMENT_SIZE)
+        if segment is not None:
+            new_size = max(new_size, 2 * segment.size)
+            self._release_segment(segment)
+
+        segment = SharedMemorySegment(unique_name('muscle3_shm'), new_size)
+        with self._segments_lock:
+            self._segments[conn] = segment
+        return segment
+
+    def _release_segment(self, segment: SharedMemorySegment) -> None:
+        """Unlinks and unmaps a segment.
+
+        The client unlinks segments when it opens them, we do so here
+        in case the client never got to it.
+
+        Args:
+            segment: The segment to release.
+        """
+        segment.unlink()
+        segment.close()
+
+
+class ShmTransportServer(UdsTransportServer):
+    """A TransportServer that uses shared memory to communicate.
+
+    This server can only be reached by clients on the same node. It
+    listens on a Unix domain socket in the abstract namespace, which
+    is used for requests and small responses, and sends large
+    responses through POSIX shared memory segments.
+    """
+    _scheme = 'shm'
+
+    def __init__(self, handler: RequestHandler) -> None:
+        """Create a ShmTransportServer.
+
+        Args:
+            handler: A RequestHandler to handle requests
+
+        Raises:
+            ServerNotSupported: If shared memory or abstract Unix
+                domain sockets are not available on this system.
+        """
+        if not shm_available():
+            raise ServerNotSupported('No shared memory available')
+
+        super().__init__(handler)
+
+    def get_location(self) -> str:
+        """Returns the location this server listens on.
+
+        Returns:
+            A string containing the location.
+        """
+        return 'shm:{}:{}:{}'.format(
+                local_node_id(), shm_id(), self._socket_name)
+
+    def close(self) -> None:
+        """Closes this server.
+
+        Stops the server listening, waits for existing clients to
+        disconnect, then frees any other resources.
+        """
+        super().close()
+        self._shm_server.unlink_segments()
+
+    def _create_server(self, sock: socket.socket) -> SelectorServer:
+        """Creates the server that serves our connections.
+
+        Args:
+            sock: The bound and listening socket to serve.
+        """
+        self._shm_server = ShmSelectorServer(sock, self._handler)
+        return self._shm_server
@@ -1,8 +1,31 @@
 import socket
 from typing import Optional
 
-from libmuscle.mcp.transport_client import TransportClient
-from libmuscle.mcp.tcp_util import recv_all, recv_int64, send_int64
+from libmuscle.mcp.transport_client import ResponseReader, TransportClient
+from libmuscle.mcp.tcp_util import (
+        recv_all, recv_all_into, recv_int64, send_int64)
+
+
+class SocketResponseReader(ResponseReader):
+    """Reads a response directly from a socket.
+    """
+    def __init__(self, socket: socket.SocketType, length: int) -> None:
+        """Create a SocketResponseReader.
+
+        Args:
+            socket: The socket to read from.
+            length: Length of the response in bytes.
+        """
+        super().__init__(length)
+        self._socket = socket
+
+    def read_into(self, buf: memoryview) -> None:
+        """Reads the next part of the response into a given buffer.
+
+        Args:
+            buf: The buffer to read into, which will be filled.
+        """
+        recv_all_into(self._socket, buf)
 
 
 class TcpTransportClient(TransportClient):
@@ -62,6 +85,33 @@ class TcpTransportClient(TransportClient):
         length = recv_int64(self._socket)
         return recv_all(self._socket, length)
 
+    def call_stream(self, request: bytes) -> ResponseReader:
+        """Send a request to the server and start receiving the response.
+
+        This blocks until the response starts to arrive.
+
+        Args:
+            request: The request to send
+
+        Returns:
+            A reader for the response
+        """
+        send_int64(self._socket, len(request))
+        self._socket.sendall(request)
+        return self.next_response()
+
+    def next_response(self) -> ResponseReader:
+        """Start receiving the next of a series of responses.
+
+        This is used if the server sends several responses to a single
+        request. It blocks until the response starts to arrive.
+
+        Returns:
+            A reader for the response
+        """
+        length = recv_int64(self._socket)
+        return SocketResponseReader(self._socket, length)
+
     def close(self) -> None:
         """Closes this client.
 
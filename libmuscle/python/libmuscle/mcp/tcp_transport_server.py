@@ -1,61 +1,20 @@
-import socketserver as ss
+import socket
 import threading
-from typing import cast, List, Optional, Tuple
-from typing_extensions import Type
+from typing import List
 
 import netifaces
 
+from libmuscle.mcp.selector_server import SelectorServer
 from libmuscle.mcp.transport_server import RequestHandler, TransportServer
-from libmuscle.mcp.tcp_util import (recv_all, recv_int64, send_int64,
-                                    SocketClosed)
 
 
-class TcpTransportServerImpl(ss.ThreadingMixIn, ss.TCPServer):
-    daemon_threads = True
-    allow_reuse_address = True
-
-    def __init__(self, host_port_tuple: Tuple[str, int],
-                 streamhandler: Type, transport_server: 'TcpTransportServer'
-                 ) -> None:
-        super().__init__(host_port_tuple, streamhandler)
-        self.transport_server = transport_server
-
-
-class TcpHandler(ss.BaseRequestHandler):
-    """Handler for MCP-over-TCP connections.
+class TcpTransportServer(TransportServer):
+    """A TransportServer that uses TCP to communicate.
 
-    This is a Python handler for Python's TCPServer, which forwards
-    to the RequestHandler attached to the server.
+    All connections are served by a single I/O thread, so that a large
+    number of peers does not require a large number of threads. See
+    :class:`SelectorServer` for details.
     """
-    def handle(self) -> None:
-        """Handles requests on a socket
-        """
-        request = self.receive_request()
-
-        while request is not None:
-            server = cast(TcpTransportServerImpl, self.server).transport_server
-            response = server._handler.handle_request(request)
-
-            send_int64(self.request, len(response))
-            self.request.sendall(response)
-            request = self.receive_request()
-
-    def receive_request(self) -> Optional[bytes]:
-        """Receives a request
-
-        Returns:
-            The received bytes
-        """
-        try:
-            length = recv_int64(self.request)
-            reqbuf = recv_all(self.request, length)
-            return reqbuf
-        except SocketClosed:
-            return None
-
-
-class TcpTransportServer(TransportServer):
-    """A TransportServer that uses TCP to communicate."""
     def __init__(self, handler: RequestHandler, port: int = 0) -> None:
         """Create a TCPServer.
 
@@ -69,7 +28,16 @@ class TcpTransportServer(TransportServer):
         """
         super().__init__(handler)
 
-        self._server = TcpTransportServerImpl(('', port), TcpHandler, self)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('', port))
+            sock.listen(socket.SOMAXCONN)
+        except OSError:
+            sock.close()
+            raise
+
+        self._server = SelectorServer(sock, handler)
         self._server_thread = threading.Thread(
                 target=self._server.serve_forever, daemon=True)
         self._server_thread.start()
@@ -1,4 +1,12 @@
 from socket import SocketType
+from typing import List
+
+from libmuscle.mcp.transport_server import Buffer
+
+
+# Maximum number of buffers to pass to a single sendmsg() call. POSIX
+# guarantees at least 16, Linux and macOS allow 1024.
+_MAX_IOV = 1024
 
 
 class SocketClosed(Exception):
@@ -19,11 +27,27 @@ def recv_all(socket: SocketType, length: int) -> bytes:
         RuntimeError: If a read error occurred.
     """
     databuf = bytearray(length)
+    recv_all_into(socket, memoryview(databuf))
+    return databuf
+
+
+def recv_all_into(socket: SocketType, buf: memoryview) -> None:
+    """Receive bytes from a socket until a buffer is full.
+
+    Args:
+        socket: Socket to receive on.
+        buf: The buffer to receive into.
+
+    Raises:
+        SocketClosed: If the socket was closed by the peer.
+        RuntimeError: If a read error occurred.
+    """
+    buf = buf.cast('B')
+    length = buf.nbytes
     received_count = 0
     while received_count < length:
         bytes_left = length - received_count
-        received_now = socket.recv_into(
-            memoryview(databuf)[received_count:], bytes_left)
+        received_now = socket.recv_into(buf[received_count:], bytes_left)
 
         if received_now == 0:
             raise SocketClosed("Socket closed while receiving")
@@ -33,7 +57,37 @@ def recv_all(socket: SocketType, length: int) -> bytes:
 
         received_count += received_now
 
-    return databuf
+
+def send_all(socket: SocketType, buffers: List[Buffer]) -> None:
+    """Sends a sequence of buffers as a single stream of bytes.
+
+    This uses scatter/gather I/O where available, so that the buffers
+    do not have to be concatenated first.
+
+    Args:
+        socket: The socket to send on.
+        buffers: The data to send.
+
+    Raises:
+        RuntimeError: If there was an error sending the data.
+    """
+    views = [memoryview(buf).cast('B') for buf in buffers]
+    views = [view for view in views if view.nbytes > 0]
+
+    if not hasattr(socket, 'sendmsg'):
+        for view in views:
+            socket.sendall(view)
+        return
+
+    while views:
+        sent = socket.sendmsg(views[:_MAX_IOV])
+        while sent > 0:
+            if sent >= views[0].nbytes:
+                sent -= views[0].nbytes
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
 
 
 def send_int64(socket: SocketType, data: int) -> None:
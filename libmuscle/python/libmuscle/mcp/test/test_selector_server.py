@@ -0,0 +1,158 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from libmuscle.mcp.tcp_transport_client import TcpTransportClient
+from libmuscle.mcp.tcp_transport_server import TcpTransportServer
+from libmuscle.mcp.tcp_util import send_int64, SocketClosed
+from libmuscle.mcp.transport_server import (
+        NonBlockingRequestHandler, Responder, StreamedResponse)
+
+
+class AsyncHandler(NonBlockingRequestHandler):
+    def __init__(self) -> None:
+        self.pending = list()
+
+    def handle_request(self, request: bytes) -> bytes:
+        raise RuntimeError('Should not be called')
+
+    def handle_request_async(
+            self, request: bytes, respond: Responder) -> None:
+        if request == b'later':
+            self.pending.append(respond)
+        elif request == b'fail':
+            raise RuntimeError('Handler failed')
+        elif request == b'stream':
+            respond(b'one', False)
+            respond([b't', b'wo'], False)
+            respond(None, True)
+        else:
+            respond(request * 2, True)
+
+
+def test_blocking_handlers_concurrent():
+    first_arrived = threading.Event()
+
+    def handle_request(request: bytes) -> bytes:
+        if request == b'first':
+            first_arrived.set()
+            assert second_done.wait(5.0)
+        return request
+
+    handler = MagicMock()
+    handler.handle_request = handle_request
+    second_done = threading.Event()
+
+    server = TcpTransportServer(handler)
+    client1 = TcpTransportClient(server.get_location())
+    client2 = TcpTransportClient(server.get_location())
+
+    thread = threading.Thread(target=lambda: client1.call(b'first'))
+    thread.start()
+    assert first_arrived.wait(5.0)
+    assert client2.call(b'second') == b'second'
+    second_done.set()
+    thread.join()
+
+    client1.close()
+    client2.close()
+    server.close()
+
+
+def test_blocking_handler_stream():
+    handler = MagicMock()
+    handler.handle_request = lambda request: StreamedResponse(
+            iter([b'one', [b'tw', b'o']]))
+
+    server = TcpTransportServer(handler)
+    client = TcpTransportClient(server.get_location())
+
+    assert client.call_stream(b'request').read(3) == b'one'
+    assert client.next_response().read(3) == b'two'
+    assert client.call(b'x') == b'one'
+
+    client.close()
+    server.close()
+
+
+def test_blocking_handler_error():
+    def handle_request(request: bytes) -> bytes:
+        if request == b'fail':
+            raise RuntimeError('Handler failed')
+        return request
+
+    handler = MagicMock()
+    handler.handle_request = handle_request
+
+    server = TcpTransportServer(handler)
+    client1 = TcpTransportClient(server.get_location())
+    client2 = TcpTransportClient(server.get_location())
+
+    with pytest.raises(SocketClosed):
+        client1.call(b'fail')
+    assert client2.call(b'ok') == b'ok'
+
+    client1.close()
+    client2.close()
+    server.close()
+
+
+def test_async_handler():
+    handler = AsyncHandler()
+    server = TcpTransportServer(handler)
+    client = TcpTransportClient(server.get_location())
+
+    assert client.call(b'ab') == b'abab'
+
+    assert client.call_stream(b'stream').read(3) == b'one'
+    assert client.next_response().read(3) == b'two'
+
+    result = list()
+    thread = threading.Thread(
+            target=lambda: result.append(client.call(b'later')))
+    thread.start()
+    while not handler.pending:
+        thread.join(0.01)
+    handler.pending[0](b'done', True)
+    thread.join()
+    assert result == [b'done']
+
+    client.close()
+    server.close()
+
+
+def test_async_handler_error():
+    handler = AsyncHandler()
+    server = TcpTransportServer(handler)
+    client1 = TcpTransportClient(server.get_location())
+    client2 = TcpTransportClient(server.get_location())
+
+    send_int64(client2._socket, 1)
+    client2._socket.sendall(b'a')
+    with pytest.raises(SocketClosed):
+        client1.call(b'fail')
+    assert client2.next_response().read(2) == b'aa'
+    assert client2.call(b'b') == b'bb'
+
+    client1.close()
+    client2.close()
+    server.close()
+
+
+def test_pipelined_requests():
+    handler = AsyncHandler()
+    server = TcpTransportServer(handler)
+    client = TcpTransportClient(server.get_location())
+
+    for request in [b'a', b'stream', b'bc']:
+        send_int64(client._socket, len(request))
+        client._socket.sendall(request)
+
+    assert client.next_response().read(2) == b'aa'
+    assert client.next_response().read(3) == b'one'
+    assert client.next_response().read(3) == b'two'
+    assert client.next_response().read(4) == b'bcbc'
+
+    client.close()
+    server.close()
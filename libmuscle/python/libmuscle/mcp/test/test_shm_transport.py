@@ -0,0 +1,95 @@
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from libmuscle.mcp.local_util import shm_available
+from libmuscle.mcp.shm_transport_client import ShmTransportClient
+from libmuscle.mcp.shm_transport_server import (
+        INLINE_LIMIT, MIN_SEGMENT_SIZE, ShmTransportServer)
+
+
+pytestmark = pytest.mark.skipif(
+        not shm_available(), reason='No shared memory available')
+
+
+@pytest.fixture
+def shm_transport_server():
+    handler = MagicMock()
+    handler.handle_request = lambda request: request * 2
+    server = ShmTransportServer(handler)
+    yield server
+    server.close()
+
+
+def test_shm_transport(shm_transport_server):
+    location = shm_transport_server.get_location()
+    assert location.startswith('shm:')
+    assert ShmTransportClient.can_connect_to(location)
+
+    client = ShmTransportClient(location)
+
+    # small, sent inline
+    assert client.call(b'request') == b'requestrequest'
+    assert client._segment is None
+
+    # large, sent via shared memory
+    request = bytes(range(256)) * (INLINE_LIMIT // 256 + 1)
+    assert client.call(request) == request * 2
+    assert client._segment is not None
+    first_segment = client._segment.name
+
+    # reuses the segment, without copying the response out of it
+    response = client.call(request)
+    assert isinstance(response, memoryview)
+    assert response == request * 2
+    assert client._segment.name == first_segment
+
+    # the previous response is released by the next call
+    client.call(b'request')
+    with pytest.raises(ValueError):
+        bytes(response)
+
+    # needs a bigger one
+    request = b'x' * MIN_SEGMENT_SIZE
+    assert client.call(request) == request * 2
+    assert client._segment.name != first_segment
+
+    # segments are unlinked once the client has them
+    assert not (Path('/dev/shm') / client._segment.name).exists()
+
+    client.close()
+
+
+def test_shm_transport_buffers(shm_transport_server):
+    client = ShmTransportClient(shm_transport_server.get_location())
+    part = b'x' * INLINE_LIMIT
+    shm_transport_server._handler.handle_request = lambda request: [
+            part, memoryview(request), part]
+
+    assert client.call(b'small') == part + b'small' + part
+    assert client._segment is not None
+
+    client.close()
+
+
+def test_shm_transport_stream(shm_transport_server):
+    client = ShmTransportClient(shm_transport_server.get_location())
+
+    for request in (b'small', b'x' * INLINE_LIMIT):
+        reader = client.call_stream(request)
+        assert reader.length == 2 * len(request)
+        first = bytearray(len(request) + 1)
+        reader.read_into(memoryview(first))
+        rest = reader.read(reader.length - len(first))
+        assert first + rest == request * 2
+
+    client.close()
+
+
+def test_cannot_connect_to_other_node(shm_transport_server):
+    location = shm_transport_server.get_location()
+    parts = location.split(':')
+    other_node = ':'.join([parts[0], 'other-node'] + parts[2:])
+    assert not ShmTransportClient.can_connect_to(other_node)
+    assert not ShmTransportClient.can_connect_to('tcp:localhost:9000')
@@ -28,3 +28,38 @@ def test_tcp_transport():
 
     client.close()
     server.close()
+
+
+def test_tcp_transport_buffers():
+    response = [b'first', bytearray(b'second'), memoryview(b'third')]
+
+    handler = MagicMock()
+    handler.handle_request = lambda request: response
+
+    server = TcpTransportServer(handler)
+    client = TcpTransportClient(server.get_location())
+
+    assert client.call(b'request') == b'firstsecondthird'
+
+    client.close()
+    server.close()
+
+
+def test_tcp_transport_stream():
+    handler = MagicMock()
+    handler.handle_request = lambda request: request * 2
+
+    server = TcpTransportServer(handler)
+    client = TcpTransportClient(server.get_location())
+
+    reader = client.call_stream(b'0123456789')
+    assert reader.length == 20
+    buf = bytearray(15)
+    reader.read_into(memoryview(buf))
+    assert buf == b'012345678901234'
+    assert reader.read(5) == b'56789'
+
+    assert client.call(b'next') == b'nextnext'
+
+    client.close()
+    server.close()
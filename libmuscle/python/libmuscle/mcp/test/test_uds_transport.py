@@ -0,0 +1,36 @@
+from unittest.mock import MagicMock
+
+from libmuscle.mcp.uds_transport_client import UdsTransportClient
+from libmuscle.mcp.uds_transport_server import UdsTransportServer
+
+
+def test_uds_transport():
+    request = b'request'
+    response = b'response'
+
+    def handle_request(request: bytes) -> bytes:
+        assert request == b'request'
+        return response
+
+    handler = MagicMock()
+    handler.handle_request = handle_request
+
+    # create server
+    server = UdsTransportServer(handler)
+
+    # create client
+    server_location = server.get_location()
+    assert server_location.startswith('unix:')
+    assert UdsTransportClient.can_connect_to(server_location)
+    client = UdsTransportClient(server_location)
+
+    response2 = client.call(request)
+    assert response == response2
+
+    client.close()
+    server.close()
+
+
+def test_cannot_connect_to_other_node():
+    assert not UdsTransportClient.can_connect_to('unix:other-node:socket')
+    assert not UdsTransportClient.can_connect_to('tcp:localhost:9000')
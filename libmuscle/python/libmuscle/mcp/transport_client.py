@@ -1,3 +1,71 @@
+from libmuscle.mcp.transport_server import Buffer
+
+
+class ResponseReader:
+    """Reads a response to a request, piece by piece.
+
+    This lets the caller decide where each part of the response ends
+    up, so that large responses can be received directly into their
+    final location. Readers must be read completely, and before the
+    next request is made on the same client.
+
+    Attributes:
+        length: Total length of the response in bytes.
+    """
+    def __init__(self, length: int) -> None:
+        """Create a ResponseReader.
+
+        Args:
+            length: Total length of the response in bytes.
+        """
+        self.length = length
+
+    def read(self, length: int) -> bytearray:
+        """Reads the next part of the response into a new buffer.
+
+        Args:
+            length: Number of bytes to read.
+
+        Returns:
+            The data read.
+        """
+        buf = bytearray(length)
+        self.read_into(memoryview(buf))
+        return buf
+
+    def read_into(self, buf: memoryview) -> None:
+        """Reads the next part of the response into a given buffer.
+
+        Args:
+            buf: The buffer to read into, which will be filled.
+        """
+        raise NotImplementedError()     # pragma: no cover
+
+
+class BufferResponseReader(ResponseReader):
+    """Reads a response that has been received already.
+    """
+    def __init__(self, response: Buffer) -> None:
+        """Create a BufferResponseReader.
+
+        Args:
+            response: The response to read from.
+        """
+        super().__init__(len(response))
+        self._response = memoryview(response)
+        self._offset = 0
+
+    def read_into(self, buf: memoryview) -> None:
+        """Reads the next part of the response into a given buffer.
+
+        Args:
+            buf: The buffer to read into, which will be filled.
+        """
+        end = self._offset + buf.nbytes
+        buf[:] = self._response[self._offset:end]
+        self._offset = end
+
+
 class TransportClient:
     """A client that connects to an MCP server.
 
@@ -17,10 +85,12 @@ class TransportClient:
         """
         raise NotImplementedError()     # pragma: no cover
 
-    def call(self, request: bytes) -> bytes:
+    def call(self, request: bytes) -> Buffer:
         """Send a request to the server and receive the response.
 
-        This is a blocking call.
+        This is a blocking call. The response may refer to memory that
+        is reused for the next response, so it is only valid until the
+        next request on this client.
 
         Args:
             request: The request to send
@@ -30,6 +100,34 @@ class TransportClient:
         """
         raise NotImplementedError()     # pragma: no cover
 
+    def call_stream(self, request: bytes) -> ResponseReader:
+        """Send a request to the server and start receiving the response.
+
+        This blocks until the response starts to arrive. Subclasses
+        override this to avoid receiving the response into an
+        intermediate buffer.
+
+        Args:
+            request: The request to send
+
+        Returns:
+            A reader for the response
+        """
+        return BufferResponseReader(self.call(request))
+
+    def next_response(self) -> ResponseReader:
+        """Start receiving the next of a series of responses.
+
+        This is used if the server sends several responses to a single
+        request, see
+        :class:`libmuscle.mcp.transport_server.StreamedResponse`. It
+        blocks until the response starts to arrive.
+
+        Returns:
+            A reader for the response
+        """
+        raise NotImplementedError()     # pragma: no cover
+
     def close(self) -> None:
         """Closes this client.
 
@@ -1,23 +1,89 @@
+from typing import Callable, Iterator, List, Optional, Union
+
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# A response is either a single buffer, or a list of buffers which are
+# sent one after the other, without being concatenated first.
+Response = Union[Buffer, List[Buffer]]
+
+
+class StreamedResponse:
+    """A series of responses to a single request.
+
+    Request handlers can return this to send a response whenever one
+    becomes available, without waiting for the client to ask for it.
+    Each response is sent as soon as the iterator produces it. Once it
+    is exhausted, the server goes back to waiting for requests.
+    """
+    def __init__(self, responses: Iterator[Response]) -> None:
+        """Create a StreamedResponse.
+
+        Args:
+            responses: The responses to send.
+        """
+        self.responses = responses
+
+
 class RequestHandler:
     """Handles requests sent to a TransportServer.
 
     TransportServers operate in terms of chunks of bytes received and
     sent in return. RequestHandlers interpret received chunks of bytes,
     handle the request, and return a chunk of bytes containing an
-    encoded response.
+    encoded response, or a list of chunks to be sent back to back.
     """
-    def handle_request(self, request: bytes) -> bytes:
+    def handle_request(
+            self, request: bytes) -> Union[Response, StreamedResponse]:
         """Handle a request.
 
         Args:
             request: A received request
 
         Returns:
-            An encoded response
+            An encoded response, or a stream of them
         """
         raise NotImplementedError()     # pragma: no cover
 
 
+# Called by a NonBlockingRequestHandler to send a response. If the
+# second argument is False, more responses to the same request follow.
+# The last one may be None, which just ends the series.
+Responder = Callable[[Optional[Response], bool], None]
+
+
+class NonBlockingRequestHandler(RequestHandler):
+    """A RequestHandler that can handle requests without blocking.
+
+    Event-driven servers use :meth:`handle_request_async` to handle
+    requests on their I/O thread, rather than occupying a worker thread
+    while waiting for a response to become available. Threaded servers
+    use :meth:`handle_request` as for any other handler.
+    """
+    def handle_request_async(
+            self, request: bytes, respond: Responder) -> None:
+        """Handle a request without blocking.
+
+        This must return quickly. The response is passed to respond,
+        either before returning, or later from any thread.
+
+        Args:
+            request: A received request
+            respond: A function to call with the response
+        """
+        raise NotImplementedError()     # pragma: no cover
+
+    def requests_handled(self) -> None:
+        """Called after handling requests that arrived together.
+
+        Event-driven servers call this once they have passed all the
+        requests that arrived at the same time to
+        :meth:`handle_request_async`, so that handlers can e.g. log
+        them together. By default, this does nothing.
+        """
+        pass
+
+
 class ServerNotSupported(RuntimeError):
     pass
 
@@ -1,9 +1,15 @@
+from libmuscle.mcp.shm_transport_client import ShmTransportClient
+from libmuscle.mcp.shm_transport_server import ShmTransportServer
 from libmuscle.mcp.tcp_transport_client import TcpTransportClient
 from libmuscle.mcp.tcp_transport_server import TcpTransportServer
+from libmuscle.mcp.uds_transport_client import UdsTransportClient
+from libmuscle.mcp.uds_transport_server import UdsTransportServer
 
 
 # These must be in order of preference, i.e. most efficient first
-transport_client_types = [TcpTransportClient]
+transport_client_types = [
+        ShmTransportClient, UdsTransportClient, TcpTransportClient]
 
 
-transport_server_types = [TcpTransportServer]
+transport_server_types = [
+        ShmTransportServer, UdsTransportServer, TcpTransportServer]
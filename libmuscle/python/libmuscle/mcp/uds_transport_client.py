@@ -0,0 +1,100 @@
+import socket
+
+from libmuscle.mcp.local_util import local_node_id
+from libmuscle.mcp.tcp_transport_client import SocketResponseReader
+from libmuscle.mcp.transport_client import ResponseReader, TransportClient
+from libmuscle.mcp.transport_server import Buffer
+from libmuscle.mcp.tcp_util import recv_all, recv_int64, send_int64
+
+
+class UdsTransportClient(TransportClient):
+    """A client that connects to a UdsTransport server.
+    """
+    @staticmethod
+    def can_connect_to(location: str) -> bool:
+        """Whether this client class can connect to the given location.
+
+        This is only possible if the server is on the same node as we
+        are.
+
+        Args:
+            location: The location to potentially connect to.
+
+        Returns:
+            True iff this class can connect to this location.
+        """
+        if not location.startswith('unix:'):
+            return False
+        parts = location[5:].split(':')
+        return len(parts) == 2 and parts[0] == local_node_id()
+
+    def __init__(self, location: str) -> None:
+        """Create a UdsTransportClient for a given location.
+
+        The client will connect to this location and be able to request
+        messages from any instance and port represented by it.
+
+        Args:
+            location: A location string for the peer.
+        """
+        socket_name = location.split(':')[-1]
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect('\0' + socket_name)
+        except OSError:
+            self._socket.close()
+            raise RuntimeError('Could not connect to the server at location'
+                               ' {}'.format(location))
+
+    def call(self, request: bytes) -> Buffer:
+        """Send a request to the server and receive the response.
+
+        This is a blocking call.
+
+        Args:
+            request: The request to send
+
+        Returns:
+            The received response
+        """
+        send_int64(self._socket, len(request))
+        self._socket.sendall(request)
+
+        length = recv_int64(self._socket)
+        return recv_all(self._socket, length)
+
+    def call_stream(self, request: bytes) -> ResponseReader:
+        """Send a request to the server and start receiving the response.
+
+        This blocks until the response starts to arrive.
+
+        Args:
+            request: The request to send
+
+        Returns:
+            A reader for the response
+        """
+        send_int64(self._socket, len(request))
+        self._socket.sendall(request)
+        return self.next_response()
+
+    def next_response(self) -> ResponseReader:
+        """Start receiving the next of a series of responses.
+
+        This is used if the server sends several responses to a single
+        request. It blocks until the response starts to arrive.
+
+        Returns:
+            A reader for the response
+        """
+        length = recv_int64(self._socket)
+        return SocketResponseReader(self._socket, length)
+
+    def close(self) -> None:
+        """Closes this client.
+
+        This closes any connections this client has and/or performs
+        other shutdown activities.
+        """
+        self._socket.shutdown(socket.SHUT_RDWR)
+        self._socket.close()
@@ -0,0 +1,72 @@
+import socket
+import threading
+
+from libmuscle.mcp.local_util import local_node_id, unique_name
+from libmuscle.mcp.selector_server import SelectorServer
+from libmuscle.mcp.transport_server import (
+        RequestHandler, ServerNotSupported, TransportServer)
+
+
+class UdsTransportServer(TransportServer):
+    """A TransportServer that uses Unix domain sockets to communicate.
+
+    This server can only be reached by clients on the same node. It
+    listens on a socket in the abstract namespace, so that there is
+    no file to clean up afterwards, and uses the same framing as the
+    TCP transport. Like the TCP transport, it serves all connections
+    on a single I/O thread, see :class:`SelectorServer`.
+    """
+    _scheme = 'unix'
+
+    def __init__(self, handler: RequestHandler) -> None:
+        """Create a UdsTransportServer.
+
+        Args:
+            handler: A RequestHandler to handle requests
+
+        Raises:
+            ServerNotSupported: If abstract Unix domain sockets are not
+                available on this system.
+        """
+        super().__init__(handler)
+
+        self._socket_name = unique_name('muscle3_' + self._scheme)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind('\0' + self._socket_name)
+            sock.listen(socket.SOMAXCONN)
+        except OSError as e:
+            sock.close()
+            raise ServerNotSupported(
+                    'Could not create a Unix domain socket: {}'.format(e))
+
+        self._server = self._create_server(sock)
+        self._server_thread = threading.Thread(
+                target=self._server.serve_forever, daemon=True)
+        self._server_thread.start()
+
+    def get_location(self) -> str:
+        """Returns the location this server listens on.
+
+        Returns:
+            A string containing the location.
+        """
+        return 'unix:{}:{}'.format(local_node_id(), self._socket_name)
+
+    def close(self) -> None:
+        """Closes this server.
+
+        Stops the server listening, waits for existing clients to
+        disconnect, then frees any other resources.
+        """
+        self._server.shutdown()
+        self._server_thread.join()
+        self._server.server_close()
+
+    def _create_server(self, sock: socket.socket) -> SelectorServer:
+        """Creates the server that serves our connections.
+
+        Args:
+            sock: The bound and listening socket to serve.
+        """
+        return SelectorServer(sock, self._handler)
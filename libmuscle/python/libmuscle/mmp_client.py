@@ -1,20 +1,20 @@
-from random import uniform
-from time import perf_counter, sleep
-from typing import Any, Dict, Iterable, List, Tuple
+from threading import Lock
+from time import perf_counter, time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import msgpack
 from ymmsl import Conduit, Operator, Port, Reference, Settings
 
+from libmuscle.clock_sync import ClockSync
 from libmuscle.mcp.protocol import RequestType, ResponseType
 from libmuscle.mcp.tcp_transport_client import TcpTransportClient
-from libmuscle.profiling import ProfileEvent
+from libmuscle.profiling import ProfileEvent, ProfileEventType
 from libmuscle.logging import LogMessage
 
 
 CONNECTION_TIMEOUT = 300
 PEER_TIMEOUT = 600
-PEER_INTERVAL_MIN = 5.0
-PEER_INTERVAL_MAX = 10.0
+CLOCK_SYNC_SAMPLES = 4
 
 
 def encode_operator(op: Operator) -> str:
@@ -42,7 +42,7 @@ def encode_profile_event(event: ProfileEvent) -> Any:
             event.start_time.seconds, event.stop_time.seconds,
             event.event_type.value,
             encoded_port, event.port_length, event.slot,
-            event.message_size]
+            event.message_size, event.outbox_size]
 
 
 class MMPClient():
@@ -52,7 +52,12 @@ class MMPClient():
     behalf of the rest of libmuscle.
 
     It manages the connection, and converts between our native types
-    and the gRPC generated types.
+    and the gRPC generated types. It may be used from multiple threads,
+    requests are sent one at a time.
+
+    Times sent to the manager, in log messages and profile events, are
+    converted to the manager's clock once it has been measured using
+    sync_clock(), so that events on different machines line up.
     """
     def __init__(self, location: str) -> None:
         """Create an MMPClient
@@ -60,7 +65,11 @@ class MMPClient():
         Args:
             location: A connection string of the form hostname:port
         """
+        self._location = location
         self._transport_client = TcpTransportClient(location)
+        self._mutex = Lock()
+        self._encoded_ports = dict()    # type: Dict[Port, List[str]]
+        self._clock = ClockSync()
 
     def close(self) -> None:
         """Close the connection
@@ -70,6 +79,33 @@ class MMPClient():
         """
         self._transport_client.close()
 
+    def sync_clock(self) -> None:
+        """Measures the offset between our clock and the manager's.
+
+        This asks the manager for the time a few times, and uses the
+        answer that came back the quickest. Calling this again later
+        refines the estimate, and lets us correct for clock drift, so
+        this should be done regularly, see :class:`Profiler`.
+        """
+        best = None     # type: Optional[Tuple[float, float, float]]
+        for _ in range(CLOCK_SYNC_SAMPLES):
+            t_send = time()
+            response = self._call_manager([RequestType.GET_TIME.value])
+            t_receive = time()
+            if best is None or t_receive - t_send < best[2] - best[0]:
+                best = (t_send, response[1], t_receive)
+
+        if best is not None:
+            self._clock.add_measurement(*best)
+
+    def clock_offset(self) -> float:
+        """Returns the estimated offset of the manager's clock.
+
+        This is the number of seconds to add to our time to get the
+        manager's time.
+        """
+        return self._clock.offset()
+
     def submit_log_message(self, message: LogMessage) -> None:
         """Send a log message to the manager.
 
@@ -78,7 +114,8 @@ class MMPClient():
         """
         request = [
                 RequestType.SUBMIT_LOG_MESSAGE.value,
-                message.instance_id, message.timestamp.seconds,
+                message.instance_id,
+                self._clock.to_manager_time(message.timestamp.seconds),
                 message.level.value, message.text]
         self._call_manager(request)
 
@@ -88,9 +125,50 @@ class MMPClient():
         Args:
             events: The events to send.
         """
-        request = [
-                RequestType.SUBMIT_PROFILE_EVENTS.value,
-                [encode_profile_event(e) for e in events]]
+        encoded = [encode_profile_event(e) for e in events]
+        for event in encoded:
+            event[1] = self._clock.to_manager_time(event[1])
+            event[2] = self._clock.to_manager_time(event[2])
+
+        request = [RequestType.SUBMIT_PROFILE_EVENTS.value, encoded]
+        self._call_manager(request)
+
+    def submit_profile_records(
+            self, instance_id: Reference,
+            records: Iterable[Tuple[
+                ProfileEventType, float, float, Optional[Port],
+                Optional[int], Optional[int], Optional[int],
+                Optional[int]]]
+            ) -> None:
+        """Sends profiling events to the manager.
+
+        This does the same as submit_profile_events(), but takes the
+        events as tuples of event type, start time, stop time, port,
+        port length, slot, message size and outbox size. This avoids creating
+        objects for each event, which matters when there are many.
+
+        Args:
+            instance_id: The instance the events occurred in.
+            records: The events to send.
+        """
+        instance = str(instance_id)
+        ports = self._encoded_ports
+        to_manager_time = self._clock.to_manager_time
+        encoded = list()
+        for (
+                event_type, start, stop, port, length, slot, size,
+                outbox_size) in records:
+            encoded_port = None
+            if port is not None:
+                encoded_port = ports.get(port)
+                if encoded_port is None:
+                    encoded_port = ports[port] = encode_port(port)
+            encoded.append([
+                instance, to_manager_time(start), to_manager_time(stop),
+                event_type.value, encoded_port, length, slot, size,
+                outbox_size])
+
+        request = [RequestType.SUBMIT_PROFILE_EVENTS.value, encoded]
         self._call_manager(request)
 
     def get_settings(self) -> Settings:
@@ -129,10 +207,11 @@ class MMPClient():
                     Dict[Reference, List[str]]]:
         """Request connection information about peers.
 
-        This will repeat the request at an exponentially increasing
-        query interval at first, until it reaches the interval
-        specified by PEER_INTERVAL_MIN and PEER_INTERVAL_MAX. From
-        there on, intervals are drawn randomly from that range.
+        The manager holds on to the request until all our peers have
+        registered, and then responds immediately. If that takes more
+        than PEER_TIMEOUT seconds, we give up. We wait on a separate
+        connection, so that other threads can keep sending log messages
+        and profile events in the mean time.
 
         Args:
             name: Name of the current instance.
@@ -146,23 +225,19 @@ class MMPClient():
             instance, and containing for each peer instance a list of
             network location strings at which it can be reached.
         """
-        sleep_time = 0.1
-        start_time = perf_counter()
-
-        request = [RequestType.GET_PEERS.value, str(name)]
-        response = self._call_manager(request)
+        deadline = perf_counter() + PEER_TIMEOUT
 
-        while (response[0] == ResponseType.PENDING.value and
-               perf_counter() < start_time + PEER_TIMEOUT and
-               sleep_time < PEER_INTERVAL_MIN):
-            sleep(sleep_time)
-            response = self._call_manager(request)
-            sleep_time *= 1.5
+        request = [RequestType.GET_PEERS.value, str(name), PEER_TIMEOUT]
+        client = TcpTransportClient(self._location)
+        try:
+            response = self._call_manager(request, client)
 
-        while (response[0] == ResponseType.PENDING.value and
-               perf_counter() < start_time + PEER_TIMEOUT):
-            sleep(uniform(PEER_INTERVAL_MIN, PEER_INTERVAL_MAX))
-            response = self._call_manager(request)
+            while (response[0] == ResponseType.PENDING.value and
+                   perf_counter() < deadline):
+                request[2] = deadline - perf_counter()
+                response = self._call_manager(request, client)
+        finally:
+            client.close()
 
         if response[0] == ResponseType.PENDING.value:
             raise RuntimeError('Timeout waiting for peers to appear')
@@ -196,15 +271,24 @@ class MMPClient():
             raise RuntimeError('Error deregistering instance: {}'.format(
                     response[1]))
 
-    def _call_manager(self, request: Any) -> Any:
+    def _call_manager(
+            self, request: Any,
+            client: Optional[TcpTransportClient] = None) -> Any:
         """Call the manager and do en/decoding.
 
         Args:
             request: The request to encode and send
+            client: A client to send it with, which must not be shared
+                    with other threads. If not given, we use the
+                    shared one.
 
         Returns:
             The decoded response
         """
         encoded_request = msgpack.packb(request, use_bin_type=True)
-        response = self._transport_client.call(encoded_request)
+        if client is not None:
+            response = client.call(encoded_request)
+        else:
+            with self._mutex:
+                response = self._transport_client.call(encoded_request)
         return msgpack.unpackb(response, raw=False)
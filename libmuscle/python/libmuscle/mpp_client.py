@@ -1,11 +1,24 @@
-from typing import List, Optional
+import logging
+from typing import (  # noqa
+        Any, cast, Dict, Iterator, List, Optional, Tuple, Union)
 
 import msgpack
+import numpy as np
 from ymmsl import Reference
 
-from libmuscle.mcp.protocol import RequestType
+from libmuscle.mcp.protocol import MPPFeature, RequestType
 from libmuscle.mcp.transport_client import TransportClient
+from libmuscle.mcp.transport_server import Buffer
 from libmuscle.mcp.type_registry import transport_client_types
+from libmuscle.mpp_message import ClosePort, MPPMessage, OverlayCache
+
+
+_logger = logging.getLogger(__name__)
+
+
+_wanted_features = [
+        MPPFeature.OOB_GRIDS.value, MPPFeature.PUSH.value,
+        MPPFeature.CHANNELS.value, MPPFeature.ANY.value]
 
 
 class MPPClient:
@@ -14,16 +27,43 @@ class MPPClient:
     This client connects to a peer to retrieve messages. It uses an MCP
     Transport to connect.
     """
-    def __init__(self, locations: List[str]) -> None:
+    def __init__(
+            self, locations: List[str],
+            overlays: Optional[Dict[Reference, OverlayCache]] = None
+            ) -> None:
         """Create an MPPClient for the given peer.
 
         The client will connect to the peer on one of its locations. It
         tries the most efficient protocol first. Once connected, it can
         request messages from any component and port represented by it.
 
+        After connecting, the client negotiates which optional protocol
+        features to use with the peer. If the peer does not support
+        negotiation, it will close the connection, and we reconnect
+        without using any optional features.
+
+        If the peer supports it, each receiving port is referred to by
+        a channel number obtained from the peer the first time we
+        receive on it, which is quicker for the peer to look up than
+        its name.
+
+        If overlays is given, then received settings overlays are
+        cached there, per receiving port, and the peer may send
+        references to them rather than repeating them. The peer sends
+        each port's messages to one client at a time, in order, so
+        all clients receiving messages for a port must share its cache.
+
         Args:
             locations: The peer's location strings
+            overlays: Settings overlay caches, by receiving port.
         """
+        self._overlays = overlays
+
+        # encoded requests for the next message, by receiver
+        self._requests = dict()     # type: Dict[Reference, bytes]
+        # what to call each receiver in requests, see _address()
+        self._addresses = dict()    # type: Dict[Reference, Union[str, int]]
+
         client = None       # type: Optional[TransportClient]
         for ClientType in transport_client_types:
             for location in locations:
@@ -38,20 +78,127 @@ class MPPClient:
         else:
             raise RuntimeError('Failed to connect')
 
-        self._transport_client = client
+        self._transport_client, self._features = self._negotiate(
+                client, location)
 
-    def receive(self, receiver: Reference) -> bytes:
+    def receive(self, receiver: Reference) -> Buffer:
         """Receive a message from a port this client connects to.
 
+        The result may refer to memory that is reused for the next
+        response, so it is only valid until the next request made by
+        this client. Use :meth:`receive_message` to get a message that
+        remains valid.
+
         Args:
             receiver: The receiving (local) port.
 
         Returns:
             The received message.
         """
-        request = [RequestType.GET_NEXT_MESSAGE.value, str(receiver)]
-        encoded_request = msgpack.packb(request, use_bin_type=True)
-        return self._transport_client.call(encoded_request)
+        return self._transport_client.call(self._receive_request(receiver))
+
+    def receive_message(self, receiver: Reference
+                        ) -> Tuple[MPPMessage, int]:
+        """Receive and decode a message.
+
+        Any grid data is copied once, into arrays of its own.
+
+        Args:
+            receiver: The receiving (local) port.
+
+        Returns:
+            The received message, and its size in bytes.
+        """
+        return self.receive_into(receiver, None)
+
+    def receive_into(
+            self, receiver: Reference, destination: Optional[np.ndarray]
+            ) -> Tuple[MPPMessage, int]:
+        """Receive a message, storing grid data into a given array.
+
+        If the message's data is a grid of the same data type and shape
+        as the destination array, then the data will be received into
+        the destination, and the message will refer to it. See
+        :meth:`MPPMessage.from_reader`.
+
+        Args:
+            receiver: The receiving (local) port.
+            destination: The array to receive grid data into, if any.
+
+        Returns:
+            The received message, and its size in bytes.
+        """
+        reader = self._transport_client.call_stream(
+                self._receive_request(receiver))
+        message = MPPMessage.from_reader(
+                reader, destination, self._overlay_cache(receiver))
+        return message, reader.length
+
+    def receive_any(self, receivers: List[Reference]
+                    ) -> Tuple[MPPMessage, int]:
+        """Receive the first message available for any of the receivers.
+
+        This requires the peer to support MPPFeature.ANY. The receiver
+        the message is for is given by its receiver attribute.
+
+        Settings overlays are always received in full, since a message
+        for a port may come in on this client or on another one.
+
+        Args:
+            receivers: The receiving (local) ports.
+
+        Returns:
+            The received message, and its size in bytes.
+        """
+        features = [
+                feature for feature in self._features
+                if feature != MPPFeature.SETTINGS_REFS.value]
+        request = [
+                RequestType.GET_ANY_MESSAGE.value,
+                [self._address(receiver) for receiver in receivers],
+                features]
+        reader = self._transport_client.call_stream(
+                cast(bytes, msgpack.packb(request, use_bin_type=True)))
+        message = MPPMessage.from_reader(reader, None, None)
+        return message, reader.length
+
+    def supports(self, feature: MPPFeature) -> bool:
+        """Whether the peer supports the given optional feature.
+
+        Args:
+            feature: The feature to check for.
+        """
+        return feature.value in self._features
+
+    def subscribe(self, receiver: Reference
+                  ) -> Iterator[Tuple[MPPMessage, int]]:
+        """Have messages for a port pushed to us as they are sent.
+
+        This requires the peer to support MPPFeature.PUSH. Messages are
+        produced until a ClosePort message has been received. While the
+        iterator is active, this client cannot be used for anything
+        else.
+
+        Args:
+            receiver: The receiving (local) port.
+
+        Returns:
+            An iterator producing the received messages and their
+            sizes in bytes.
+        """
+        request = [
+                RequestType.SUBSCRIBE.value, self._address(receiver),
+                self._features]
+        reader = self._transport_client.call_stream(
+                cast(bytes, msgpack.packb(request, use_bin_type=True)))
+        overlays = self._overlay_cache(receiver)
+        while True:
+            message = MPPMessage.from_bytes(
+                    reader.read(reader.length), overlays)
+            yield message, reader.length
+            if isinstance(message.data, ClosePort):
+                return
+            reader = self._transport_client.next_response()
 
     def close(self) -> None:
         """Closes this client.
@@ -60,3 +207,83 @@ class MPPClient:
         other shutdown activities.
         """
         self._transport_client.close()
+
+    def _overlay_cache(self, receiver: Reference
+                       ) -> Optional[OverlayCache]:
+        """Returns the settings overlay cache for a receiver, if any.
+
+        Args:
+            receiver: The receiving (local) port.
+        """
+        if self._overlays is None:
+            return None
+        return self._overlays.setdefault(receiver, OverlayCache())
+
+    def _receive_request(self, receiver: Reference) -> bytes:
+        """Returns an encoded request for the next message for receiver.
+
+        The request is the same every time, so it is created once and
+        then reused.
+
+        Args:
+            receiver: The receiving (local) port.
+        """
+        if receiver not in self._requests:
+            request = [
+                    RequestType.GET_NEXT_MESSAGE.value,
+                    self._address(receiver)]  # type: List[Any]
+            if self._features:
+                request.append(self._features)
+            self._requests[receiver] = cast(
+                    bytes, msgpack.packb(request, use_bin_type=True))
+        return self._requests[receiver]
+
+    def _address(self, receiver: Reference) -> Union[str, int]:
+        """Returns what to call a receiver in requests to the peer.
+
+        This is its channel number if the peer supports channels, or
+        its name otherwise.
+
+        Args:
+            receiver: The receiving (local) port.
+        """
+        if receiver not in self._addresses:
+            if not self.supports(MPPFeature.CHANNELS):
+                self._addresses[receiver] = str(receiver)
+            else:
+                request = [RequestType.OPEN_CHANNEL.value, str(receiver)]
+                response = self._transport_client.call(
+                        cast(bytes, msgpack.packb(request, use_bin_type=True)))
+                self._addresses[receiver] = cast(
+                        int, msgpack.unpackb(response, raw=False))
+        return self._addresses[receiver]
+
+    def _negotiate(self, client: TransportClient, location: str
+                   ) -> Tuple[TransportClient, List[str]]:
+        """Negotiates protocol features with the peer.
+
+        Args:
+            client: A client connected to the peer.
+            location: The location it connected to.
+
+        Returns:
+            A client connected to the peer, which may be a new one, and
+            the features to use with it.
+        """
+        wanted_features = list(_wanted_features)
+        if self._overlays is not None:
+            wanted_features.append(MPPFeature.SETTINGS_REFS.value)
+        request = [RequestType.NEGOTIATE_FEATURES.value, wanted_features]
+        encoded_request = msgpack.packb(request, use_bin_type=True)
+        try:
+            response = client.call(encoded_request)
+            return client, msgpack.unpackb(response, raw=False)
+        except Exception:
+            _logger.debug(
+                    'Peer at {} does not support feature negotiation,'
+                    ' reconnecting'.format(location))
+            try:
+                client.close()
+            except Exception:
+                pass
+            return type(client)(location), []     # type: ignore
@@ -1,5 +1,13 @@
 from enum import IntEnum
-from typing import Any, cast, Optional
+from functools import lru_cache, partial
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+import threading
+from typing import (  # noqa
+        Any, Callable, cast, Dict, Iterable, Iterator, List, Optional, Tuple,
+        Union)
 
 import msgpack
 import numpy as np
@@ -7,6 +15,8 @@ import numpy as np
 from ymmsl import Reference, Settings
 
 from libmuscle.grid import Grid
+from libmuscle.mcp.transport_client import ResponseReader
+from libmuscle.mcp.transport_server import Buffer
 
 
 class ExtTypeId(IntEnum):
@@ -23,6 +33,15 @@ class ExtTypeId(IntEnum):
     GRID_FLOAT32 = 4
     GRID_FLOAT64 = 5
     GRID_BOOL = 6
+    SETTINGS_REF = 7
+
+
+# Starts an encoded message with out-of-band grid buffers. 0xc1 is not
+# used by MessagePack, so this cannot be confused with a plain message.
+OOB_MAGIC = b'\xc1\x00\x00\x00\x00\x00\x00\x00'
+
+# Alignment of out-of-band buffers within an encoded message
+OOB_ALIGNMENT = 64
 
 
 _grid_types = {
@@ -45,8 +64,167 @@ class ClosePort:
     pass
 
 
-def _encode_grid(grid: Grid) -> msgpack.ExtType:
+# MessagePack header of a map with 7 entries, like an encoded MPPMessage
+_MAP_7 = b'\x87'
+
+# MessagePack header of a map with 1 entry
+_MAP_1 = b'\x81'
+
+# MessagePack encoded key of the settings overlay in an MPPMessage
+_OVERLAY_KEY = msgpack.packb('settings_overlay', use_bin_type=True)
+
+
+# Sender, receiver and port length, see MPPMessage.encoded_frames()
+_Address = Tuple[Union[Reference, str], Union[Reference, str], Optional[int]]
+
+
+def _padding(size: int) -> int:
+    """Returns the amount of padding needed to align after size bytes.
+    """
+    return -size % OOB_ALIGNMENT
+
+
+class _OOBBuffers:
+    """Collects the out-of-band grid buffers of a message being encoded.
+    """
+    def __init__(self) -> None:
+        self.buffers = list()   # type: List[np.ndarray]
+        self.size = 0
+
+    def add(self, data: np.ndarray) -> int:
+        """Adds a buffer.
+
+        Args:
+            data: A one-dimensional array of bytes.
+
+        Returns:
+            The offset of the buffer from the start of the first one.
+        """
+        offset = self.size
+        self.buffers.append(data)
+        self.size += data.nbytes + _padding(data.nbytes)
+        return offset
+
+
+class _Payload:
+    """The part of an encoded message that is the same for all receivers.
+
+    Copies of a message encoded for different receivers share their
+    payload, see :meth:`MPPMessage.encoded_frames`, and with it the
+    legacy encoding of the data, which is made at most once.
+
+    Attributes:
+        data: The encoded message data, which is the last header part.
+        buffers: The out-of-band grid buffers.
+        size: The size of the data and the buffers in bytes.
+    """
+    def __init__(self, data: Buffer, buffers: List[np.ndarray]) -> None:
+        self.data = data
+        self.buffers = buffers
+        self.size = memoryview(data).nbytes + sum(
+                buf.nbytes + _padding(buf.nbytes) for buf in buffers)
+        self._on_disk = False
+        self._spilled = None  # type: Optional[_Payload]
+        self._legacy = None     # type: Optional[bytes]
+        self._legacy_lock = threading.Lock()
+
+    def has_legacy(self) -> bool:
+        """Returns whether the legacy encoding has been made already.
+
+        If not, then calling :meth:`legacy` copies all grid data, so
+        callers that must not block may want to do so elsewhere.
+        """
+        return self._legacy is not None or not self.buffers
+
+    def legacy(self) -> Buffer:
+        """Returns the data with any grid data encoded inline.
+
+        This is made the first time it is needed, and reused for all
+        messages that share this payload. See
+        :meth:`EncodedMessage.legacy`.
+        """
+        if not self.buffers:
+            return self.data
+
+        with self._legacy_lock:
+            if self._legacy is None:
+                offsets = dict()  # type: Dict[int, np.ndarray]
+                offset = 0
+                for buf in self.buffers:
+                    offsets[offset] = buf
+                    offset += buf.nbytes + _padding(buf.nbytes)
+
+                def inline_grid(code: int, data: bytes) -> msgpack.ExtType:
+                    if code not in _grid_types:
+                        return msgpack.ExtType(code, data)
+                    grid_dict = msgpack.unpackb(data, raw=False)
+                    buf = offsets[grid_dict['oob'][0]]
+                    legacy_dict = {
+                            'type': grid_dict['type'],
+                            'shape': grid_dict['shape'],
+                            'order': grid_dict['order'],
+                            'data': buf.tobytes(),
+                            'indexes': grid_dict['indexes']}
+                    return msgpack.ExtType(
+                            code,
+                            msgpack.packb(legacy_dict, use_bin_type=True))
+
+                # the data is the 'data' entry of a map, see
+                # MPPMessage.encoded_frames()
+                data_dict = msgpack.unpackb(
+                        _MAP_1 + bytes(self.data), ext_hook=inline_grid,
+                        raw=False, strict_map_key=False)
+                self._legacy = cast(bytes, msgpack.packb(
+                        data_dict, use_bin_type=True))[1:]
+            return self._legacy
+
+    def spill(self, directory: Path) -> '_Payload':
+        """Returns a copy of the payload that is stored on disk.
+
+        The copy is made only once, and returned again on subsequent
+        calls, so that messages sharing this payload can share the copy
+        as well. See :meth:`EncodedMessage.spill`.
+
+        Args:
+            directory: The directory to write the file to.
+        """
+        if self._on_disk:
+            return self
+        if self._spilled is not None:
+            return self._spilled
+
+        fd, path = tempfile.mkstemp(prefix='muscle3_outbox_', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.data)
+                data_size = f.tell()
+                f.write(bytes(_padding(data_size)))
+                for buf in self.buffers:
+                    f.write(buf.data)
+                    f.write(bytes(_padding(buf.nbytes)))
+            mapped = np.memmap(path, dtype=np.uint8, mode='r')
+        finally:
+            os.unlink(path)
+
+        buffers = list()  # type: List[np.ndarray]
+        offset = data_size + _padding(data_size)
+        for buf in self.buffers:
+            buffers.append(mapped[offset:offset + buf.nbytes])
+            offset += buf.nbytes + _padding(buf.nbytes)
+
+        self._spilled = _Payload(mapped[:data_size].data, buffers)
+        self._spilled._on_disk = True
+        return self._spilled
+
+
+def _encode_grid(
+        grid: Grid, oob_buffers: Optional[_OOBBuffers] = None
+        ) -> msgpack.ExtType:
     """Encodes a Grid object into the wire format.
+
+    If oob_buffers is given, then the array data is not included in
+    the result. Instead, a copy is added to oob_buffers and the grid
+    refers to it by offset and size.
     """
     ext_type_map = {
             'int32': ExtTypeId.GRID_INT32,
@@ -72,50 +250,108 @@ def _encode_grid(grid: Grid) -> msgpack.ExtType:
     if array_type not in ext_type_map:
         raise RuntimeError('Unsupported array data type')
 
-    buf = array.tobytes(order='A')
-
     # array_type is redundant, but useful metadata.
     grid_dict = {
             'type': array_type,
             'shape': list(array.shape),
-            'order': order,
-            'data': buf,
-            'indexes': grid.indexes}
+            'order': order}  # type: Dict[str, Any]
+
+    if oob_buffers is None:
+        grid_dict['data'] = array.tobytes(order='A')
+    else:
+        # Our one copy, the user may change the array after sending
+        if order == 'fa':
+            snapshot = array.copy(order='F')
+        else:
+            snapshot = array.copy(order='C')
+        data = snapshot.reshape(-1, order='A').view(np.uint8)
+        grid_dict['oob'] = [oob_buffers.add(data), data.nbytes]
+
+    grid_dict['indexes'] = grid.indexes
     packed_data = msgpack.packb(grid_dict, use_bin_type=True)
     return msgpack.ExtType(ext_type_map[array_type], packed_data)
 
 
-def _decode_grid(code: int, data: bytes) -> Grid:
-    """Creates a Grid from serialised data.
-    """
-    type_map = {
-            ExtTypeId.GRID_INT32: np.int32,
-            ExtTypeId.GRID_INT64: np.int64,
-            ExtTypeId.GRID_FLOAT32: np.float32,
-            ExtTypeId.GRID_FLOAT64: np.float64,
-            ExtTypeId.GRID_BOOL: np.bool8}
+_grid_dtypes = {
+        ExtTypeId.GRID_INT32: np.int32,
+        ExtTypeId.GRID_INT64: np.int64,
+        ExtTypeId.GRID_FLOAT32: np.float32,
+        ExtTypeId.GRID_FLOAT64: np.float64,
+        ExtTypeId.GRID_BOOL: np.bool8}
+
+_grid_orders = {
+        'fa': 'F',
+        'la': 'C'}
 
-    order_map = {
-            'fa': 'F',
-            'la': 'C'}
 
+def _decode_grid(
+        code: int, data: bytes, oob_data: Optional[memoryview] = None,
+        destination: Optional[np.ndarray] = None) -> Grid:
+    """Creates a Grid from serialised data.
+
+    If the grid data was sent out-of-band, then the array will be a
+    view into oob_data, rather than a copy. If destination is given,
+    then the grid's data has already been received into it.
+    """
     grid_dict = msgpack.unpackb(data, raw=False)
-    order = order_map[grid_dict['order']]
-    shape = tuple(grid_dict['shape'])
-    dtype = type_map[ExtTypeId(code)]
-    array = np.ndarray(     # type: ignore
-            shape, dtype, grid_dict['data'], order=order)   # type: ignore
     indexes = grid_dict['indexes']
     if indexes == []:
         indexes = None
+
+    if destination is not None:
+        return Grid(destination, indexes)
+
+    order = _grid_orders[grid_dict['order']]
+    shape = tuple(grid_dict['shape'])
+    dtype = _grid_dtypes[ExtTypeId(code)]
+    if 'oob' in grid_dict:
+        if oob_data is None:
+            raise RuntimeError('Received out-of-band grid without data')
+        offset, nbytes = grid_dict['oob']
+        buf = oob_data[offset:offset + nbytes]  # type: Buffer
+    else:
+        buf = grid_dict['data']
+    array = np.ndarray(     # type: ignore
+            shape, dtype, buf, order=order)   # type: ignore
+    # received grids are read-only, whichever way they came in
+    array.flags.writeable = False
     return Grid(array, indexes)
 
 
-def _data_encoder(obj: Any) -> Any:
+def _fits(destination: np.ndarray, dtype: Any, shape: List[int]) -> bool:
+    """Whether a received array can be stored into a destination array.
+    """
+    return bool(
+            destination.flags.writeable and
+            destination.dtype == dtype and
+            destination.shape == tuple(shape))
+
+
+def _byte_view(array: np.ndarray, order: str) -> Optional[memoryview]:
+    """Returns the memory of an array as a flat buffer of bytes.
+
+    Args:
+        array: The array to get the memory of.
+        order: The memory layout the contents should have, 'C' or 'F'.
+
+    Returns:
+        A view of the array's memory, or None if the array is not
+        contiguous in the given order.
+    """
+    if order == 'F' and not array.flags.f_contiguous:
+        return None
+    if order == 'C' and not array.flags.c_contiguous:
+        return None
+    return array.reshape(-1, order='A').view(np.uint8).data
+
+
+def _data_encoder(
+        obj: Any, oob_buffers: Optional[_OOBBuffers] = None) -> Any:
     """Encodes custom objects for MessagePack.
 
     In particular, this takes care of any Settings, Grid and
-    numpy.ndarray objects the user may want to send.
+    numpy.ndarray objects the user may want to send. If oob_buffers
+    is given, grid data is collected there rather than encoded inline.
     """
     if isinstance(obj, ClosePort):
         return msgpack.ExtType(ExtTypeId.CLOSE_PORT, bytes())
@@ -124,23 +360,288 @@ def _data_encoder(obj: Any) -> Any:
                                     use_bin_type=True)
         return msgpack.ExtType(ExtTypeId.SETTINGS, packed_data)
     elif isinstance(obj, np.ndarray):
-        return _encode_grid(Grid(obj))
+        return _encode_grid(Grid(obj), oob_buffers)
     elif isinstance(obj, Grid):
-        return _encode_grid(obj)
+        return _encode_grid(obj, oob_buffers)
     return obj
 
 
-def _ext_decoder(code: int, data: bytes) -> msgpack.ExtType:
+def _encode_overlay(overlay: Any) -> Tuple[bytes, Optional[bytes]]:
+    """Encodes a settings overlay for MessagePack.
+
+    Returns:
+        The encoded overlay, and its digest if it is a Settings object.
+    """
+    if not isinstance(overlay, Settings):
+        return cast(bytes, msgpack.packb(
+            overlay, default=_data_encoder, use_bin_type=True)), None
+
+    packed_data = cast(bytes, msgpack.packb(
+        overlay.as_ordered_dict(), use_bin_type=True))
+    encoded = cast(bytes, msgpack.packb(
+        msgpack.ExtType(ExtTypeId.SETTINGS, packed_data),
+        use_bin_type=True))
+    return encoded, _overlay_digest(packed_data)
+
+
+def _overlay_digest(packed_data: bytes) -> bytes:
+    """Returns a digest identifying an encoded settings overlay.
+    """
+    return hashlib.blake2b(packed_data, digest_size=16).digest()
+
+
+class OverlayCache:
+    """Remembers the last settings overlay received on a port.
+
+    Settings overlays rarely change, so if the receiver supports it,
+    the sender replaces an overlay that is the same as the previous
+    one it sent to that receiver with a reference containing its
+    digest. This resolves those references. It also avoids decoding
+    an overlay again if it is the same as the previous one.
+
+    Received overlays are copies, so that changing them does not
+    affect the cache.
+    """
+    def __init__(self) -> None:
+        """Create an OverlayCache."""
+        self._packed_data = None    # type: Optional[bytes]
+        self._digest = None     # type: Optional[bytes]
+        self._overlay = Settings()
+
+        # Settings decoded from the current message, one of which may
+        # be its overlay, while others may be part of its data
+        self._decoded = list()  # type: List[Tuple[bytes, Settings]]
+
+    def decode(self, packed_data: bytes) -> Settings:
+        """Decodes received settings.
+
+        These may be the message's overlay, or part of its data. Call
+        :meth:`received` once the message is decoded, to tell which.
+
+        Args:
+            packed_data: The MessagePack-encoded settings.
+
+        Returns:
+            The decoded settings.
+        """
+        if packed_data == self._packed_data:
+            return self._overlay.copy()
+
+        settings = Settings(msgpack.unpackb(packed_data, raw=False))
+        self._decoded.append((packed_data, settings))
+        return settings
+
+    def received(self, overlay: Any) -> None:
+        """Remembers the overlay of a decoded message.
+
+        Args:
+            overlay: The message's settings overlay.
+        """
+        for packed_data, settings in self._decoded:
+            if settings is overlay:
+                self._packed_data = bytes(packed_data)
+                self._digest = None
+                self._overlay = settings.copy()
+        self._decoded.clear()
+
+    def resolve(self, digest: bytes) -> Settings:
+        """Resolves a received reference to an overlay.
+
+        Args:
+            digest: The digest of the referenced overlay.
+
+        Returns:
+            The referenced overlay.
+
+        Raises:
+            RuntimeError: If it is not the last overlay we received.
+        """
+        if self._packed_data is not None and self._digest is None:
+            self._digest = _overlay_digest(self._packed_data)
+        if digest != self._digest:
+            raise RuntimeError(
+                    'Received a reference to an unknown settings overlay.'
+                    ' This is a bug, please report it.')
+        return self._overlay.copy()
+
+
+def _ext_decoder(
+        code: int, data: bytes, oob_data: Optional[memoryview] = None,
+        destination: Optional[np.ndarray] = None,
+        overlays: Optional[OverlayCache] = None) -> msgpack.ExtType:
     if code == ExtTypeId.CLOSE_PORT:
         return ClosePort()
     elif code == ExtTypeId.SETTINGS:
+        if overlays is not None:
+            return overlays.decode(data)
         plain_dict = msgpack.unpackb(data, raw=False)
         return Settings(plain_dict)
+    elif code == ExtTypeId.SETTINGS_REF:
+        if overlays is None:
+            raise RuntimeError(
+                    'Received a reference to a settings overlay without'
+                    ' having asked for it. Did the streams get crossed?')
+        return overlays.resolve(data)
     elif code in _grid_types:
-        return _decode_grid(code, data)
+        return _decode_grid(code, data, oob_data, destination)
     return msgpack.ExtType(code, data)
 
 
+class EncodedMessage:
+    """An MPPMessage encoded for sending.
+
+    Grid data is kept out-of-band, in separate buffers which are sent
+    after the MessagePack-encoded rest of the message. This avoids
+    copying large arrays into and out of MessagePack buffers. The
+    resulting frame starts with OOB_MAGIC and the length of the
+    MessagePack part, which is followed by padding and the buffers,
+    each of which starts at a multiple of OOB_ALIGNMENT bytes.
+
+    Messages without grids are plain MessagePack, as are messages sent
+    to peers that do not support out-of-band grids, see
+    :meth:`legacy`.
+
+    Attributes:
+        size: The size of the frame in bytes.
+        payload: The data and grids, which copies of a message for
+                different receivers share. Compare by identity.
+        payload_size: The size of the payload in bytes. This is part
+                of size, but takes memory only once for all messages
+                with the same payload.
+        closes_port: Whether the message is a ClosePort message.
+        spilled: Whether the message is stored on disk, see
+                :meth:`spill`.
+        overlay_digest: Digest of the settings overlay, if it can be
+                replaced by a reference, see :meth:`frame`.
+    """
+    def __init__(
+            self, header_parts: List[Buffer], payload: _Payload,
+            closes_port: bool = False,
+            overlay: Optional[Tuple[int, bytes]] = None) -> None:
+        """Create an EncodedMessage.
+
+        Args:
+            header_parts: The MessagePack-encoded message, except for
+                    the data, which is in the payload. This may be
+                    split into several parts, which are sent one after
+                    the other, followed by the data.
+            payload: The encoded data, with any grids referring to
+                    their data in its buffers.
+            closes_port: Whether the message is a ClosePort message.
+            overlay: The index of the header part that holds the
+                    encoded settings overlay and nothing else, and the
+                    overlay's digest.
+        """
+        self.closes_port = closes_port
+        self.spilled = False
+        self.overlay_digest = None if overlay is None else overlay[1]
+        self.payload = payload
+        self.payload_size = payload.size
+        self._header_parts = header_parts + [payload.data]
+        self._buffers = payload.buffers
+        self._overlay = overlay
+        header_size = sum(len(part) for part in self._header_parts)
+        if self._buffers:
+            header_end = len(OOB_MAGIC) + 8 + header_size
+            self.size = header_end + _padding(header_end) + sum(
+                    buf.nbytes + _padding(buf.nbytes)
+                    for buf in self._buffers)
+        else:
+            self.size = header_size
+
+    def frame(self, refer_to_overlay: bool = False) -> List[Buffer]:
+        """Returns the encoded message as a list of buffers.
+
+        The buffers refer to the message's data without copying it, so
+        they can be sent directly, e.g. using :func:`socket.sendmsg`.
+
+        If refer_to_overlay is True, then the settings overlay is
+        replaced by a reference to it, which can be resolved by a
+        receiver that received the same overlay with the previous
+        message, see :class:`OverlayCache`.
+
+        Args:
+            refer_to_overlay: Whether to send a reference to the
+                    settings overlay rather than the overlay itself.
+
+        Returns:
+            A list of buffers which together make up the message.
+        """
+        header_parts = self._header_parts
+        if refer_to_overlay and self._overlay is not None:
+            index, digest = self._overlay
+            header_parts = list(header_parts)
+            header_parts[index] = cast(bytes, msgpack.packb(
+                msgpack.ExtType(ExtTypeId.SETTINGS_REF, digest),
+                use_bin_type=True))
+
+        if not self._buffers:
+            return list(header_parts)
+
+        header_size = sum(len(part) for part in header_parts)
+        header_end = len(OOB_MAGIC) + 8 + header_size
+        prefix = OOB_MAGIC + header_size.to_bytes(8, 'little')
+        result = [prefix]    # type: List[Buffer]
+        result.extend(header_parts)
+        result.append(bytes(_padding(header_end)))
+        for buf in self._buffers:
+            result.append(buf.data)
+            padding = _padding(buf.nbytes)
+            if padding:
+                result.append(bytes(padding))
+        return result
+
+    def legacy(self) -> bytes:
+        """Returns the message in the original, single-buffer format.
+
+        This is used for peers that do not support out-of-band grids,
+        and is equal to what :meth:`MPPMessage.encoded` returns. If the
+        message has grids, then their data is copied into the result.
+        This is done only once for all messages sharing the payload,
+        see :meth:`_Payload.legacy`.
+
+        Returns:
+            The message with any grid data encoded inline.
+        """
+        return b''.join(self._header_parts[:-1] + [self.payload.legacy()])
+
+    def spill(self, directory: Path) -> 'EncodedMessage':
+        """Returns a copy of the message with its payload on disk.
+
+        The payload, which holds the data and the grid buffers, is
+        written to a file in the given directory, which is then
+        memory-mapped, so that the operating system can drop the data
+        from memory and read it back when the message is sent. The file
+        is removed from the directory straight away, and its space is
+        released when the copy is no longer used.
+
+        Copies of a message for different receivers share their payload,
+        and it is only written once, with the spilled copies sharing the
+        file. The rest of the message is small and is kept in memory.
+
+        Args:
+            directory: The directory to write the file to.
+
+        Returns:
+            An EncodedMessage with the same contents.
+        """
+        result = EncodedMessage(
+                self._header_parts[:-1], self.payload.spill(directory),
+                self.closes_port, self._overlay)
+        result.spilled = True
+        return result
+
+
+@lru_cache(maxsize=1024)
+def _decode_reference(text: str) -> Reference:
+    """Create a Reference to a sender or receiver from its string form.
+
+    We receive from the same endpoints again and again, so we cache
+    the results to avoid parsing them again and again.
+    """
+    return Reference(text)
+
+
 class MPPMessage:
     """A MUSCLE Communication Protocol message.
 
@@ -183,26 +684,148 @@ class MPPMessage:
             self.data = data
 
     @staticmethod
-    def from_bytes(message: bytes) -> 'MPPMessage':
+    def from_bytes(
+            message: Buffer, overlays: Optional[OverlayCache] = None
+            ) -> 'MPPMessage':
         """Create an MPP Message from an encoded buffer.
 
+        The buffer may be in either of the formats produced by
+        :class:`EncodedMessage`. Any grids with out-of-band data will
+        refer to the buffer rather than contain a copy of their data.
+
         Args:
             message: MessagePack encoded message data.
+            overlays: Cache of the receiving port's settings overlay,
+                    needed if the sender may refer to it.
+        """
+        buf = memoryview(message)
+        ext_decoder = partial(_ext_decoder, overlays=overlays)
+        if buf[:len(OOB_MAGIC)] == OOB_MAGIC:
+            header_start = len(OOB_MAGIC) + 8
+            header_end = header_start + int.from_bytes(
+                    buf[len(OOB_MAGIC):header_start], 'little')
+            oob_data = buf[header_end + _padding(header_end):]
+            ext_decoder = partial(ext_decoder, oob_data=oob_data)
+            buf = buf[header_start:header_end]
+
+        return MPPMessage._decode(buf, ext_decoder, overlays)
+
+    @staticmethod
+    def from_reader(
+            reader: ResponseReader, destination: Optional[np.ndarray] = None,
+            overlays: Optional[OverlayCache] = None) -> 'MPPMessage':
+        """Receive an MPP Message from a response reader.
+
+        If a destination array is given, and the message's data is a
+        grid with the same shape and data type, then the grid data is
+        stored into the destination, and the received Grid will refer
+        to it. Where possible, the data is received directly into the
+        destination without any intermediate buffer.
+
+        Args:
+            reader: A reader for a response in either of the formats
+                    produced by :class:`EncodedMessage`.
+            destination: An array to receive grid data into.
+            overlays: Cache of the receiving port's settings overlay,
+                    needed if the sender may refer to it.
+        """
+        prefix_length = len(OOB_MAGIC) + 8
+        if reader.length < prefix_length:
+            message = MPPMessage.from_bytes(
+                    reader.read(reader.length), overlays)
+            return message.store_into(destination)
+
+        prefix = reader.read(prefix_length)
+        if prefix[:len(OOB_MAGIC)] != OOB_MAGIC:
+            buf = bytearray(reader.length)
+            buf[:prefix_length] = prefix
+            reader.read_into(memoryview(buf)[prefix_length:])
+            return MPPMessage.from_bytes(buf, overlays).store_into(
+                    destination)
+
+        header_end = prefix_length + int.from_bytes(
+                prefix[len(OOB_MAGIC):], 'little')
+        header = reader.read(header_end - prefix_length)
+        reader.read(_padding(header_end))
+        oob_length = reader.length - header_end - _padding(header_end)
+
+        if destination is not None:
+            grid_dicts = list()  # type: List[Dict[str, Any]]
+
+            def find_grids(code: int, data: bytes) -> None:
+                if code in _grid_types:
+                    grid_dict = msgpack.unpackb(data, raw=False)
+                    grid_dict['dtype'] = _grid_dtypes[ExtTypeId(code)]
+                    grid_dicts.append(grid_dict)
+
+            msgpack.unpackb(header, ext_hook=find_grids, raw=False,
+                            strict_map_key=False)
+
+            if len(grid_dicts) == 1 and 'oob' in grid_dicts[0]:
+                grid_dict = grid_dicts[0]
+                dest_buf = _byte_view(
+                        destination, _grid_orders[grid_dict['order']])
+                fits = _fits(
+                        destination, grid_dict['dtype'], grid_dict['shape'])
+                if fits and dest_buf is not None:
+                    reader.read_into(dest_buf)
+                    reader.read(oob_length - dest_buf.nbytes)
+                    return MPPMessage._decode(header, partial(
+                        _ext_decoder, destination=destination,
+                        overlays=overlays), overlays)
+
+        oob_data = memoryview(reader.read(oob_length))
+        message = MPPMessage._decode(header, partial(
+            _ext_decoder, oob_data=oob_data, overlays=overlays), overlays)
+        return message.store_into(destination)
+
+    @staticmethod
+    def _decode(
+            header: Buffer, ext_decoder: Callable,
+            overlays: Optional[OverlayCache] = None) -> 'MPPMessage':
+        """Decodes a MessagePack encoded message.
+
+        Args:
+            header: The encoded message.
+            ext_decoder: Extension type hook to use.
+            overlays: The cache used by ext_decoder, if any.
         """
         message_dict = msgpack.unpackb(
-                message, ext_hook=_ext_decoder, raw=False)
-        sender = Reference(message_dict["sender"])
-        receiver = Reference(message_dict["receiver"])
+                header, ext_hook=ext_decoder, raw=False)
+        sender = _decode_reference(message_dict["sender"])
+        receiver = _decode_reference(message_dict["receiver"])
         port_length = message_dict["port_length"]
         timestamp = message_dict["timestamp"]
         next_timestamp = message_dict["next_timestamp"]
         settings_overlay = message_dict["settings_overlay"]
+        if overlays is not None:
+            overlays.received(settings_overlay)
 
         data = message_dict["data"]
         return MPPMessage(
                 sender, receiver, port_length, timestamp, next_timestamp,
                 settings_overlay, data)
 
+    def store_into(
+            self, destination: Optional[np.ndarray]) -> 'MPPMessage':
+        """Copies received grid data into a destination array, if any.
+
+        Does nothing if destination is None, or the message's data is
+        not a grid with the same data type and shape.
+
+        Args:
+            destination: An array to copy into.
+
+        Returns:
+            This message.
+        """
+        if destination is not None and isinstance(self.data, Grid):
+            array = self.data.array
+            if _fits(destination, array.dtype, list(array.shape)):
+                np.copyto(destination, array)
+                self.data = Grid(destination, self.data.indexes)
+        return self
+
     def encoded(self) -> bytes:
         """Encode the message and return as a bytes buffer.
         """
@@ -218,3 +841,62 @@ class MPPMessage:
 
         return cast(bytes, msgpack.packb(
             message_dict, default=_data_encoder, use_bin_type=True))
+
+    def encoded_frame(self) -> EncodedMessage:
+        """Encode the message, keeping grid data out-of-band.
+
+        Grid data is copied once, so that the message is unaffected by
+        any later changes to the arrays, but is not otherwise copied.
+
+        Returns:
+            The encoded message.
+        """
+        return next(self.encoded_frames(
+            [(self.sender, self.receiver, self.port_length)]))
+
+    def encoded_frames(self, addresses: Iterable[_Address]
+                       ) -> Iterator[EncodedMessage]:
+        """Encode the message for several senders and receivers.
+
+        This produces the same result as calling :meth:`encoded_frame`
+        on copies of the message with each of the given senders,
+        receivers and port lengths, but encodes the rest of the message
+        only once and shares it between the results.
+
+        Senders and receivers may be given as strings, which saves
+        converting them if they are reused for many messages.
+
+        Args:
+            addresses: Sender, receiver and port length for each copy.
+
+        Returns:
+            The encoded messages, in the order of the addresses.
+        """
+        # A MessagePack map is a header byte for up to 15 entries, then
+        # the keys and values. So we can encode the common entries
+        # once, and add the address entries and the header to that.
+        # The settings overlay gets a part of its own, so that it can
+        # be replaced by a reference, see EncodedMessage.frame().
+        timestamps = cast(bytes, msgpack.packb(
+            {
+                'timestamp': self.timestamp,
+                'next_timestamp': self.next_timestamp},
+            use_bin_type=True))[1:] + _OVERLAY_KEY
+        overlay, digest = _encode_overlay(self.settings_overlay)
+        oob_buffers = _OOBBuffers()
+        data = memoryview(cast(bytes, msgpack.packb(
+            {'data': self.data},
+            default=partial(_data_encoder, oob_buffers=oob_buffers),
+            use_bin_type=True)))[1:]
+        payload = _Payload(data, oob_buffers.buffers)
+        closes_port = isinstance(self.data, ClosePort)
+        overlay_part = None if digest is None else (2, digest)
+
+        for sender, receiver, port_length in addresses:
+            address = cast(bytes, msgpack.packb({
+                'sender': str(sender),
+                'receiver': str(receiver),
+                'port_length': port_length}, use_bin_type=True))[1:]
+            yield EncodedMessage(
+                    [_MAP_7 + address, timestamps, overlay], payload,
+                    closes_port, overlay_part)
@@ -0,0 +1,108 @@
+from threading import Lock, Thread
+from typing import Dict, List  # noqa
+
+from ymmsl import Reference
+
+from libmuscle.inbox import MessageQueue
+from libmuscle.mpp_client import MPPClient
+from libmuscle.mpp_message import ClosePort
+
+
+class MultiPrefetcher:
+    """Requests the next messages for several endpoints in the background.
+
+    A MultiPrefetcher has a single connection to the sending peer and a
+    single background thread, on which it asks for the first message
+    available for any of our receiving endpoints. Each message is then
+    stored for its endpoint until it is retrieved, so that a slow
+    sender for one endpoint does not hold up the others.
+
+    Messages for each endpoint are received in the order in which they
+    were sent. An endpoint is no longer requested for after it has
+    received a ClosePort message.
+    """
+    def __init__(self, client: MPPClient, receivers: List[Reference]
+                 ) -> None:
+        """Create a MultiPrefetcher and start fetching messages.
+
+        Args:
+            client: A client connected to the sending peer, which
+                    supports MPPFeature.ANY. The MultiPrefetcher takes
+                    ownership.
+            receivers: The receiving endpoints to fetch messages for.
+        """
+        self._client = client
+        self._endpoints = {
+                receiver: PrefetchedEndpoint(self)
+                for receiver in receivers
+                }   # type: Dict[Reference, PrefetchedEndpoint]
+        self._closing = False
+        self._close_lock = Lock()
+        self._thread = Thread(
+                target=self._receive, args=(receivers,), daemon=True)
+        self._thread.start()
+
+    def endpoint(self, receiver: Reference) -> 'PrefetchedEndpoint':
+        """Returns the messages received for an endpoint.
+
+        Args:
+            receiver: One of the receiving endpoints.
+        """
+        return self._endpoints[receiver]
+
+    def close(self) -> None:
+        """Closes the connection to the peer.
+
+        Any messages that have not been received yet are lost. It is
+        okay to call this more than once.
+        """
+        with self._close_lock:
+            if self._closing:
+                return
+            self._closing = True
+
+        self._client.close()
+        self._thread.join()
+        # wake up anyone still waiting in retrieve()
+        for endpoint in self._endpoints.values():
+            endpoint._put(ConnectionAbortedError(
+                    'The MultiPrefetcher was closed'))
+
+    def _receive(self, receivers: List[Reference]) -> None:
+        """Receives messages into the endpoints' queues.
+
+        This runs in a background thread, until all endpoints have
+        received a ClosePort message or the MultiPrefetcher is closed.
+
+        Args:
+            receivers: The receiving endpoints to fetch messages for.
+        """
+        open_receivers = list(receivers)
+        try:
+            while open_receivers:
+                message, size = self._client.receive_any(open_receivers)
+                self._endpoints[message.receiver]._put((message, size))
+                if isinstance(message.data, ClosePort):
+                    open_receivers.remove(message.receiver)
+        except Exception as e:
+            if not self._closing:
+                for endpoint in self._endpoints.values():
+                    endpoint._put(e)
+
+
+class PrefetchedEndpoint(MessageQueue):
+    """The messages a MultiPrefetcher received for one endpoint.
+    """
+    def __init__(self, prefetcher: MultiPrefetcher) -> None:
+        """Create an empty PrefetchedEndpoint.
+
+        Args:
+            prefetcher: The MultiPrefetcher that fills it.
+        """
+        super().__init__()
+        self._prefetcher = prefetcher
+
+    def close(self) -> None:
+        """Closes the MultiPrefetcher, and with it its other endpoints.
+        """
+        self._prefetcher.close()
@@ -1,4 +1,42 @@
+from collections import deque
 from queue import Queue
+from threading import Lock
+from typing import Callable, Deque, Optional, Tuple  # noqa
+
+from libmuscle.mpp_message import EncodedMessage
+
+
+_Waiter = Callable[[EncodedMessage], None]
+
+
+class Claim:
+    """Makes sure that a waiter gets only one message.
+
+    A waiter may wait on several outboxes at once, using the same
+    Claim for each, in which case only the first of them to have a
+    message passes it on. Waiters that have lost out stay in the other
+    outboxes, but are skipped.
+
+    Attributes:
+        taken: Whether a message has been passed on.
+    """
+    def __init__(self) -> None:
+        """Create a Claim that has not been taken yet.
+        """
+        self.taken = False
+        self._lock = Lock()
+
+    def take(self) -> bool:
+        """Takes the claim, if it has not been taken yet.
+
+        Returns:
+            True iff the caller took it, and should pass on a message.
+        """
+        with self._lock:
+            if self.taken:
+                return False
+            self.taken = True
+            return True
 
 
 class Outbox:
@@ -10,25 +48,40 @@ class Outbox:
     def __init__(self) -> None:
         """Create an empty Outbox.
         """
-        self.__queue = Queue()  # type: Queue[bytes]
+        self.__queue = Queue()  # type: Queue[EncodedMessage]
+        self.__lock = Lock()
+        self.__waiters = deque(
+                )   # type: Deque[Tuple[_Waiter, Optional[Claim]]]
 
     def is_empty(self) -> bool:
         """Returns True iff the outbox is empty.
         """
         return self.__queue.empty()
 
-    def deposit(self, message: bytes) -> None:
+    def deposit(self, message: EncodedMessage) -> None:
         """Put a message in the Outbox.
 
         The message will be placed at the back of a queue, and may be
-        retrieved later via :py:meth:`retrieve`.
+        retrieved later via :py:meth:`retrieve`. If someone is waiting
+        for it via :py:meth:`retrieve_nowait`, then it is passed on to
+        them immediately instead, or to the one that has waited longest
+        if there are several.
 
         Args:
             message: The message to store.
         """
-        self.__queue.put(message)
+        with self.__lock:
+            while self.__waiters:
+                waiter, claim = self.__waiters.popleft()
+                if claim is None or claim.take():
+                    break
+            else:
+                self.__queue.put(message)
+                return
+
+        waiter(message)
 
-    def retrieve(self) -> bytes:
+    def retrieve(self) -> EncodedMessage:
         """Retrieve a message from the Outbox.
 
         The message will be removed from the front of the queue, and
@@ -39,3 +92,40 @@ class Outbox:
             The next message.
         """
         return self.__queue.get()
+
+    def retrieve_nowait(
+            self, waiter: _Waiter, claim: Optional[Claim] = None
+            ) -> Optional[EncodedMessage]:
+        """Retrieve a message from the Outbox without blocking.
+
+        If a message is available, it is removed from the front of the
+        queue and returned. If not, then waiter will be called with
+        the next message when it is deposited, instead of it being
+        put in the queue, and None is returned. If there are several
+        waiters, then they get the next messages in the order in which
+        they started waiting.
+
+        If a claim is given, then a message is only returned or passed
+        to the waiter if the claim can be taken, see :class:`Claim`.
+
+        Args:
+            waiter: Function to call with the next message.
+            claim: Claim to take before passing on a message.
+
+        Returns:
+            The next message, if there is one.
+        """
+        with self.__lock:
+            # forget waiters that got their message from another outbox
+            while self.__waiters:
+                old_claim = self.__waiters[0][1]
+                if old_claim is None or not old_claim.taken:
+                    break
+                self.__waiters.popleft()
+
+            if self.__queue.empty():
+                self.__waiters.append((waiter, claim))
+                return None
+            if claim is not None and not claim.take():
+                return None
+            return self.__queue.get_nowait()
@@ -1,49 +1,215 @@
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from queue import Queue
+from threading import Condition, Lock
 import time
-from typing import Dict
+from typing import (  # noqa
+        cast, Dict, Iterator, List, Optional, Set, Tuple, Union)
 
 import msgpack
 from ymmsl import Reference
 
-from libmuscle.mcp.protocol import RequestType
-from libmuscle.mcp.transport_server import RequestHandler
-from libmuscle.outbox import Outbox
+from libmuscle.mcp.protocol import MPPFeature, RequestType
+from libmuscle.mcp.transport_server import (
+        NonBlockingRequestHandler, Responder, Response, StreamedResponse)
+from libmuscle.mpp_message import EncodedMessage
+from libmuscle.outbox import Claim, Outbox
 
 
-class PostOffice(RequestHandler):
+_supported_features = {
+        MPPFeature.OOB_GRIDS.value, MPPFeature.PUSH.value,
+        MPPFeature.SETTINGS_REFS.value, MPPFeature.CHANNELS.value,
+        MPPFeature.ANY.value}
+
+
+class PostOffice(NonBlockingRequestHandler):
     """A PostOffice is an object that holds messages to be retrieved.
 
     A PostOffice holds outboxes with messages for receivers. It also
     acts as a request handler for incoming requests for messages.
+
+    Receivers are identified in requests by name, or by a channel
+    number if the client supports that. Channel numbers are handed out
+    by the PostOffice on request, and refer to the same receiver for
+    all clients, so that connections do not need to be kept track of.
     """
     def __init__(self) -> None:
         """Create a PostOffice.
         """
         self._outboxes = dict()  # type: Dict[Reference, Outbox]
 
+        # receiver and outbox, indexed by channel number
+        self._channels = list()  # type: List[Tuple[Reference, Outbox]]
+        self._channel_numbers = dict()  # type: Dict[Reference, int]
+
         self._outbox_lock = Lock()
 
-    def handle_request(self, request: bytes) -> bytes:
+        # digest of the last settings overlay sent to each receiver
+        self._overlays_sent = dict()    # type: Dict[Reference, bytes]
+
+        # total size of the messages in the outboxes, overall and per
+        # sending port, and the port sending to each receiver
+        self._space = Condition()
+        self._size = 0
+        self._port_sizes = dict()   # type: Dict[str, int]
+        self._ports = dict()    # type: Dict[Reference, str]
+
+        # number of messages in the outboxes sharing each payload
+        self._payload_refs = dict()     # type: Dict[object, int]
+
+        self._limit = None  # type: Optional[int]
+        self._port_limit = None     # type: Optional[int]
+        self._block = True
+        self._spill_dir = None  # type: Optional[Path]
+
+        # receivers that do not support out-of-band grids, and a thread
+        # for encoding messages for them, see handle_request_async()
+        self._legacy_receivers = set()  # type: Set[Reference]
+        self._encoder = ThreadPoolExecutor(max_workers=1)
+
+    def set_limits(
+            self, limit: Optional[int], port_limit: Optional[int],
+            block: bool, spill_dir: Optional[Path] = None) -> None:
+        """Limits the amount of data waiting to be received.
+
+        If depositing a message would take the total size of the
+        messages in the outboxes over a limit, then deposit() will
+        wait until enough of them have been received, or raise an
+        exception if block is False. A message that is larger than a
+        limit by itself is let through once the outboxes it counts
+        against are empty.
+
+        If spill_dir is given, then messages that do not fit are
+        written to disk there instead, see
+        :meth:`EncodedMessage.spill`, and deposit() does not wait or
+        raise.
+
+        Args:
+            limit: Maximum total size of all messages in bytes, or
+                    None for no limit.
+            port_limit: Maximum total size in bytes of the messages
+                    sent on any single port, or None for no limit.
+            block: Whether to wait for space, rather than raising.
+            spill_dir: Directory to spill messages to, or None to
+                    keep them in memory.
+        """
+        with self._space:
+            self._limit = limit
+            self._port_limit = port_limit
+            self._block = block
+            self._spill_dir = spill_dir
+            self._space.notify_all()
+
+    def size(self) -> int:
+        """Returns the total size of the waiting messages in bytes.
+
+        Messages that were spilled to disk are not included. Copies of
+        a message sent to several receivers share their payload, which
+        is counted only once.
+        """
+        return self._size
+
+    def handle_request(
+            self, request: bytes) -> Union[Response, StreamedResponse]:
         """Handle a request.
 
         This receives an MCP request and handles it by blocking until
         the requested message is available, then returning it.
 
+        Feature negotiation requests are answered with the subset of
+        the requested features that we support. Channel requests are
+        answered with the channel number of the given receiver.
+        Subscription requests are answered with a stream of all
+        messages for the receiver, each sent as soon as it is
+        deposited, up to and including a ClosePort message. Requests
+        for any of several receivers are answered with the first
+        message to be available for one of them.
+
         Args:
             request: A received request
 
         Returns:
             An encoded response
         """
-        req = msgpack.unpackb(request, raw=False)
-        if len(req) != 2 or req[0] != RequestType.GET_NEXT_MESSAGE.value:
-            raise RuntimeError(
-                    'Invalid request type. Did the streams get crossed?')
-        recv_port = Reference(req[1])
-        self._ensure_outbox_exists(recv_port)
-        return self._outboxes[recv_port].retrieve()
+        req = self._decode_request(request)
+        if req[0] == RequestType.NEGOTIATE_FEATURES.value:
+            return self._negotiate(req[1])
+        if req[0] == RequestType.OPEN_CHANNEL.value:
+            return self._open_channel(req[1])
+        if req[0] == RequestType.GET_ANY_MESSAGE.value:
+            responses = Queue()     # type: Queue[Optional[Response]]
+            self._send_any(
+                    req[1], req[2],
+                    lambda response, last: responses.put(response))
+            return cast(Response, responses.get())
+
+        recv_port, outbox = self._find_outbox(req[1])
+        features = req[2] if len(req) == 3 else []
+        if req[0] == RequestType.SUBSCRIBE.value:
+            return StreamedResponse(
+                    self._push_messages(recv_port, outbox, features))
+
+        message = outbox.retrieve()
+        self._release(recv_port, message)
+        return self._encode(recv_port, message, features)
+
+    def handle_request_async(
+            self, request: bytes, respond: Responder) -> None:
+        """Handle a request without blocking.
 
-    def get_message(self, receiver: Reference) -> bytes:
+        This does the same as :meth:`handle_request`, but rather than
+        waiting for a message to become available, it arranges for it
+        to be passed to respond when it is deposited.
+
+        Receivers that do not support out-of-band grids need the grid
+        data copied into the message. That is done when the message is
+        deposited if we know about the receiver by then, and otherwise
+        on a separate thread, which then passes the message to respond.
+
+        Args:
+            request: A received request
+            respond: A function to call with the response
+        """
+        req = self._decode_request(request)
+        if req[0] == RequestType.NEGOTIATE_FEATURES.value:
+            respond(self._negotiate(req[1]), True)
+            return
+        if req[0] == RequestType.OPEN_CHANNEL.value:
+            respond(self._open_channel(req[1]), True)
+            return
+        if req[0] == RequestType.GET_ANY_MESSAGE.value:
+            self._send_any(req[1], req[2], respond)
+            return
+
+        recv_port, outbox = self._find_outbox(req[1])
+        features = req[2] if len(req) == 3 else []
+        push = req[0] == RequestType.SUBSCRIBE.value
+        legacy = MPPFeature.OOB_GRIDS.value not in features
+        if legacy:
+            self._legacy_receivers.add(recv_port)
+
+        def send(message: Optional[EncodedMessage]) -> None:
+            while message is not None:
+                if legacy and not message.payload.has_legacy():
+                    # this copies all the grid data, so we do it on
+                    # another thread rather than holding up the server
+                    self._encoder.submit(encode_and_send, message)
+                    return
+                self._release(recv_port, message)
+                last = not push or message.closes_port
+                respond(self._encode(recv_port, message, features), last)
+                if last:
+                    return
+                message = outbox.retrieve_nowait(send)
+
+        def encode_and_send(message: EncodedMessage) -> None:
+            message.payload.legacy()
+            send(message)
+
+        send(outbox.retrieve_nowait(send))
+
+    def get_message(self, receiver: Reference) -> EncodedMessage:
         """Get a message from a receiver's outbox.
 
         Used by servers to get messages that have been sent to another
@@ -52,37 +218,315 @@ class PostOffice(RequestHandler):
         Args:
             receiver: The receiver of the message.
         """
-        self._ensure_outbox_exists(receiver)
-        return self._outboxes[receiver].retrieve()
+        message = self._get_outbox(receiver).retrieve()
+        self._release(receiver, message)
+        return message
 
-    def deposit(self, receiver: Reference, message: bytes) -> None:
+    def deposit(
+            self, receiver: Reference, message: EncodedMessage,
+            port_name: Optional[str] = None) -> None:
         """Deposits a message into an outbox.
 
+        This blocks or spills the message to disk if the outboxes are
+        full, see set_limits().
+
         Args:
             receiver: Receiver of the message.
             message: The message to deposit.
+            port_name: The port it was sent on, if any, for applying
+                    the per-port limit.
+
+        Raises:
+            RuntimeError: If the outboxes are full and we're not
+                    blocking.
         """
-        self._ensure_outbox_exists(receiver)
-        self._outboxes[receiver].deposit(message)
+        outbox = self._get_outbox(receiver)
+        if not self._reserve(receiver, port_name, message):
+            message = message.spill(cast(Path, self._spill_dir))
+        elif receiver in self._legacy_receivers:
+            # encode it here rather than on the server's I/O thread
+            message.payload.legacy()
+        outbox.deposit(message)
 
     def wait_for_receivers(self) -> None:
         """Waits until all outboxes are empty.
         """
-        for outbox in self._outboxes.values():
+        with self._outbox_lock:
+            outboxes = list(self._outboxes.values())
+        for outbox in outboxes:
             while not outbox.is_empty():
                 time.sleep(0.1)
 
-    def _ensure_outbox_exists(self, receiver: Reference) -> None:
-        """Ensure that an outbox exists.
+    def _reserve(
+            self, receiver: Reference, port_name: Optional[str],
+            message: EncodedMessage) -> bool:
+        """Accounts for a message about to be deposited.
+
+        This waits for space to become available first, or raises if
+        there isn't any and we're not blocking. If we're spilling, then
+        this returns immediately instead.
+
+        If another message with the same payload is waiting already,
+        then the payload is not counted again. Copies of a message are
+        all sent on the same port, so this works for the per-port
+        limit too.
+
+        Args:
+            receiver: Receiver of the message.
+            port_name: The port it was sent on, if any.
+            message: The message.
+
+        Returns:
+            True if the message was accounted for, False if it does not
+            fit and should be spilled to disk.
+        """
+        with self._space:
+            while True:
+                size = message.size
+                if message.payload in self._payload_refs:
+                    size -= message.payload_size
+
+                total_ok = (
+                        self._limit is None or self._size == 0 or
+                        self._size + size <= self._limit)
+
+                port_size = 0
+                if port_name is not None:
+                    port_size = self._port_sizes.get(port_name, 0)
+                port_ok = (
+                        self._port_limit is None or port_size == 0 or
+                        port_size + size <= self._port_limit)
+
+                if total_ok and port_ok:
+                    break
+
+                if self._spill_dir is not None:
+                    return False
+
+                if not self._block:
+                    raise RuntimeError((
+                        'The outbox is full: sending a message of {} bytes'
+                        ' on port {} would take the data waiting to be'
+                        ' received over the limit set by'
+                        ' muscle_outbox_limit or muscle_outbox_port_limit.'
+                        ' Are the receivers too slow, or not receiving?'
+                        ).format(size, port_name))
+                self._space.wait()
+
+            self._size += size
+            self._payload_refs[message.payload] = (
+                    self._payload_refs.get(message.payload, 0) + 1)
+            if port_name is not None:
+                self._port_sizes[port_name] = port_size + size
+                self._ports[receiver] = port_name
+            return True
+
+    def _release(self, receiver: Reference, message: EncodedMessage
+                 ) -> None:
+        """Accounts for a message that was taken out of an outbox.
+
+        Args:
+            receiver: Receiver of the message.
+            message: The message.
+        """
+        if message.spilled:
+            return
+
+        with self._space:
+            size = message.size
+            refs = self._payload_refs.pop(message.payload) - 1
+            if refs > 0:
+                self._payload_refs[message.payload] = refs
+                size -= message.payload_size
+
+            self._size -= size
+            port_name = self._ports.get(receiver)
+            if port_name is not None:
+                self._port_sizes[port_name] -= size
+            self._space.notify_all()
+
+    def _decode_request(self, request: bytes) -> List:
+        """Decodes and checks a request.
+
+        Args:
+            request: The encoded request.
+
+        Returns:
+            The request as a list of request type and arguments.
+
+        Raises:
+            RuntimeError: If this is not a request we handle.
+        """
+        req = msgpack.unpackb(request, raw=False)
+        valid_lengths = {
+                RequestType.GET_NEXT_MESSAGE.value: (2, 3),
+                RequestType.NEGOTIATE_FEATURES.value: (2,),
+                RequestType.OPEN_CHANNEL.value: (2,),
+                RequestType.SUBSCRIBE.value: (3,),
+                RequestType.GET_ANY_MESSAGE.value: (3,)}
+        if len(req) not in valid_lengths.get(req[0], ()):
+            raise RuntimeError(
+                    'Invalid request type. Did the streams get crossed?')
+        if req[0] == RequestType.GET_ANY_MESSAGE.value and not req[1]:
+            raise RuntimeError('Request for a message for no receivers')
+        return cast(List, req)
+
+    def _negotiate(self, features: List[str]) -> bytes:
+        """Returns the encoded subset of features we support.
+
+        Args:
+            features: The features the client would like to use.
+        """
+        supported = [f for f in features if f in _supported_features]
+        return cast(bytes, msgpack.packb(supported, use_bin_type=True))
+
+    def _open_channel(self, receiver: str) -> bytes:
+        """Returns the encoded channel number for a receiver.
+
+        Channel numbers are assigned the first time they are asked
+        for, and stay the same after that.
+
+        Args:
+            receiver: The receiver to get the channel number of.
+        """
+        recv_port = Reference(receiver)
+        with self._outbox_lock:
+            outbox = self._get_outbox_locked(recv_port)
+            if recv_port not in self._channel_numbers:
+                self._channel_numbers[recv_port] = len(self._channels)
+                self._channels.append((recv_port, outbox))
+            number = self._channel_numbers[recv_port]
+        return cast(bytes, msgpack.packb(number, use_bin_type=True))
+
+    def _find_outbox(self, receiver: Union[str, int]
+                     ) -> Tuple[Reference, Outbox]:
+        """Finds the receiver and outbox a request refers to.
+
+        Args:
+            receiver: The receiver's name or channel number.
+
+        Raises:
+            RuntimeError: If there is no channel with the given
+                    number.
+        """
+        if isinstance(receiver, int):
+            # _channels is only ever appended to, so this needs no lock
+            if receiver >= 0:
+                try:
+                    return self._channels[receiver]
+                except IndexError:
+                    pass
+            raise RuntimeError(
+                    'Unknown channel {}. Did the streams get'
+                    ' crossed?'.format(receiver))
+
+        recv_port = Reference(receiver)
+        return recv_port, self._get_outbox(recv_port)
+
+    def _send_any(
+            self, receivers: List[Union[str, int]], features: List[str],
+            respond: Responder) -> None:
+        """Sends the first message available for any of the receivers.
+
+        This returns right away, and calls respond once a message is
+        available, which may be right away as well.
+
+        Args:
+            receivers: Names or channel numbers of the receivers.
+            features: Protocol features negotiated with the receiver.
+            respond: A function to call with the response.
+        """
+        legacy = MPPFeature.OOB_GRIDS.value not in features
+        claim = Claim()
+
+        def send(recv_port: Reference, message: EncodedMessage) -> None:
+            if legacy and not message.payload.has_legacy():
+                # see handle_request_async()
+                self._encoder.submit(encode_and_send, recv_port, message)
+                return
+            self._release(recv_port, message)
+            respond(self._encode(recv_port, message, features), True)
+
+        def encode_and_send(
+                recv_port: Reference, message: EncodedMessage) -> None:
+            message.payload.legacy()
+            send(recv_port, message)
+
+        for receiver in receivers:
+            recv_port, outbox = self._find_outbox(receiver)
+            message = outbox.retrieve_nowait(partial(send, recv_port), claim)
+            if message is not None:
+                send(recv_port, message)
+            if claim.taken:
+                return
+
+    def _push_messages(
+            self, receiver: Reference, outbox: Outbox, features: List[str]
+            ) -> Iterator[Response]:
+        """Produces messages for a receiver as they are deposited.
+
+        Args:
+            receiver: The receiver to produce messages for.
+            outbox: Its outbox.
+            features: Protocol features to use in encoding.
+        """
+        while True:
+            message = outbox.retrieve()
+            self._release(receiver, message)
+            yield self._encode(receiver, message, features)
+            if message.closes_port:
+                return
+
+    def _encode(
+            self, receiver: Reference, message: EncodedMessage,
+            features: List[str]) -> Response:
+        """Returns the on-the-wire format of a message.
+
+        If the receiver supports it, and the settings overlay is the
+        same as that of the previous message sent to it, then the
+        overlay is replaced by a reference.
+
+        Args:
+            receiver: The receiver of the message.
+            message: The message to send.
+            features: Protocol features negotiated with the receiver.
+        """
+        if MPPFeature.OOB_GRIDS.value not in features:
+            return message.legacy()
+
+        refer_to_overlay = False
+        digest = message.overlay_digest
+        if MPPFeature.SETTINGS_REFS.value in features and digest is not None:
+            refer_to_overlay = self._overlays_sent.get(receiver) == digest
+            self._overlays_sent[receiver] = digest
+        return message.frame(refer_to_overlay)
+
+    def _get_outbox(self, receiver: Reference) -> Outbox:
+        """Get or create the outbox for a receiver.
 
         Outboxes are created dynamically, the first time a message is
-        sent to a receiver. This function checks that an outbox exists
-        for a receiver, and if not, creates one.
+        sent to or requested by a receiver. Only creating one needs the
+        lock, looking up an existing one does not.
+
+        Args:
+            receiver: The receiver whose outbox to get.
+        """
+        outbox = self._outboxes.get(receiver)
+        if outbox is None:
+            with self._outbox_lock:
+                outbox = self._get_outbox_locked(receiver)
+        return outbox
+
+    def _get_outbox_locked(self, receiver: Reference) -> Outbox:
+        """Get or create the outbox for a receiver.
+
+        Like _get_outbox(), but for use while holding the outbox lock.
 
         Args:
-            receiver: The receiver that should have an outbox.
+            receiver: The receiver whose outbox to get.
         """
-        self._outbox_lock.acquire()
-        if receiver not in self._outboxes:
-            self._outboxes[receiver] = Outbox()
-        self._outbox_lock.release()
+        outbox = self._outboxes.get(receiver)
+        if outbox is None:
+            outbox = Outbox()
+            self._outboxes[receiver] = outbox
+        return outbox
@@ -0,0 +1,93 @@
+from concurrent.futures import Future, ThreadPoolExecutor  # noqa
+from typing import Callable, Optional, Tuple  # noqa
+
+from ymmsl import Reference
+
+from libmuscle.mpp_client import MPPClient
+from libmuscle.mpp_message import ClosePort, MPPMessage
+
+
+class Prefetcher:
+    """Requests the next message for an endpoint in the background.
+
+    A Prefetcher has its own connection to the sending peer, on which
+    it requests the next message for one of our receiving endpoints as
+    soon as the previous one has been retrieved. If the receiver takes
+    a while to ask for it, then the message will already be here by
+    that time.
+
+    There is never more than one request in flight, so messages are
+    received in the order in which they were sent.
+    """
+    def __init__(self, client: MPPClient, receiver: Reference) -> None:
+        """Create a Prefetcher and start fetching the first message.
+
+        Args:
+            client: A client connected to the sending peer. The
+                    Prefetcher takes ownership.
+            receiver: The receiving endpoint to fetch messages for.
+        """
+        self._client = client
+        self._receiver = receiver
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._next = None  # type: Optional[Future[Tuple[MPPMessage, int]]]
+        self._callback = None  # type: Optional[Callable[[], None]]
+        self._start()
+
+    def notify(self, callback: Callable[[], None]) -> None:
+        """Calls a function whenever a message has been fetched.
+
+        If a message has been fetched already, the callback is called
+        right away. It is called in a background thread otherwise.
+
+        Args:
+            callback: The function to call.
+        """
+        self._callback = callback
+        if self._next is not None:
+            self._next.add_done_callback(lambda _: callback())
+
+    def available(self) -> bool:
+        """Returns whether retrieve() will return without blocking.
+        """
+        return self._next is not None and self._next.done()
+
+    def retrieve(self) -> Tuple[MPPMessage, int]:
+        """Retrieve the next message.
+
+        Blocks until a message is available, then starts fetching the
+        one after it, unless this message closes the port.
+
+        Returns:
+            The next message, and its size in bytes.
+        """
+        if self._next is None:
+            self._start()
+        message, size = self._next.result()     # type: ignore
+        self._next = None
+        if not isinstance(message.data, ClosePort):
+            self._start()
+        return message, size
+
+    def close(self) -> None:
+        """Closes the connection to the peer.
+
+        Any message that is being fetched is lost.
+        """
+        self._client.close()
+        self._executor.shutdown()
+
+    def _start(self) -> None:
+        """Starts fetching the next message.
+        """
+        self._next = self._executor.submit(self._fetch)
+        callback = self._callback
+        if callback is not None:
+            self._next.add_done_callback(lambda _: callback())
+
+    def _fetch(self) -> Tuple[MPPMessage, int]:
+        """Receives the next message.
+
+        This runs in a background thread.
+        """
+        return self._client.receive_message(self._receiver)
@@ -1,75 +1,207 @@
+from collections import deque
+import logging
+from threading import Event, Thread
 from time import time
-from typing import List, Optional
+from typing import Deque, Dict, List, Optional, Tuple  # noqa
 
-from ymmsl import Port, Reference
+from ymmsl import Identifier, Port, Reference
 
 from libmuscle.mmp_client import MMPClient
 from libmuscle.profiling import ProfileEvent, ProfileEventType
-from libmuscle.timestamp import Timestamp
+
+
+_logger = logging.getLogger(__name__)
+
+
+CLOCK_SYNC_INTERVAL = 60.0
+"""Time between clock synchronisations with the manager, in s."""
+
+
+# Event type, start time, stop time, port, port length, slot, message size,
+# outbox size
+_Record = Tuple[
+        ProfileEventType, float, float, Optional[Port], Optional[int],
+        Optional[int], Optional[int], Optional[int]]
 
 
 class Profiler:
     """Collects profiling events and sends them to the manager.
+
+    Recording an event only appends a tuple to a queue, so that it can
+    be done on every send and receive without slowing down the model.
+    A background thread takes the events from the queue and sends them
+    to the manager, whenever a batch is full or the flush interval has
+    passed, whichever comes first. The same thread resynchronises our
+    clock with the manager's every CLOCK_SYNC_INTERVAL seconds, so that
+    the times of events and log messages stay accurate over long runs.
+
+    Sends and receives can be sampled, in which case only one out of
+    every so many of them is recorded. Messages are counted separately
+    for each port and slot, so that if the sender and the receiver use
+    the same sample interval, they record the same messages and sends
+    can still be matched to receives. Registration, connection and
+    deregistration are always recorded if profiling is enabled.
     """
     def __init__(self, instance_id: Reference, manager: MMPClient) -> None:
         """Create a Profiler.
 
         Args:
+            instance_id: The instance we're profiling.
             manager: The client used to submit data to the manager.
         """
-        # TODO: use a background thread for flushing
         self._instance_id = instance_id
         self._manager = manager
-        self._events = list()   # type: List[ProfileEvent]
 
-    def start(self, event_type: ProfileEventType, port: Optional[Port] = None,
-              port_length: Optional[int] = None, slot: Optional[int] = None,
-              message_size: Optional[int] = None
-              ) -> ProfileEvent:
+        self._enabled = True
+        self._sample_interval = 1
+        self._sample_counts: Dict[
+                Tuple[ProfileEventType, Identifier, Optional[int]], int
+                ] = dict()
+        self._flush_interval = 10.0
+        self._batch_size = 1000
+        self._clock_sync_interval = CLOCK_SYNC_INTERVAL
+
+        self._events = deque()  # type: Deque[_Record]
+        self._wakeup = Event()
+        self._shutting_down = False
+        self._thread = Thread(target=self._flush_in_background, daemon=True)
+        self._thread.start()
+
+    def set_level(self, enabled: bool, sample_interval: int = 1) -> None:
+        """Sets which events to record.
+
+        Args:
+            enabled: Whether to record events at all.
+            sample_interval: Record only one out of every this many
+                    sends and receives on each port and slot.
+        """
+        if sample_interval < 1:
+            raise ValueError('The sample interval must be at least 1')
+        self._enabled = enabled
+        self._sample_interval = sample_interval
+
+    def set_flush_policy(self, interval: float, batch_size: int) -> None:
+        """Sets when to send events to the manager.
+
+        Args:
+            interval: Maximum time in seconds to hold on to an event.
+            batch_size: Send events as soon as this many are waiting.
+        """
+        if interval <= 0.0:
+            raise ValueError('The flush interval must be positive')
+        if batch_size < 1:
+            raise ValueError('The batch size must be at least 1')
+        self._flush_interval = interval
+        self._batch_size = batch_size
+        self._wakeup.set()
+
+    def start(self) -> float:
         """Start measuring an event.
 
-        Call this, then call stop() on the returned ProfileEvent at
-        the end of the event.
+        Call this at the start of the event, then pass the result to
+        record() at the end of the event.
+
+        Returns:
+            The current time.
+        """
+        return time()
+
+    def record(
+            self, event_type: ProfileEventType, start_time: float,
+            port: Optional[Port] = None, port_length: Optional[int] = None,
+            slot: Optional[int] = None, message_size: Optional[int] = None,
+            outbox_size: Optional[int] = None) -> None:
+        """Record an event that ends now.
 
         Args:
-            instance_id: Instance for which this event occurred.
             event_type: Type of event that occurred.
+            start_time: When the event started, as returned by start().
             port: Port that was sent or received on.
             port_length: Length of the port, if vector.
             slot: Slot that was sent or received on.
             message_size: Size in bytes of the message.
-
-        Returns:
-            A new ProfileEvent.
+            outbox_size: Total size in bytes of the sent messages
+                    waiting to be received, after sending.
         """
-        if len(self._events) >= 100:
-            self.__flush()
+        if not self._enabled:
+            return
 
-        now = Timestamp(time())
-        event = ProfileEvent(self._instance_id, now, now, event_type, port,
-                             port_length, slot, message_size)
-        self._events.append(event)
-        return event
+        if self._sample_interval > 1 and port is not None:
+            key = (event_type, port.name, slot)
+            count = self._sample_counts.get(key, 0) + 1
+            if count < self._sample_interval:
+                self._sample_counts[key] = count
+                return
+            self._sample_counts[key] = 0
 
-    def shutdown(self) -> None:
-        self.__flush()
+        self._events.append((
+            event_type, start_time, time(), port, port_length, slot,
+            message_size, outbox_size))
+
+        if len(self._events) >= self._batch_size:
+            if not self._wakeup.is_set():
+                self._wakeup.set()
 
     def record_event(self, event: ProfileEvent) -> None:
         """Record a profiling event.
 
-        This will record the event, and may flush this and previously
-        recorded events to the manager.
+        This is the interface used before start() and record() were
+        added, and is kept for compatibility. The event is recorded
+        as is, without sampling.
 
         Args:
             event: The event to record.
         """
-        self._events.append(event)
-        if len(self._events) >= 100:
-            self.__flush()
-        if event.event_type == ProfileEventType.DEREGISTER:
-            self.__flush()
-
-    def __flush(self) -> None:
-        if self._events:
-            self._manager.submit_profile_events(self._events)
-            self._events.clear()
+        if not self._enabled:
+            return
+
+        self._events.append((
+            event.event_type, event.start_time.seconds,
+            event.stop_time.seconds, event.port, event.port_length,
+            event.slot, event.message_size, event.outbox_size))
+
+        if len(self._events) >= self._batch_size:
+            if not self._wakeup.is_set():
+                self._wakeup.set()
+
+    def shutdown(self) -> None:
+        """Sends any remaining events and stops the background thread.
+        """
+        self._shutting_down = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def _flush_in_background(self) -> None:
+        """Sends events to the manager as they come in.
+
+        This runs in a background thread until shutdown() is called,
+        after which it sends any events that are still waiting.
+        """
+        last_sync = time()
+        while not self._shutting_down:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self._flush()
+            except Exception:
+                _logger.exception('Could not send profile events')
+
+            if time() - last_sync >= self._clock_sync_interval:
+                last_sync = time()
+                try:
+                    self._manager.sync_clock()
+                except Exception:
+                    _logger.exception('Could not synchronise clocks')
+
+        try:
+            self._flush()
+        except Exception:
+            _logger.exception('Could not send profile events')
+
+    def _flush(self) -> None:
+        """Sends all waiting events to the manager, in batches."""
+        while self._events:
+            batch = list()  # type: List[_Record]
+            while self._events and len(batch) < self._batch_size:
+                batch.append(self._events.popleft())
+            self._manager.submit_profile_records(self._instance_id, batch)
@@ -38,6 +38,8 @@ class ProfileEvent:
         port_length: Length of that port, if a vector.
         slot: Slot that was sent or received on, if applicable.
         message_size: Size of the message involved, if applicable.
+        outbox_size: Total size of the messages waiting to be \
+                received after sending, if applicable.
 
     Attributes:
         instance_id: The identifier of the instance that generated \
@@ -51,6 +53,8 @@ class ProfileEvent:
         port_length: Length of that port, if a vector.
         slot: Slot that was sent or received on, if applicable.
         message_size: Size of the message involved, if applicable.
+        outbox_size: Total size of the messages waiting to be \
+                received after sending, if applicable.
     """
     def __init__(
             self,
@@ -61,7 +65,8 @@ class ProfileEvent:
             port: Optional[Port] = None,
             port_length: Optional[int] = None,
             slot: Optional[int] = None,
-            message_size: Optional[int] = None
+            message_size: Optional[int] = None,
+            outbox_size: Optional[int] = None
             ) -> None:
 
         self.instance_id = instance_id
@@ -72,6 +77,7 @@ class ProfileEvent:
         self.port_length = port_length
         self.slot = slot
         self.message_size = message_size
+        self.outbox_size = outbox_size
 
     def stop(self) -> None:
         """Sets stop_time to the current time.
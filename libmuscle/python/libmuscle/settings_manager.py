@@ -1,6 +1,10 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union  # noqa
 
-from ymmsl import SettingValue, Reference, Settings
+from ymmsl import Identifier, SettingValue, Reference, Settings
+
+
+_CacheKey = Tuple[Reference, Reference, Optional[str]]
+_SnapshotKey = Tuple[Reference, Optional[Reference]]
 
 
 def has_setting_type(value: SettingValue, typ: str) -> bool:
@@ -43,6 +47,36 @@ def has_setting_type(value: SettingValue, typ: str) -> bool:
     raise ValueError('Invalid setting type specified: {}'.format(typ))
 
 
+class _Layer(Settings):
+    """A layer of settings that counts the changes made to it.
+
+    This lets SettingsManager tell when its cached values are out of
+    date.
+
+    Attributes:
+        version: Incremented every time a setting is set or deleted.
+    """
+    def __init__(self, settings: Settings) -> None:
+        """Create a _Layer.
+
+        Args:
+            settings: Settings to initialise the layer with. These
+                    are copied, like Settings.copy() does.
+        """
+        super().__init__()
+        self._store.update(settings.ordered_items())
+        self.version = 0
+
+    def __setitem__(self, key: Union[str, Reference], value: SettingValue
+                    ) -> None:
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key: Union[str, Reference]) -> None:
+        super().__delitem__(key)
+        self.version += 1
+
+
 class SettingsManager:
     """Manages the current settings for a component instance.
     """
@@ -57,12 +91,47 @@ class SettingsManager:
         the simulation's yMMSL description, and an overlay layer that
         holds settings that have been set at run-time.
 
+        Looked-up values are cached until either layer changes.
+
         Attributes:
             base: The base layer.
             overlay: The overlay layer.
         """
-        self.base = Settings()
-        self.overlay = Settings()
+        self._base = _Layer(Settings())
+        self._overlay = _Layer(Settings())
+        self._cache = dict()  # type: Dict[_CacheKey, SettingValue]
+        self._snapshots = dict()  # type: Dict[_SnapshotKey, Settings]
+        self._cache_versions = (0, 0)
+
+    @property
+    def base(self) -> Settings:
+        """The base layer.
+
+        Assigning to this stores a copy of the given Settings, so
+        changes to the assigned object afterwards have no effect.
+        Changes made through this property do take effect.
+        """
+        return self._base
+
+    @base.setter
+    def base(self, settings: Settings) -> None:
+        self._base = _Layer(settings)
+        self._clear_cache()
+
+    @property
+    def overlay(self) -> Settings:
+        """The overlay layer.
+
+        Assigning to this stores a copy of the given Settings, so
+        changes to the assigned object afterwards have no effect.
+        Changes made through this property do take effect.
+        """
+        return self._overlay
+
+    @overlay.setter
+    def overlay(self, settings: Settings) -> None:
+        self._overlay = _Layer(settings)
+        self._clear_cache()
 
     def get_setting(self, instance: Reference, setting_name: Reference,
                     typ: Optional[str] = None) -> SettingValue:
@@ -82,6 +151,11 @@ class SettingsManager:
                     not match `typ`.
             ValueError: If an invalid value was specified for `typ`
         """
+        self._check_cache()
+        key = (instance, setting_name, typ)
+        if key in self._cache:
+            return self._cache[key]
+
         for i in range(len(instance), -1, -1):
             if i > 0:
                 name = instance[:i] + setting_name
@@ -103,4 +177,72 @@ class SettingsManager:
                 raise TypeError('Value for setting "{}" is of type {},'
                                 ' where {} was expected.'.format(
                                     name, type(value), typ))
+
+        self._cache[key] = value
         return value
+
+    def get_settings(self, instance: Reference,
+                     prefix: Optional[Reference] = None) -> Settings:
+        """Returns the values of all settings for an instance.
+
+        The result contains the value that get_setting() would return
+        for each setting, by name without an instance prefix. Since a
+        setting in the configuration may apply to the instance and
+        have a name starting with the instance name at the same time,
+        the result may contain some settings under both names.
+
+        Args:
+            instance: The instance to get the settings for.
+            prefix: If given, only settings whose names start with
+                    this are returned.
+
+        Returns:
+            A new Settings object with the values.
+        """
+        self._check_cache()
+        key = (instance, prefix)
+        if key not in self._snapshots:
+            names = dict()  # type: Dict[Reference, None]
+            for layer in (self._base, self._overlay):
+                for setting, _ in layer.ordered_items():
+                    for name in _setting_names(instance, setting):
+                        if prefix is None or name[:len(prefix)] == prefix:
+                            names[name] = None
+
+            snapshot = Settings()
+            for name in names:
+                snapshot[name] = self.get_setting(instance, name)
+            self._snapshots[key] = snapshot
+
+        return self._snapshots[key].copy()
+
+    def _check_cache(self) -> None:
+        """Forgets all looked-up values if a layer has changed."""
+        versions = (self._base.version, self._overlay.version)
+        if versions != self._cache_versions:
+            self._clear_cache()
+
+    def _clear_cache(self) -> None:
+        """Forgets all looked-up values."""
+        self._cache.clear()
+        self._snapshots.clear()
+        self._cache_versions = (self._base.version, self._overlay.version)
+
+
+def _setting_names(instance: Reference, setting: Reference) -> List[Reference]:
+    """Returns the names by which an instance can get a setting.
+
+    This is the setting's full name, plus its name without each prefix
+    of the instance name that it starts with.
+
+    Args:
+        instance: The instance getting the setting.
+        setting: The name of the setting in the configuration.
+    """
+    result = [setting]
+    for i in range(1, min(len(instance) + 1, len(setting))):
+        if setting[:i] != instance[:i]:
+            break
+        if isinstance(setting[i], Identifier):
+            result.append(setting[i:])
+    return result
@@ -0,0 +1,30 @@
+import pytest
+
+from libmuscle.clock_sync import ClockSync
+
+
+def test_no_measurement():
+    clock = ClockSync()
+    assert clock.offset() == 0.0
+    assert clock.to_manager_time(123.0) == 123.0
+
+
+def test_offset():
+    clock = ClockSync()
+    clock.add_measurement(100.0, 50.5, 101.0)
+    assert clock.offset() == pytest.approx(-50.0)
+    assert clock.to_manager_time(200.0) == pytest.approx(150.0)
+
+    # too close together to estimate drift
+    clock.add_measurement(102.0, 52.6, 102.2)
+    assert clock.offset() == pytest.approx(-49.5)
+    assert clock.to_manager_time(200.0) == pytest.approx(150.5)
+
+
+def test_drift():
+    clock = ClockSync()
+    clock.add_measurement(999.0, 1000.0, 1001.0)
+    clock.add_measurement(1099.0, 1100.1, 1101.0)
+    assert clock.offset() == pytest.approx(0.1)
+    assert clock.to_manager_time(1100.0) == pytest.approx(1100.1)
+    assert clock.to_manager_time(1200.0) == pytest.approx(1200.2)
@@ -1,9 +1,12 @@
 from libmuscle.communicator import Communicator, Endpoint, Message
+from libmuscle.grid import Grid
+from libmuscle.mcp.local_util import shm_available
 from libmuscle.mpp_message import ClosePort, MPPMessage
 from libmuscle.port import Port
 
 from ymmsl import Conduit, Identifier, Operator, Reference, Settings
 
+import numpy as np
 import pytest
 from unittest.mock import patch, MagicMock
 
@@ -35,6 +38,11 @@ def test_endpoint_instance() -> None:
     assert endpoint3.instance() == 'test.kernel'
 
 
+def _received(message: MPPMessage):
+    encoded = message.encoded()
+    return MPPMessage.from_bytes(encoded), len(encoded)
+
+
 @pytest.fixture
 def communicator() -> Communicator:
     instance_id = Reference('kernel')
@@ -146,14 +154,18 @@ def communicator3() -> Communicator:
 def test_create_communicator(communicator) -> None:
     assert str(communicator._kernel) == 'kernel'
     assert communicator._index == [13]
-    assert len(communicator._servers) == 1
+    assert len(communicator._servers) == (3 if shm_available() else 2)
     assert communicator._clients == {}
     assert communicator._post_office._outboxes == {}
 
 
 def test_get_locations(communicator) -> None:
-    assert len(communicator.get_locations()) == 1
-    assert communicator.get_locations()[0].startswith('tcp:')
+    locations = communicator.get_locations()
+    assert len(locations) == len(communicator._servers)
+    assert locations[-1].startswith('tcp:')
+    assert locations[-2].startswith('unix:')
+    if shm_available():
+        assert locations[0].startswith('shm:')
 
 
 def test_connect() -> None:
@@ -274,7 +286,7 @@ def test_send_message(communicator, message) -> None:
 
     assert 'other.in[13]' in communicator._post_office._outboxes
     msg_bytes = communicator._post_office._outboxes[
-            'other.in[13]']._Outbox__queue.get()
+            'other.in[13]']._Outbox__queue.get().legacy()
     msg = MPPMessage.from_bytes(msg_bytes)
     assert msg.sender == 'kernel[13].out'
     assert msg.receiver == 'other.in[13]'
@@ -284,6 +296,44 @@ def test_send_message(communicator, message) -> None:
     assert msg.data == b'test'
 
 
+def test_send_message_reuses_addresses(communicator, message) -> None:
+    gpe = MagicMock(wraps=communicator._peer_manager.get_peer_endpoint)
+    communicator._peer_manager.get_peer_endpoint = gpe
+    for _ in range(3):
+        communicator.send_message('out', message)
+    gpe.assert_called_once()
+
+    outbox = communicator._post_office._outboxes['other.in[13]']
+    for _ in range(3):
+        msg = MPPMessage.from_bytes(outbox._Outbox__queue.get().legacy())
+        assert msg.sender == 'kernel[13].out'
+        assert msg.receiver == 'other.in[13]'
+
+
+def test_send_message_async(communicator) -> None:
+    communicator.set_async_send(True)
+    for i in range(3):
+        communicator.send_message(
+                'out', Message(float(i), None, b'test', Settings()))
+    communicator.flush()
+    assert not communicator._pending_sends
+
+    outbox = communicator._post_office._outboxes['other.in[13]']
+    for i in range(3):
+        msg = MPPMessage.from_bytes(outbox._Outbox__queue.get().legacy())
+        assert msg.timestamp == float(i)
+        assert msg.data == b'test'
+
+
+def test_send_message_async_error(communicator) -> None:
+    communicator.set_async_send(True)
+    communicator.send_message(
+            'out', Message(0.0, None, object(), Settings()))
+    with pytest.raises(Exception):
+        communicator.flush()
+    communicator.set_async_send(False)
+
+
 def test_send_on_disconnected_port(communicator, message) -> None:
     communicator._peer_manager.is_connected.return_value = False
     communicator.send_message('not_connected', message)
@@ -299,7 +349,7 @@ def test_send_msgpack(communicator, message2) -> None:
 
     assert 'other.in[13]' in communicator._post_office._outboxes
     msg_bytes = communicator._post_office._outboxes[
-            'other.in[13]']._Outbox__queue.get()
+            'other.in[13]']._Outbox__queue.get().legacy()
     msg = MPPMessage.from_bytes(msg_bytes)
     assert msg.sender == 'kernel[13].out'
     assert msg.receiver == 'other.in[13]'
@@ -313,7 +363,7 @@ def test_send_message_with_slot(communicator2, message) -> None:
     assert 'kernel[13].in' in \
         communicator2._post_office._outboxes
     msg_bytes = communicator2._post_office._outboxes[
-            'kernel[13].in']._Outbox__queue.get()
+            'kernel[13].in']._Outbox__queue.get().legacy()
     msg = MPPMessage.from_bytes(msg_bytes)
     assert msg.sender == 'other.out[13]'
     assert msg.receiver == 'kernel[13].in'
@@ -321,6 +371,28 @@ def test_send_message_with_slot(communicator2, message) -> None:
     assert msg.data == b'test'
 
 
+def test_broadcast_message(communicator2, message) -> None:
+    def gpe(p, s) -> Reference:
+        endpoint = MagicMock()
+        endpoint.ref.return_value = Reference('kernel[{}].in'.format(s[0]))
+        return endpoint
+
+    communicator2._peer_manager.get_peer_endpoint = gpe
+    communicator2.broadcast_message('out', message)
+
+    outboxes = communicator2._post_office._outboxes
+    assert len(outboxes) == 20
+    for slot in range(20):
+        msg_bytes = outboxes['kernel[{}].in'.format(slot)]._Outbox__queue.get(
+                ).legacy()
+        msg = MPPMessage.from_bytes(msg_bytes)
+        assert msg.sender == 'other.out[{}]'.format(slot)
+        assert msg.receiver == 'kernel[{}].in'.format(slot)
+        assert msg.port_length is None
+        assert msg.settings_overlay == Settings()
+        assert msg.data == b'test'
+
+
 def test_send_message_resizable(communicator3, message) -> None:
     with pytest.raises(RuntimeError):
         communicator3.send_message('out', message, 13)
@@ -330,7 +402,7 @@ def test_send_message_resizable(communicator3, message) -> None:
 
     assert 'other.in[13]' in communicator3._post_office._outboxes
     msg_bytes = communicator3._post_office._outboxes[
-            'other.in[13]']._Outbox__queue.get()
+            'other.in[13]']._Outbox__queue.get().legacy()
     msg = MPPMessage.from_bytes(msg_bytes)
     assert msg.sender == 'kernel.out[13]'
     assert msg.receiver == 'other.in[13]'
@@ -343,7 +415,7 @@ def test_send_message_with_settings(communicator, message) -> None:
 
     assert 'other.in[13]' in communicator._post_office._outboxes
     msg_bytes = communicator._post_office._outboxes[
-            'other.in[13]']._Outbox__queue.get()
+            'other.in[13]']._Outbox__queue.get().legacy()
     msg = MPPMessage.from_bytes(msg_bytes)
     assert msg.sender == 'kernel[13].out'
     assert msg.receiver == 'other.in[13]'
@@ -358,7 +430,7 @@ def test_send_settings(communicator, message) -> None:
 
     assert 'other.in[13]' in communicator._post_office._outboxes
     msg_bytes = communicator._post_office._outboxes[
-            'other.in[13]']._Outbox__queue.get()
+            'other.in[13]']._Outbox__queue.get().legacy()
     msg = MPPMessage.from_bytes(msg_bytes)
     assert msg.sender == 'kernel[13].out'
     assert msg.receiver == 'other.in[13]'
@@ -371,7 +443,7 @@ def test_close_port(communicator) -> None:
 
     assert 'other.in[13]' in communicator._post_office._outboxes
     msg_bytes = communicator._post_office._outboxes[
-            'other.in[13]']._Outbox__queue.get()
+            'other.in[13]']._Outbox__queue.get().legacy()
     msg = MPPMessage.from_bytes(msg_bytes)
     assert msg.sender == 'kernel[13].out'
     assert msg.receiver == 'other.in[13]'
@@ -383,10 +455,10 @@ def test_close_port(communicator) -> None:
 
 def test_receive_message(communicator) -> None:
     client_mock = MagicMock()
-    client_mock.receive.return_value = MPPMessage(
+    client_mock.receive_into.return_value = _received(MPPMessage(
             Reference('other.out[13]'), Reference('kernel[13].in'),
             None, 0.0, None, Settings({'test1': 12}),
-            b'test').encoded()
+            b'test'))
     get_client_mock = MagicMock(return_value=client_mock)
     communicator._Communicator__get_client = get_client_mock
     communicator._profiler = MagicMock()
@@ -394,11 +466,38 @@ def test_receive_message(communicator) -> None:
     msg = communicator.receive_message('in')
 
     get_client_mock.assert_called_with(Reference('other'))
-    client_mock.receive.assert_called_with(Reference('kernel[13].in'))
+    client_mock.receive_into.assert_called_with(
+            Reference('kernel[13].in'), None)
     assert msg.data == b'test'
     assert msg.settings['test1'] == 12
 
 
+def test_receive_into_buffer(communicator) -> None:
+    array = np.zeros(3)
+    client_mock = MagicMock()
+    client_mock.receive_into.return_value = (MPPMessage(
+            Reference('other.out[13]'), Reference('kernel[13].in'),
+            None, 0.0, None, Settings(), Grid(array)), 100)
+    communicator._Communicator__get_client = MagicMock(
+            return_value=client_mock)
+    communicator._profiler = MagicMock()
+
+    communicator.set_receive_buffer('in', None, array)
+    msg = communicator.receive_message('in')
+    client_mock.receive_into.assert_called_with(
+            Reference('kernel[13].in'), array)
+    assert msg.data.array is array
+
+    communicator.set_receive_buffer('in', None, None)
+    client_mock.receive_into.return_value = _received(MPPMessage(
+            Reference('other.out[13]'), Reference('kernel[13].in'),
+            None, 0.0, None, Settings(), b'test'))
+    msg = communicator.receive_message('in')
+    client_mock.receive_into.assert_called_with(
+            Reference('kernel[13].in'), None)
+    assert msg.data == b'test'
+
+
 def test_receive_message_default(communicator) -> None:
     communicator._peer_manager.is_connected.return_value = False
     default_msg = Message(3.0, 4.0, 'test', Settings())
@@ -422,10 +521,10 @@ def test_receive_on_invalid_port(communicator) -> None:
 
 def test_receive_msgpack(communicator) -> None:
     client_mock = MagicMock()
-    client_mock.receive.return_value = MPPMessage(
+    client_mock.receive_into.return_value = _received(MPPMessage(
             Reference('other.out[13]'), Reference('kernel[13].in'),
             None, 0.0, None, Settings({'test1': 12}),
-            {'test': 13}).encoded()
+            {'test': 13}))
     get_client_mock = MagicMock(return_value=client_mock)
     communicator._Communicator__get_client = get_client_mock
     communicator._profiler = MagicMock()
@@ -433,16 +532,17 @@ def test_receive_msgpack(communicator) -> None:
     msg = communicator.receive_message('in')
 
     get_client_mock.assert_called_with(Reference('other'))
-    client_mock.receive.assert_called_with(Reference('kernel[13].in'))
+    client_mock.receive_into.assert_called_with(
+            Reference('kernel[13].in'), None)
     assert msg.data == {'test': 13}
 
 
 def test_receive_with_slot(communicator2) -> None:
     client_mock = MagicMock()
-    client_mock.receive.return_value = MPPMessage(
+    client_mock.receive_into.return_value = _received(MPPMessage(
             Reference('kernel[13].out'), Reference('other.in[13]'),
             None, 0.0, None, Settings({'test': 'testing'}),
-            b'test').encoded()
+            b'test'))
     get_client_mock = MagicMock(return_value=client_mock)
     communicator2._Communicator__get_client = get_client_mock
     communicator2._profiler = MagicMock()
@@ -450,17 +550,63 @@ def test_receive_with_slot(communicator2) -> None:
     msg = communicator2.receive_message('in', 13)
 
     get_client_mock.assert_called_with(Reference('kernel[13]'))
-    client_mock.receive.assert_called_with(Reference('other.in[13]'))
+    client_mock.receive_into.assert_called_with(
+            Reference('other.in[13]'), None)
     assert msg.data == b'test'
     assert msg.settings['test'] == 'testing'
 
 
+def test_receive_messages(communicator2) -> None:
+    def gpe(p, s) -> Reference:
+        endpoint = MagicMock()
+        endpoint.instance.return_value = Reference(f'kernel[{s[0] % 2}]')
+        endpoint.ref.return_value = Reference(f'kernel[{s[0] % 2}].out')
+        return endpoint
+
+    communicator2._peer_manager.get_peer_endpoint = gpe
+
+    def get_client(instance: Reference) -> MagicMock:
+        client = MagicMock()
+        client.receive_into.return_value = _received(MPPMessage(
+                instance + 'out', Reference('other.in'), None, 0.0, None,
+                Settings(), str(instance)))
+        return client
+
+    get_client_mock = MagicMock(side_effect=get_client)
+    communicator2._Communicator__get_client = get_client_mock
+    communicator2._profiler = MagicMock()
+
+    slots = [('in', slot) for slot in range(4)]
+    arrived = dict()
+    received = communicator2.receive_messages(slots, arrived.__setitem__)
+
+    assert len(received) == 4
+    for slot in range(4):
+        assert received[('in', slot)].data == f'kernel[{slot % 2}]'
+    assert arrived == received
+    assert not communicator2._async_receivers
+    assert not communicator2._prefetchers
+
+    # messages that arrived are passed on even if another receive fails
+    def get_failing_client(instance: Reference) -> MagicMock:
+        client = get_client(instance)
+        if instance == 'kernel[1]':
+            client.receive_into.side_effect = RuntimeError()
+        return client
+
+    get_client_mock.side_effect = get_failing_client
+    arrived.clear()
+    with pytest.raises(RuntimeError):
+        communicator2.receive_messages(slots, arrived.__setitem__)
+    assert set(arrived) == {('in', 0), ('in', 2)}
+
+
 def test_receive_message_resizable(communicator3) -> None:
     client_mock = MagicMock()
-    client_mock.receive.return_value = MPPMessage(
+    client_mock.receive_into.return_value = _received(MPPMessage(
             Reference('other.out[13]'), Reference('kernel.in[13]'),
             20, 0.0, None, Settings({'test': 'testing'}),
-            b'test').encoded()
+            b'test'))
     get_client_mock = MagicMock(return_value=client_mock)
     communicator3._Communicator__get_client = get_client_mock
     communicator3._profiler = MagicMock()
@@ -468,17 +614,18 @@ def test_receive_message_resizable(communicator3) -> None:
     msg = communicator3.receive_message('in', 13)
 
     get_client_mock.assert_called_with(Reference('other'))
-    client_mock.receive.assert_called_with(Reference('kernel.in[13]'))
+    client_mock.receive_into.assert_called_with(
+            Reference('kernel.in[13]'), None)
     assert msg.data == b'test'
     assert communicator3.get_port('in').get_length() == 20
 
 
 def test_receive_with_settings(communicator) -> None:
     client_mock = MagicMock()
-    client_mock.receive.return_value = MPPMessage(
+    client_mock.receive_into.return_value = _received(MPPMessage(
             Reference('other.out[13]'), Reference('kernel[13].in'),
             None, 0.0, None, Settings({'test2': 3.1}),
-            b'test').encoded()
+            b'test'))
     get_client_mock = MagicMock(return_value=client_mock)
     communicator._Communicator__get_client = get_client_mock
     communicator._profiler = MagicMock()
@@ -486,17 +633,18 @@ def test_receive_with_settings(communicator) -> None:
     msg = communicator.receive_message('in')
 
     get_client_mock.assert_called_with(Reference('other'))
-    client_mock.receive.assert_called_with(Reference('kernel[13].in'))
+    client_mock.receive_into.assert_called_with(
+            Reference('kernel[13].in'), None)
     assert msg.data == b'test'
     assert msg.settings['test2'] == 3.1
 
 
 def test_receive_msgpack_with_slot_and_settings(communicator2) -> None:
     client_mock = MagicMock()
-    client_mock.receive.return_value = MPPMessage(
+    client_mock.receive_into.return_value = _received(MPPMessage(
             Reference('kernel[13].out'), Reference('other.in[13]'),
             None, 0.0, 1.0,
-            Settings({'test': 'testing'}), 'test').encoded()
+            Settings({'test': 'testing'}), 'test'))
     get_client_mock = MagicMock(return_value=client_mock)
     communicator2._Communicator__get_client = get_client_mock
     communicator2._profiler = MagicMock()
@@ -504,17 +652,18 @@ def test_receive_msgpack_with_slot_and_settings(communicator2) -> None:
     msg = communicator2.receive_message('in', 13)
 
     get_client_mock.assert_called_with(Reference('kernel[13]'))
-    client_mock.receive.assert_called_with(Reference('other.in[13]'))
+    client_mock.receive_into.assert_called_with(
+            Reference('other.in[13]'), None)
     assert msg.data == 'test'
     assert msg.settings['test'] == 'testing'
 
 
 def test_receive_settings(communicator) -> None:
     client_mock = MagicMock()
-    client_mock.receive.return_value = MPPMessage(
+    client_mock.receive_into.return_value = _received(MPPMessage(
             Reference('other.out[13]'), Reference('kernel[13].in'),
             None, 0.0, None, Settings({'test1': 12}),
-            Settings({'test': 13})).encoded()
+            Settings({'test': 13})))
     get_client_mock = MagicMock(return_value=client_mock)
     communicator._Communicator__get_client = get_client_mock
     communicator._profiler = MagicMock()
@@ -522,16 +671,17 @@ def test_receive_settings(communicator) -> None:
     msg = communicator.receive_message('in')
 
     get_client_mock.assert_called_with(Reference('other'))
-    client_mock.receive.assert_called_with(Reference('kernel[13].in'))
+    client_mock.receive_into.assert_called_with(
+            Reference('kernel[13].in'), None)
     assert isinstance(msg.data, Settings)
     assert msg.data['test'] == 13
 
 
 def test_receive_close_port(communicator) -> None:
     client_mock = MagicMock()
-    client_mock.receive.return_value = MPPMessage(
+    client_mock.receive_into.return_value = _received(MPPMessage(
             Reference('other.out[13]'), Reference('kernel[13].in'),
-            None, 0.0, None, Settings(), ClosePort()).encoded()
+            None, 0.0, None, Settings(), ClosePort()))
     get_client_mock = MagicMock(return_value=client_mock)
     communicator._Communicator__get_client = get_client_mock
     communicator._profiler = MagicMock()
@@ -547,4 +697,24 @@ def test_get_message(communicator, message) -> None:
             Reference('kernel[13].out'), Reference('other.in[13]'),
             None, 0.0, None, Settings(), b'test').encoded()
     assert communicator._post_office.get_message(
-            'other.in[13]') == ref_message
+            'other.in[13]').legacy() == ref_message
+
+
+def test_receive_any_message_not_vector(communicator) -> None:
+    with pytest.raises(RuntimeError):
+        communicator.receive_any_message('in')
+
+
+def test_probe_message_disconnected(communicator) -> None:
+    communicator._peer_manager.is_connected.return_value = False
+    with pytest.raises(RuntimeError):
+        communicator.probe_message('not_connected')
+
+
+def test_receive_message_async_default(communicator) -> None:
+    communicator._peer_manager.is_connected.return_value = False
+    future = communicator.receive_message_async(
+            'not_connected', None, 'testing')
+    assert future.result() == 'testing'
+    with pytest.raises(RuntimeError):
+        communicator.receive_message_async('not_connected')
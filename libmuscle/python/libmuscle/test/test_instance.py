@@ -1,6 +1,7 @@
+from concurrent.futures import Future
 import sys
 from typing import Generator
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 
 import pytest
 from ymmsl import Operator, Reference, Settings
@@ -35,6 +36,17 @@ def sys_argv_instance() -> Generator[None, None, None]:
     sys.argv = old_argv
 
 
+def _receive_messages(communicator):
+    def receive_messages(slots, callback=None):
+        received = dict()
+        for slot in slots:
+            received[slot] = communicator.receive_message(*slot)
+            if callback is not None:
+                callback(slot, received[slot])
+        return received
+    return receive_messages
+
+
 @pytest.fixture
 def instance(sys_argv_instance):
     with patch('libmuscle.instance.MMPClient') as mmp_client, \
@@ -44,6 +56,8 @@ def instance(sys_argv_instance):
         settings['test1'] = 12
         msg = Message(0.0, 1.0, 'message', settings)
         communicator.receive_message.return_value = msg
+        communicator.receive_messages.side_effect = _receive_messages(
+                communicator)
         comm_type.return_value = communicator
 
         mmp_client_object = MagicMock()
@@ -61,7 +75,10 @@ def instance(sys_argv_instance):
 @pytest.fixture
 def instance2(sys_argv_instance):
     with patch('libmuscle.instance.MMPClient') as mmp_client, \
-         patch('libmuscle.instance.Communicator'):
+         patch('libmuscle.instance.Communicator') as comm_type:
+        communicator = comm_type.return_value
+        communicator.receive_messages.side_effect = _receive_messages(
+                communicator)
         mmp_client_object = MagicMock()
         mmp_client_object.request_peers.return_value = (None, None, None)
         mmp_client.return_value = mmp_client_object
@@ -144,6 +161,20 @@ def test_get_setting(instance):
         instance.get_setting('test2', 'nonexistenttype')
 
 
+def test_get_settings(instance):
+    instance._settings_manager.base = Settings({
+        'test1': 'test', 'solver.tol': 1e-6, 'solver.max_iter': 10})
+    instance._settings_manager.overlay = Settings({'solver.max_iter': 20})
+
+    settings = instance.get_settings()
+    assert settings.as_ordered_dict() == {
+            'test1': 'test', 'solver.tol': 1e-6, 'solver.max_iter': 20}
+
+    settings = instance.get_settings('solver')
+    assert settings.as_ordered_dict() == {
+            'solver.tol': 1e-6, 'solver.max_iter': 20}
+
+
 def test_list_ports(instance):
     ports = instance.list_ports()
     assert instance._communicator.list_ports.called_with()
@@ -164,6 +195,12 @@ def test_send(instance, message):
             'out', message, 1)
 
 
+def test_send_all(instance, message):
+    instance.send_all('out', message)
+    instance._communicator.broadcast_message.assert_called_with(
+            'out', message)
+
+
 def test_send_invalid_port(instance, message):
     instance._communicator.port_exists.return_value = False
     with pytest.raises(RuntimeError):
@@ -212,6 +249,72 @@ def test_receive_with_settings(instance):
     assert msg.settings['test1'] == 12
 
 
+def test_probe(instance):
+    port = instance._communicator.get_port.return_value
+    port.operator = Operator.S
+    instance._communicator.probe_message.return_value = True
+    assert instance.probe('in', 1)
+    instance._communicator.probe_message.assert_called_with('in', 1)
+
+    port.operator = Operator.F_INIT
+    assert not instance.probe('in', 1)
+
+
+def test_receive_async(instance):
+    port = instance._communicator.get_port.return_value
+    port.operator = Operator.S
+    port.is_open.return_value = True
+    receiving = Future()
+    instance._communicator.receive_message_async.return_value = receiving
+
+    result = instance.receive_async('in', 1)
+    instance._communicator.receive_message_async.assert_called_with(
+            'in', 1, None)
+    assert not result.done()
+
+    receiving.set_result(Message(0.0, 1.0, 'message', Settings()))
+    msg = result.result()
+    assert msg.data == 'message'
+    assert msg.settings is None
+
+
+def test_receive_async_closed(instance):
+    port = instance._communicator.get_port.return_value
+    port.operator = Operator.S
+    port.is_open.return_value = False
+    receiving = Future()
+    receiving.set_result(Message(0.0, None, ClosePort(), Settings()))
+    instance._communicator.receive_message_async.return_value = receiving
+
+    result = instance.receive_async('in')
+    with pytest.raises(RuntimeError):
+        result.result()
+
+
+def test_receive_any(instance):
+    port = instance._communicator.get_port.return_value
+    port.operator = Operator.S
+    port.is_open.return_value = True
+    instance._communicator.receive_any_message.return_value = (
+            3, Message(0.0, 1.0, 'message', Settings()))
+    slot, msg = instance.receive_any('in')
+    instance._communicator.receive_any_message.assert_called_with('in')
+    assert slot == 3
+    assert msg.data == 'message'
+    assert msg.settings is None
+
+
+def test_receive_any_with_settings(instance):
+    port = instance._communicator.get_port.return_value
+    port.operator = Operator.S
+    port.is_open.return_value = True
+    instance._communicator.receive_any_message.return_value = (
+            3, Message(0.0, 1.0, 'message', Settings({'test1': 12})))
+    slot, msg = instance.receive_any_with_settings('in')
+    assert slot == 3
+    assert msg.settings['test1'] == 12
+
+
 def test_receive_with_settings_default(instance):
     instance.receive_with_settings('not_connected', 1, 'testing')
     assert instance._communicator.receive_message.called_with(
@@ -278,7 +381,8 @@ def test_reuse_instance_vector_port(instance2):
             return Message(0.0, None, data, Settings())
         assert False    # pragma: no cover
 
-    instance2._communicator.receive_message = receive_message
+    instance2._communicator.receive_message = MagicMock(
+            side_effect=receive_message)
     instance2._communicator.list_ports.return_value = {
             Operator.F_INIT: ['in'],
             Operator.O_F: ['out']}
@@ -286,17 +390,31 @@ def test_reuse_instance_vector_port(instance2):
     port = MagicMock()
     port.is_vector.return_value = True
     port.is_connected.return_value = True
+    port.is_resizable.return_value = False
     port.get_length.return_value = 10
     instance2._communicator.get_port.return_value = port
 
     do_reuse = instance2.reuse_instance()
     assert do_reuse is True
 
+    # all slots are received together
+    instance2._communicator.receive_messages.assert_any_call(
+            [('in', slot) for slot in range(10)], ANY)
+
     msg = instance2.receive('in', 5)
     assert msg.timestamp == 0.0
     assert msg.next_timestamp is None
     assert msg.data == 'test 5'
 
+    # resizable ports get their length from slot 0
+    port.is_resizable.return_value = True
+    instance2._communicator.receive_messages.reset_mock()
+    do_reuse = instance2.reuse_instance()
+    assert do_reuse is True
+    instance2._communicator.receive_messages.assert_any_call([('in', 0)], ANY)
+    instance2._communicator.receive_messages.assert_called_with(
+            [('in', slot) for slot in range(1, 10)], ANY)
+
 
 def test_reuse_instance_no_f_init_ports(instance):
     instance._communicator.receive_message.return_value = Message(
@@ -312,3 +430,10 @@ def test_reuse_instance_no_f_init_ports(instance):
 def test_reuse_instance_miswired(instance):
     with pytest.raises(RuntimeError):
         instance.reuse_instance()
+
+
+def test_reuse_instance_send_error(instance):
+    instance._communicator.flush.side_effect = RuntimeError('lost')
+    with pytest.raises(RuntimeError):
+        instance.reuse_instance()
+    instance._communicator.shutdown.assert_called_with()
@@ -1,3 +1,4 @@
+import time
 from unittest.mock import patch
 
 import msgpack
@@ -7,6 +8,7 @@ from ymmsl import Conduit, Operator, Port, Reference
 from libmuscle.logging import LogLevel, LogMessage, Timestamp
 from libmuscle.mcp.protocol import RequestType, ResponseType
 from libmuscle.mmp_client import MMPClient
+from libmuscle.profiling import ProfileEventType
 
 
 def test_init() -> None:
@@ -47,6 +49,50 @@ def test_submit_log_message(mocked_mmp_client) -> None:
             'Testing the MMPClient']
 
 
+def test_submit_profile_records(mocked_mmp_client) -> None:
+    client, stub = mocked_mmp_client
+    result = [ResponseType.SUCCESS.value]
+    stub.call.return_value = msgpack.packb(result, use_bin_type=True)
+
+    port = Port(Reference('out'), Operator.O_I)
+    client.submit_profile_records(Reference('macro'), [
+        (ProfileEventType.REGISTER, 1.0, 2.0, None, None, None, None, None),
+        (ProfileEventType.SEND, 3.0, 3.5, port, 10, 3, 1000, 5000)])
+
+    sent_request = stub.call.call_args[0][0]
+    decoded_request = msgpack.unpackb(sent_request, raw=False)
+
+    assert decoded_request == [
+            RequestType.SUBMIT_PROFILE_EVENTS.value, [
+                [
+                    'macro', 1.0, 2.0, ProfileEventType.REGISTER.value,
+                    None, None, None, None, None],
+                [
+                    'macro', 3.0, 3.5, ProfileEventType.SEND.value,
+                    ['out', 'O_I'], 10, 3, 1000, 5000]]]
+
+
+def test_sync_clock(mocked_mmp_client) -> None:
+    client, stub = mocked_mmp_client
+    assert client.clock_offset() == 0.0
+
+    manager_time = time.time() + 1000.0
+    result = [ResponseType.SUCCESS.value, manager_time]
+    stub.call.return_value = msgpack.packb(result, use_bin_type=True)
+
+    client.sync_clock()
+    sent_request = msgpack.unpackb(stub.call.call_args[0][0], raw=False)
+    assert sent_request == [RequestType.GET_TIME.value]
+    assert client.clock_offset() == pytest.approx(1000.0, abs=1.0)
+
+    stub.call.return_value = msgpack.packb(
+            [ResponseType.SUCCESS.value], use_bin_type=True)
+    client.submit_log_message(LogMessage(
+        'test_mmp_client', Timestamp(10.0), LogLevel.INFO, 'Testing'))
+    sent_request = msgpack.unpackb(stub.call.call_args[0][0], raw=False)
+    assert sent_request[2] == pytest.approx(1010.0, abs=1.0)
+
+
 def test_get_settings(mocked_mmp_client) -> None:
     client, stub = mocked_mmp_client
 
@@ -104,6 +150,7 @@ def test_request_peers(mocked_mmp_client) -> None:
     sent_msg = msgpack.unpackb(stub.call.call_args[0][0], raw=False)
     assert sent_msg[0] == RequestType.GET_PEERS.value
     assert sent_msg[1] == 'kernel[13]'
+    assert sent_msg[2] > 0.0
 
     assert len(result[0]) == 1
     assert isinstance(result[0][0], Conduit)
@@ -133,9 +180,7 @@ def test_request_peers_timeout(mocked_mmp_client) -> None:
     result_msg = [ResponseType.PENDING.value, 'test_status_message']
     stub.call.return_value = msgpack.packb(result_msg, use_bin_type=True)
 
-    with patch('libmuscle.mmp_client.PEER_TIMEOUT', 1), \
-            patch('libmuscle.mmp_client.PEER_INTERVAL_MIN', 0.1), \
-            patch('libmuscle.mmp_client.PEER_INTERVAL_MAX', 1.0):
+    with patch('libmuscle.mmp_client.PEER_TIMEOUT', 0.1):
         with pytest.raises(RuntimeError):
             client.request_peers(Reference('kernel[13]'))
 
@@ -0,0 +1,153 @@
+import msgpack
+import numpy as np
+from ymmsl import Reference, Settings
+
+from libmuscle.mcp.protocol import MPPFeature, RequestType
+from libmuscle.inbox import Inbox
+from libmuscle.mcp.tcp_transport_server import TcpTransportServer
+from libmuscle.mcp.transport_server import Responder
+from libmuscle.mcp.type_registry import transport_server_types
+from libmuscle.mpp_client import MPPClient
+from libmuscle.mpp_message import (
+        ClosePort, MPPMessage, OOB_MAGIC, OverlayCache)
+from libmuscle.post_office import PostOffice
+
+
+class LegacyPostOffice(PostOffice):
+    """Rejects feature negotiation, like older peers do."""
+    def handle_request(self, request: bytes) -> bytes:
+        self._check_legacy(request)
+        return super().handle_request(request)
+
+    def handle_request_async(
+            self, request: bytes, respond: Responder) -> None:
+        self._check_legacy(request)
+        super().handle_request_async(request, respond)
+
+    def _check_legacy(self, request: bytes) -> None:
+        req = msgpack.unpackb(request, raw=False)
+        if len(req) != 2 or req[0] != RequestType.GET_NEXT_MESSAGE.value:
+            raise RuntimeError('Invalid request type')
+
+
+def _grid_message() -> MPPMessage:
+    return MPPMessage(
+            Reference('sender.out'), Reference('receiver.in'), None,
+            0.0, None, Settings(), np.arange(10.0))
+
+
+def _receive(post_office: PostOffice) -> bytes:
+    server = TcpTransportServer(post_office)
+    client = MPPClient([server.get_location()])
+    try:
+        post_office.deposit(
+                Reference('receiver.in'), _grid_message().encoded_frame())
+        return client.receive(Reference('receiver.in'))
+    finally:
+        client.close()
+        server.close()
+
+
+def test_negotiate_oob_grids() -> None:
+    post_office = PostOffice()
+    server = TcpTransportServer(post_office)
+    client = MPPClient([server.get_location()])
+    assert client.supports(MPPFeature.OOB_GRIDS)
+    assert client.supports(MPPFeature.PUSH)
+    assert client.supports(MPPFeature.CHANNELS)
+    client.close()
+    server.close()
+
+    received = _receive(PostOffice())
+    assert received[:len(OOB_MAGIC)] == OOB_MAGIC
+    msg = MPPMessage.from_bytes(received)
+    assert msg.data.array.tolist() == list(np.arange(10.0))
+
+
+def test_channels() -> None:
+    post_office = PostOffice()
+    received = _receive(post_office)
+    assert MPPMessage.from_bytes(received).receiver == 'receiver.in'
+    assert [
+            str(receiver)
+            for receiver, _ in post_office._channels] == ['receiver.in']
+
+
+def test_fall_back_to_legacy() -> None:
+    received = _receive(LegacyPostOffice())
+    assert received == _grid_message().encoded()
+
+    server = TcpTransportServer(LegacyPostOffice())
+    client = MPPClient([server.get_location()])
+    assert not client.supports(MPPFeature.PUSH)
+    client.close()
+    server.close()
+
+
+def test_subscribe() -> None:
+    post_office = PostOffice()
+    receiver = Reference('receiver.in')
+    for transport_server_type in transport_server_types:
+        server = transport_server_type(post_office)
+        client = MPPClient([server.get_location()])
+        assert client.supports(MPPFeature.PUSH)
+
+        post_office.deposit(receiver, _grid_message().encoded_frame())
+        inbox = Inbox(client, receiver)
+
+        msg, size = inbox.retrieve()
+        assert msg.data.array.tolist() == list(np.arange(10.0))
+        assert size > 80
+
+        for data in (b'x' * 100000, ClosePort()):
+            post_office.deposit(receiver, MPPMessage(
+                Reference('sender.out'), receiver, None, 0.0, None,
+                Settings(), data).encoded_frame())
+            msg, _ = inbox.retrieve()
+            assert msg.data == data or isinstance(data, ClosePort)
+
+        # subscription ends after ClosePort
+        inbox._thread.join()
+        inbox.close()
+        server.close()
+
+
+def test_settings_refs() -> None:
+    post_office = PostOffice()
+    server = TcpTransportServer(post_office)
+    receiver = Reference('receiver.in')
+    overlay = Settings({'test{}'.format(i): float(i) for i in range(100)})
+
+    def send() -> None:
+        post_office.deposit(receiver, MPPMessage(
+            Reference('sender.out'), receiver, None, 0.0, None, overlay,
+            b'test').encoded_frame())
+
+    client = MPPClient([server.get_location()])
+    assert not client.supports(MPPFeature.SETTINGS_REFS)
+    for _ in range(2):
+        send()
+        msg, size = client.receive_message(receiver)
+        assert size > 1000
+        assert msg.settings_overlay == overlay
+    client.close()
+
+    # overlays are sent once per receiver, even with several clients
+    overlays = {receiver: OverlayCache()}
+    client1 = MPPClient([server.get_location()], overlays)
+    client2 = MPPClient([server.get_location()], overlays)
+    assert client1.supports(MPPFeature.SETTINGS_REFS)
+    sizes = list()
+    for client in (client1, client2, client1):
+        send()
+        msg, size = client.receive_message(receiver)
+        sizes.append(size)
+        assert msg.settings_overlay == overlay
+        assert msg.data == b'test'
+    assert sizes[0] > 1000
+    assert sizes[1] < 200
+    assert sizes[2] < 200
+
+    client1.close()
+    client2.close()
+    server.close()
@@ -2,11 +2,14 @@ import struct
 
 import msgpack
 import numpy as np
+import pytest
 
 from ymmsl import Reference, Settings
 
 from libmuscle.grid import Grid
-from libmuscle.mpp_message import MPPMessage
+from libmuscle.mcp.transport_client import BufferResponseReader
+from libmuscle.mpp_message import (
+        ClosePort, MPPMessage, OOB_ALIGNMENT, OOB_MAGIC, OverlayCache)
 
 
 def test_create() -> None:
@@ -182,3 +185,239 @@ def test_non_contiguous_grid_roundtrip() -> None:
     assert grid_out.array.size == 12
     assert grid_out.array[1, 0, 1] == 8.0
     assert grid_out.array[0, 0, 2] == 3.0
+
+
+def test_oob_grid_roundtrip() -> None:
+    sender = Reference('sender.port')
+    receiver = Reference('receiver.port')
+
+    for order in ('C', 'F'):
+        array = np.array(
+                np.arange(24, dtype=np.int64).reshape((2, 3, 4)),
+                order=order)
+        data = {
+                'grid': Grid(array, ['x', 'y', 'z']),
+                'array': array[:, 1, :].astype(np.float32),
+                'flags': np.array([True, False, True]),
+                'empty': np.zeros((0, 3), np.int32),
+                'text': 'testing'}
+        msg = MPPMessage(
+                sender, receiver, None, 10.0, 11.0,
+                Settings({'test': 13}), data)
+
+        encoded = msg.encoded_frame()
+        frame = encoded.frame()
+        assert frame[0][:len(OOB_MAGIC)] == OOB_MAGIC
+        wire_data = bytearray(b''.join(frame))
+        assert len(wire_data) == encoded.size
+
+        # the grid data is sent out-of-band and snapshotted
+        array[0, 0, 0] = 100
+        assert array.tobytes(order='A') not in wire_data
+
+        msg_out = MPPMessage.from_bytes(wire_data)
+        assert msg_out.sender == sender
+        assert msg_out.timestamp == 10.0
+        assert msg_out.settings_overlay == Settings({'test': 13})
+        assert msg_out.data['text'] == 'testing'
+
+        grid_out = msg_out.data['grid']
+        assert grid_out.indexes == ['x', 'y', 'z']
+        assert grid_out.array.dtype == np.int64
+        assert grid_out.array[0, 0, 0] == 0
+        assert grid_out.array[1, 2, 3] == 23
+        assert not grid_out.array.flags.writeable
+        assert grid_out.array.flags.f_contiguous == (order == 'F')
+
+        # which is a view into the received buffer
+        assert np.shares_memory(
+                grid_out.array, np.frombuffer(wire_data, np.uint8))
+        offset = grid_out.array.__array_interface__['data'][0] - (
+                np.frombuffer(wire_data, np.uint8).__array_interface__[
+                    'data'][0])
+        assert offset % OOB_ALIGNMENT == 0
+
+        assert msg_out.data['array'].array.tolist() == [
+                [4.0, 5.0, 6.0, 7.0], [16.0, 17.0, 18.0, 19.0]]
+        assert msg_out.data['flags'].array.tolist() == [True, False, True]
+        assert msg_out.data['empty'].array.shape == (0, 3)
+
+
+def test_legacy_encoding() -> None:
+    sender = Reference('sender.port')
+    receiver = Reference('receiver.port')
+
+    array = np.arange(12, dtype=np.float64).reshape((3, 4), order='F')
+    for data in (
+            Grid(array, ['x', 'y']), [array, ClosePort()], b'test', None):
+        msg = MPPMessage(
+                sender, receiver, 3, 10.0, None, Settings({'test': [1.0]}),
+                data)
+        assert msg.encoded_frame().legacy() == msg.encoded()
+
+    # messages without grids are the same either way
+    msg = MPPMessage(
+            sender, receiver, None, 10.0, None, Settings(), {1: 'test'})
+    assert b''.join(msg.encoded_frame().frame()) == msg.encoded()
+
+
+def test_encoded_frames() -> None:
+    array = np.arange(12, dtype=np.float64).reshape((3, 4))
+    for data in (Grid(array, ['x', 'y']), b'test', ClosePort()):
+        msg = MPPMessage(
+                Reference('sender.port'), Reference('receiver.port'), None,
+                10.0, 11.0, Settings({'test': 13}), data)
+        addresses = [
+                (
+                    Reference('sender.port') + i,
+                    Reference('receiver') + i + 'port',
+                    20)
+                for i in range(3)]
+        encoded = list(msg.encoded_frames(addresses))
+        assert len(encoded) == 3
+
+        for (sender, receiver, port_length), enc in zip(addresses, encoded):
+            single = MPPMessage(
+                    sender, receiver, port_length, 10.0, 11.0,
+                    Settings({'test': 13}), data).encoded_frame()
+            assert b''.join(enc.frame()) == b''.join(single.frame())
+            assert enc.legacy() == single.legacy()
+            assert enc.size == single.size
+            assert enc.closes_port == isinstance(data, ClosePort)
+
+        # the data is shared rather than copied
+        assert all(
+                a is b for a, b in zip(
+                    encoded[0]._buffers, encoded[1]._buffers))
+
+        # addresses may be given in their wire form
+        strings = [(str(s), str(r), n) for s, r, n in addresses]
+        for enc, enc_str in zip(encoded, msg.encoded_frames(strings)):
+            assert b''.join(enc.frame()) == b''.join(enc_str.frame())
+
+
+def test_receive_into_destination() -> None:
+    sender = Reference('sender.port')
+    receiver = Reference('receiver.port')
+
+    for order in ('C', 'F'):
+        array = np.array(
+                np.arange(12, dtype=np.float64).reshape((3, 4)), order=order)
+        msg = MPPMessage(
+                sender, receiver, None, 0.0, None, Settings(),
+                Grid(array, ['x', 'y']))
+        frame = b''.join(msg.encoded_frame().frame())
+
+        for dest_order in ('C', 'F'):
+            # received directly if possible, copied otherwise
+            dest = np.zeros((3, 4), order=dest_order)
+            for wire_data in (frame, msg.encoded()):
+                dest[:] = 0.0
+                reader = BufferResponseReader(wire_data)
+                msg_out = MPPMessage.from_reader(reader, dest)
+                assert msg_out.data.array is dest
+                assert msg_out.data.indexes == ['x', 'y']
+                assert (dest == array).all()
+
+        # not if it doesn't fit
+        read_only = np.zeros((3, 4))
+        read_only.flags.writeable = False
+        for dest in (
+                np.zeros((4, 3)), np.zeros((3, 4), np.float32), read_only):
+            msg_out = MPPMessage.from_reader(
+                    BufferResponseReader(frame), dest)
+            assert msg_out.data.array is not dest
+            assert (msg_out.data.array == array).all()
+            assert not dest.any()
+
+    # and only for single grids
+    dest = np.zeros(3)
+    msg = MPPMessage(
+            sender, receiver, None, 0.0, None, Settings(),
+            [np.ones(3), np.ones(3)])
+    msg_out = MPPMessage.from_reader(
+            BufferResponseReader(b''.join(msg.encoded_frame().frame())), dest)
+    assert msg_out.data[0].array.tolist() == [1.0, 1.0, 1.0]
+    assert not dest.any()
+
+
+def test_spill(tmp_path):
+    sender = Reference('sender.port')
+    receiver = Reference('receiver.port')
+
+    for data in (b'test', {'grid': np.arange(13, dtype=np.int32),
+                           'flags': np.array([True, False])}):
+        msg = MPPMessage(
+                sender, receiver, None, 10.0, 11.0, Settings({'test': 13}),
+                data)
+        encoded = msg.encoded_frame()
+        spilled = encoded.spill(tmp_path)
+        assert spilled.spilled
+        assert not encoded.spilled
+        assert spilled.size == encoded.size
+        assert list(tmp_path.iterdir()) == []
+
+        assert b''.join(spilled.frame()) == b''.join(encoded.frame())
+        assert spilled.legacy() == encoded.legacy()
+        assert spilled.spill(tmp_path).payload is spilled.payload
+
+    # copies for different receivers share the spilled payload
+    msg = MPPMessage(
+            sender, receiver, None, 10.0, 11.0, Settings(),
+            Grid(np.arange(13, dtype=np.int32)))
+    encoded = list(msg.encoded_frames(
+        [(sender, receiver + i, 2) for i in range(2)]))
+    spilled = [enc.spill(tmp_path) for enc in encoded]
+    assert spilled[0].payload is spilled[1].payload
+    for enc, spilled_enc in zip(encoded, spilled):
+        assert b''.join(spilled_enc.frame()) == b''.join(enc.frame())
+
+
+def test_overlay_references() -> None:
+    sender = Reference('sender.port')
+    receiver = Reference('receiver.port')
+    overlay = Settings({'test{}'.format(i): float(i) for i in range(100)})
+
+    for data in (b'test', Grid(np.arange(13, dtype=np.int32))):
+        msg = MPPMessage(sender, receiver, None, 10.0, 11.0, overlay, data)
+        encoded = msg.encoded_frame()
+        assert encoded.overlay_digest is not None
+        full = b''.join(encoded.frame())
+        reference = b''.join(encoded.frame(True))
+        assert len(reference) < len(full) - 1000
+        assert encoded.legacy() == msg.encoded()
+
+        with pytest.raises(RuntimeError):
+            MPPMessage.from_bytes(reference)
+        with pytest.raises(RuntimeError):
+            MPPMessage.from_bytes(reference, OverlayCache())
+
+        cache = OverlayCache()
+        msg1 = MPPMessage.from_bytes(full, cache)
+        msg2 = MPPMessage.from_bytes(reference, cache)
+        assert msg1.settings_overlay == overlay
+        assert msg2.settings_overlay == overlay
+        assert msg2.next_timestamp == 11.0
+
+        # received overlays are independent copies
+        msg1.settings_overlay['test0'] = 'changed'
+        msg3 = MPPMessage.from_reader(BufferResponseReader(reference), None,
+                                      cache)
+        assert msg3.settings_overlay == overlay
+
+        # settings sent as data do not
+        data_msg = MPPMessage(
+                sender, receiver, None, 10.0, 11.0, overlay,
+                Settings({'x': 1}))
+        msg4 = MPPMessage.from_bytes(
+                b''.join(data_msg.encoded_frame().frame()), cache)
+        assert msg4.data == Settings({'x': 1})
+        assert MPPMessage.from_bytes(reference, cache).settings_overlay == (
+                overlay)
+
+        # a different overlay replaces the cached one
+        other = MPPMessage(
+                sender, receiver, None, 10.0, 11.0, Settings({'x': 1}), data)
+        MPPMessage.from_bytes(b''.join(other.encoded_frame().frame()), cache)
+        with pytest.raises(RuntimeError):
+            MPPMessage.from_bytes(reference, cache)
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+from ymmsl import Reference, Settings
+
+from libmuscle.mcp.tcp_transport_server import TcpTransportServer
+from libmuscle.mpp_client import MPPClient
+from libmuscle.mpp_message import ClosePort, MPPMessage
+from libmuscle.multi_prefetcher import MultiPrefetcher
+from libmuscle.post_office import PostOffice
+
+
+def _message(receiver, data):
+    return MPPMessage(
+            Reference('sender.out'), receiver, None, 0.0, None, Settings(),
+            data).encoded_frame()
+
+
+def test_multi_prefetcher() -> None:
+    post_office = PostOffice()
+    server = TcpTransportServer(post_office)
+    receivers = [Reference('receiver.in[0]'), Reference('receiver.in[1]')]
+
+    prefetcher = MultiPrefetcher(
+            MPPClient([server.get_location()]), receivers)
+    endpoint0 = prefetcher.endpoint(receivers[0])
+    endpoint1 = prefetcher.endpoint(receivers[1])
+    assert not endpoint0.available()
+    assert not endpoint1.available()
+
+    notified = list()
+    endpoint1.notify(lambda: notified.append(True))
+
+    # messages arrive in order, whichever slot they're for
+    post_office.deposit(receivers[1], _message(receivers[1], 0))
+    post_office.deposit(receivers[1], _message(receivers[1], 1))
+    msg, size = endpoint1.retrieve()
+    assert msg.data == 0
+    assert msg.receiver == receivers[1]
+    assert size > 0
+    msg, _ = endpoint1.retrieve()
+    assert msg.data == 1
+    assert notified == [True, True]
+    assert not endpoint0.available()
+
+    post_office.deposit(receivers[0], _message(receivers[0], ClosePort()))
+    msg, _ = endpoint0.retrieve()
+    assert isinstance(msg.data, ClosePort)
+
+    # the closed slot is no longer fetched from
+    post_office.deposit(receivers[0], _message(receivers[0], 2))
+    post_office.deposit(receivers[1], _message(receivers[1], 3))
+    msg, _ = endpoint1.retrieve()
+    assert msg.data == 3
+    time.sleep(0.05)
+    assert not endpoint0.available()
+    assert not post_office._outboxes[receivers[0]].is_empty()
+
+    endpoint0.close()
+    endpoint1.close()
+    with pytest.raises(RuntimeError):
+        endpoint1.retrieve()
+    server.close()
@@ -1,4 +1,4 @@
-from libmuscle.outbox import Outbox
+from libmuscle.outbox import Claim, Outbox
 from libmuscle.mpp_message import MPPMessage
 
 from copy import copy
@@ -47,3 +47,58 @@ def test_deposit_retrieve_order(outbox, message):
 
     assert outbox.retrieve() == m1
     assert outbox.retrieve() == m2
+
+
+def test_retrieve_nowait(outbox, message):
+    received = list()
+
+    assert outbox.retrieve_nowait(received.append) is None
+    outbox.deposit(message)
+    assert received == [message]
+    assert outbox.is_empty()
+
+    outbox.deposit(message)
+    assert outbox.retrieve_nowait(received.append) == message
+    assert len(received) == 1
+
+
+def test_retrieve_nowait_several(outbox, message):
+    m1 = copy(message)
+    m2 = copy(message)
+    received1 = list()
+    received2 = list()
+
+    assert outbox.retrieve_nowait(received1.append) is None
+    assert outbox.retrieve_nowait(received2.append) is None
+    outbox.deposit(m1)
+    outbox.deposit(m2)
+    assert received1 == [m1]
+    assert received2 == [m2]
+    assert outbox.is_empty()
+
+
+def test_retrieve_nowait_claim(message):
+    outbox1 = Outbox()
+    outbox2 = Outbox()
+    m1 = copy(message)
+    m2 = copy(message)
+    received = list()
+
+    claim = Claim()
+    assert outbox1.retrieve_nowait(received.append, claim) is None
+    assert outbox2.retrieve_nowait(received.append, claim) is None
+    outbox2.deposit(m1)
+    assert claim.taken
+    assert received == [m1]
+
+    # the waiter got its message, so it is skipped
+    outbox1.deposit(m2)
+    assert received == [m1]
+    assert outbox1.retrieve() == m2
+
+    claim = Claim()
+    outbox1.deposit(m1)
+    outbox2.deposit(m2)
+    assert outbox1.retrieve_nowait(received.append, claim) == m1
+    assert outbox2.retrieve_nowait(received.append, claim) is None
+    assert outbox2.retrieve() == m2
@@ -0,0 +1,239 @@
+from threading import Thread
+import time
+
+import msgpack
+import numpy as np
+import pytest
+from ymmsl import Reference, Settings
+
+from libmuscle.grid import Grid
+from libmuscle.mcp.protocol import MPPFeature, RequestType
+from libmuscle.mpp_message import MPPMessage
+from libmuscle.post_office import PostOffice
+
+
+def _message(receiver, size):
+    return MPPMessage(
+            Reference('sender.out'), receiver, None, 0.0, None, Settings(),
+            bytes(size)).encoded_frame()
+
+
+@pytest.fixture
+def post_office():
+    return PostOffice()
+
+
+def test_size(post_office):
+    receiver = Reference('receiver.in')
+    message = _message(receiver, 1000)
+    post_office.deposit(receiver, message)
+    post_office.deposit(receiver, _message(receiver, 1000))
+    assert post_office.size() == 2 * message.size
+
+    post_office.get_message(receiver)
+    assert post_office.size() == message.size
+    post_office.get_message(receiver)
+    assert post_office.size() == 0
+
+
+def test_size_broadcast(post_office):
+    receivers = [Reference('receiver.in') + i for i in range(3)]
+    messages = list(MPPMessage(
+            Reference('sender.out'), receivers[0], None, 0.0, None,
+            Settings(), bytes(1000)).encoded_frames(
+                (Reference('sender.out'), receiver, 3)
+                for receiver in receivers))
+
+    # the payload is shared, and only counted once
+    payload_size = messages[0].payload_size
+    assert payload_size > 1000
+    for receiver, message in zip(receivers, messages):
+        post_office.deposit(receiver, message, 'out')
+    total = sum(message.size for message in messages) - 2 * payload_size
+    assert post_office.size() == total
+
+    post_office.get_message(receivers[0])
+    assert post_office.size() == total - messages[0].size + payload_size
+    post_office.get_message(receivers[1])
+    post_office.get_message(receivers[2])
+    assert post_office.size() == 0
+    assert post_office._port_sizes['out'] == 0
+
+
+def test_limit_error(post_office):
+    receiver = Reference('receiver.in')
+    message = _message(receiver, 1000)
+    post_office.set_limits(message.size + 10, None, False)
+
+    post_office.deposit(receiver, message)
+    with pytest.raises(RuntimeError):
+        post_office.deposit(receiver, _message(receiver, 1000))
+
+    post_office.get_message(receiver)
+    post_office.deposit(receiver, _message(receiver, 1000))
+
+
+def test_limit_large_message(post_office):
+    receiver = Reference('receiver.in')
+    post_office.set_limits(100, None, False)
+
+    # too large, but let through if there's nothing else waiting
+    message = _message(receiver, 1000)
+    post_office.deposit(receiver, message)
+    with pytest.raises(RuntimeError):
+        post_office.deposit(receiver, _message(receiver, 10))
+
+
+def test_port_limit(post_office):
+    receiver1 = Reference('receiver1.in')
+    receiver2 = Reference('receiver2.in')
+    message = _message(receiver1, 1000)
+    post_office.set_limits(None, message.size + 10, False)
+
+    post_office.deposit(receiver1, message, 'out1')
+    post_office.deposit(receiver2, _message(receiver2, 1000), 'out2')
+    with pytest.raises(RuntimeError):
+        post_office.deposit(receiver1, _message(receiver1, 1000), 'out1')
+
+    post_office.get_message(receiver1)
+    post_office.deposit(receiver1, _message(receiver1, 1000), 'out1')
+
+
+def test_limit_block(post_office):
+    receiver = Reference('receiver.in')
+    message = _message(receiver, 1000)
+    post_office.set_limits(message.size + 10, None, True)
+    post_office.deposit(receiver, message)
+
+    def deposit():
+        post_office.deposit(receiver, _message(receiver, 1000))
+
+    sender = Thread(target=deposit)
+    sender.start()
+    time.sleep(0.1)
+    assert sender.is_alive()
+
+    post_office.get_message(receiver)
+    sender.join(1.0)
+    assert not sender.is_alive()
+    assert post_office.size() == message.size
+
+
+def test_limit_spill(post_office, tmp_path):
+    receiver = Reference('receiver.in')
+    message = _message(receiver, 1000)
+    post_office.set_limits(message.size + 10, None, False, tmp_path)
+
+    for _ in range(3):
+        post_office.deposit(receiver, _message(receiver, 1000))
+    assert post_office.size() == message.size
+    assert list(tmp_path.iterdir()) == []
+
+    for _ in range(3):
+        message_out = post_office.get_message(receiver)
+        assert b''.join(message_out.frame()) == b''.join(message.frame())
+    assert post_office.size() == 0
+
+
+def test_channels(post_office):
+    def request(*args):
+        return post_office.handle_request(
+                msgpack.packb(list(args), use_bin_type=True))
+
+    def open_channel(receiver):
+        return msgpack.unpackb(
+                request(RequestType.OPEN_CHANNEL.value, receiver))
+
+    channel = open_channel('receiver.in')
+    assert open_channel('other.in') != channel
+    assert open_channel('receiver.in') == channel
+
+    receiver = Reference('receiver.in')
+    message = _message(receiver, 1000)
+    post_office.deposit(receiver, message, 'out')
+    response = request(
+            RequestType.GET_NEXT_MESSAGE.value, channel,
+            [MPPFeature.OOB_GRIDS.value])
+    assert b''.join(response) == b''.join(message.frame())
+    assert post_office.size() == 0
+
+    with pytest.raises(RuntimeError):
+        request(RequestType.GET_NEXT_MESSAGE.value, 2, [])
+    with pytest.raises(RuntimeError):
+        request(RequestType.GET_NEXT_MESSAGE.value, -1, [])
+
+
+def test_legacy_async(post_office):
+    receiver = Reference('receiver.in')
+
+    def grid_message():
+        return MPPMessage(
+                Reference('sender.out'), receiver, None, 0.0, None,
+                Settings(), Grid(np.arange(1000.0))).encoded_frame()
+
+    def get_next():
+        responses = list()
+        post_office.handle_request_async(
+                msgpack.packb(
+                    [RequestType.GET_NEXT_MESSAGE.value, str(receiver)],
+                    use_bin_type=True),
+                lambda response, last: responses.append(response))
+        return responses
+
+    # not encoded yet, so that is done in the background
+    message = grid_message()
+    post_office.deposit(receiver, message)
+    responses = get_next()
+    for _ in range(100):
+        if responses:
+            break
+        time.sleep(0.01)
+    assert responses == [message.legacy()]
+    assert post_office.size() == 0
+
+    # now we know the receiver, so it is encoded when deposited
+    message = grid_message()
+    post_office.deposit(receiver, message)
+    assert message.payload.has_legacy()
+    assert get_next() == [message.legacy()]
+
+
+def test_get_any(post_office):
+    receiver1 = Reference('receiver.in[0]')
+    receiver2 = Reference('receiver.in[1]')
+    features = [MPPFeature.OOB_GRIDS.value]
+
+    def get_any():
+        responses = list()
+        post_office.handle_request_async(
+                msgpack.packb(
+                    [RequestType.GET_ANY_MESSAGE.value,
+                     [str(receiver1), str(receiver2)], features],
+                    use_bin_type=True),
+                lambda response, last: responses.append(response))
+        return responses
+
+    message1 = _message(receiver1, 100)
+    message2 = _message(receiver2, 100)
+    post_office.deposit(receiver2, message2)
+    assert get_any() == [message2.frame()]
+
+    # waits for either one, and gets only one message
+    responses = get_any()
+    assert responses == []
+    post_office.deposit(receiver1, message1)
+    assert responses == [message1.frame()]
+    post_office.deposit(receiver2, message2)
+    assert responses == [message1.frame()]
+    assert post_office.size() == message2.size
+
+    response = post_office.handle_request(msgpack.packb(
+            [RequestType.GET_ANY_MESSAGE.value, [str(receiver2)], features],
+            use_bin_type=True))
+    assert b''.join(response) == b''.join(message2.frame())
+    assert post_office.size() == 0
+
+    with pytest.raises(RuntimeError):
+        post_office.handle_request(msgpack.packb(
+                [RequestType.GET_ANY_MESSAGE.value, [], features],
+                use_bin_type=True))
@@ -0,0 +1,92 @@
+import time
+
+from ymmsl import Reference, Settings
+
+from libmuscle.mcp.tcp_transport_server import TcpTransportServer
+from libmuscle.mpp_client import MPPClient
+from libmuscle.mpp_message import ClosePort, MPPMessage
+from libmuscle.post_office import PostOffice
+from libmuscle.prefetcher import Prefetcher
+
+
+def _message(data):
+    return MPPMessage(
+            Reference('sender.out'), Reference('receiver.in'), None,
+            0.0, None, Settings(), data).encoded_frame()
+
+
+def test_prefetcher() -> None:
+    post_office = PostOffice()
+    server = TcpTransportServer(post_office)
+    receiver = Reference('receiver.in')
+
+    prefetcher = Prefetcher(MPPClient([server.get_location()]), receiver)
+
+    post_office.deposit(receiver, _message(0))
+    for i in range(3):
+        msg, size = prefetcher.retrieve()
+        assert msg.data == i
+        assert size > 0
+
+        # the next one is fetched in the background
+        post_office.deposit(receiver, _message(i + 1))
+        for _ in range(50):
+            if post_office._outboxes[receiver].is_empty():
+                break
+            time.sleep(0.01)
+        assert post_office._outboxes[receiver].is_empty()
+
+    msg, _ = prefetcher.retrieve()
+    assert msg.data == 3
+
+    post_office.deposit(receiver, _message(ClosePort()))
+    msg, _ = prefetcher.retrieve()
+    assert isinstance(msg.data, ClosePort)
+
+    # no more fetching after the port was closed
+    assert prefetcher._next is None
+    post_office.deposit(receiver, _message(4))
+    msg, _ = prefetcher.retrieve()
+    assert msg.data == 4
+
+    prefetcher.close()
+    server.close()
+
+
+def test_notify() -> None:
+    post_office = PostOffice()
+    server = TcpTransportServer(post_office)
+    receiver = Reference('receiver.in')
+
+    prefetcher = Prefetcher(MPPClient([server.get_location()]), receiver)
+    assert not prefetcher.available()
+
+    post_office.deposit(receiver, _message(0))
+    for _ in range(50):
+        if prefetcher.available():
+            break
+        time.sleep(0.01)
+    assert prefetcher.available()
+
+    # called right away for a message that's already here
+    notified = list()
+    prefetcher.notify(lambda: notified.append(True))
+    assert notified == [True]
+
+    msg, _ = prefetcher.retrieve()
+    assert msg.data == 0
+    assert not prefetcher.available()
+
+    post_office.deposit(receiver, _message(ClosePort()))
+    for _ in range(50):
+        if len(notified) == 2:
+            break
+        time.sleep(0.01)
+    assert notified == [True, True]
+
+    msg, _ = prefetcher.retrieve()
+    assert isinstance(msg.data, ClosePort)
+    assert not prefetcher.available()
+
+    prefetcher.close()
+    server.close()
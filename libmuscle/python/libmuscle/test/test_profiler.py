@@ -0,0 +1,138 @@
+from time import sleep
+from unittest.mock import MagicMock
+
+import pytest
+from ymmsl import Operator, Port, Reference
+
+from libmuscle.profiler import Profiler
+from libmuscle.profiling import ProfileEvent, ProfileEventType
+from libmuscle.timestamp import Timestamp
+
+
+@pytest.fixture
+def manager():
+    return MagicMock()
+
+
+@pytest.fixture
+def profiler(manager):
+    profiler = Profiler(Reference('test_instance'), manager)
+    yield profiler
+    profiler.shutdown()
+
+
+def submitted(manager):
+    return [
+            event for call in manager.submit_profile_records.call_args_list
+            for event in call[0][1]]
+
+
+def test_record(profiler, manager):
+    port = Port(Reference('out'), Operator.O_I)
+    start = profiler.start()
+    profiler.record(ProfileEventType.SEND, start, port, 10, 3, 1000, 5000)
+    profiler.shutdown()
+
+    call_args = manager.submit_profile_records.call_args[0]
+    assert call_args[0] == Reference('test_instance')
+
+    events = submitted(manager)
+    assert len(events) == 1
+    (
+            event_type, start_time, stop_time, port2, length, slot, size,
+            outbox_size) = events[0]
+    assert event_type == ProfileEventType.SEND
+    assert start_time == start
+    assert stop_time >= start
+    assert port2 == port
+    assert length == 10
+    assert slot == 3
+    assert size == 1000
+    assert outbox_size == 5000
+
+
+def test_record_event(profiler, manager):
+    port = Port(Reference('out'), Operator.O_I)
+    profiler.record_event(ProfileEvent(
+        Reference('test_instance'), Timestamp(1.0), Timestamp(2.0),
+        ProfileEventType.SEND, port, 10, 3, 1000, 5000))
+    profiler.shutdown()
+
+    assert submitted(manager) == [
+            (ProfileEventType.SEND, 1.0, 2.0, port, 10, 3, 1000, 5000)]
+
+
+def test_batch_size(profiler, manager):
+    profiler.set_flush_policy(100.0, 10)
+    for _ in range(25):
+        profiler.record(ProfileEventType.SEND, profiler.start())
+
+    for _ in range(100):
+        if len(submitted(manager)) >= 20:
+            break
+        sleep(0.01)
+
+    sizes = [
+            len(call[0][1])
+            for call in manager.submit_profile_records.call_args_list]
+    assert all(size <= 10 for size in sizes)
+    assert len(submitted(manager)) >= 20
+
+    profiler.shutdown()
+    assert len(submitted(manager)) == 25
+
+
+def test_flush_interval(profiler, manager):
+    profiler.set_flush_policy(0.01, 1000)
+    profiler.record(ProfileEventType.REGISTER, profiler.start())
+    for _ in range(100):
+        if submitted(manager):
+            break
+        sleep(0.01)
+    assert len(submitted(manager)) == 1
+
+
+def test_clock_sync(profiler, manager):
+    profiler._clock_sync_interval = 0.0
+    profiler.set_flush_policy(0.01, 1000)
+    for _ in range(100):
+        if manager.sync_clock.called:
+            break
+        sleep(0.01)
+    assert manager.sync_clock.called
+
+
+def test_disabled(profiler, manager):
+    profiler.set_level(False)
+    profiler.record(ProfileEventType.REGISTER, profiler.start())
+    profiler.shutdown()
+    assert submitted(manager) == []
+
+
+def test_sampled(profiler, manager):
+    port = Port(Reference('out'), Operator.O_I)
+    profiler.set_level(True, 10)
+    profiler.record(ProfileEventType.REGISTER, profiler.start())
+    for _ in range(100):
+        profiler.record(ProfileEventType.SEND, profiler.start(), port)
+    profiler.shutdown()
+
+    events = submitted(manager)
+    assert events[0][0] == ProfileEventType.REGISTER
+    assert len(events) == 11
+
+    with pytest.raises(ValueError):
+        profiler.set_level(True, 0)
+
+
+def test_sampled_per_slot(profiler, manager):
+    port = Port(Reference('out'), Operator.O_I)
+    profiler.set_level(True, 3)
+    for _ in range(6):
+        for slot in range(2):
+            profiler.record(ProfileEventType.SEND, profiler.start(), port,
+                            2, slot)
+    profiler.shutdown()
+
+    slots = [event[5] for event in submitted(manager)]
+    assert slots == [0, 1, 0, 1]
@@ -59,3 +59,70 @@ def test_get_setting(settings_manager):
                                         ) == 'base_test5'
     assert settings_manager.get_setting(ref('instance[11]'), ref('test5')
                                         ) == 'overlay_test5'
+
+
+def test_get_setting_cached(settings_manager):
+    ref = Reference
+    settings_manager.base = Settings({'test1': 13, 'test2': [[1.0, 2.0]]})
+    assert settings_manager.get_setting(ref('instance'), ref('test1')) == 13
+    assert settings_manager.get_setting(
+            ref('instance'), ref('test2'), '[[float]]') == [[1.0, 2.0]]
+    with pytest.raises(TypeError):
+        settings_manager.get_setting(ref('instance'), ref('test1'), 'str')
+
+    settings_manager.base['test1'] = 14
+    assert settings_manager.get_setting(ref('instance'), ref('test1')) == 14
+
+    settings_manager.overlay = Settings({'instance.test1': 15})
+    assert settings_manager.get_setting(ref('instance'), ref('test1')) == 15
+    assert settings_manager.get_setting(ref('other'), ref('test1')) == 14
+
+    del settings_manager.overlay['instance.test1']
+    assert settings_manager.get_setting(ref('instance'), ref('test1')) == 14
+
+    # layers are copies of what was assigned
+    overlay = Settings({'test1': 16})
+    settings_manager.overlay = overlay
+    overlay['test1'] = 17
+    assert settings_manager.get_setting(ref('instance'), ref('test1')) == 16
+
+
+def test_get_settings(settings_manager):
+    ref = Reference
+    settings_manager.base = Settings({
+        'solver.tol': 1e-6,
+        'solver.max_iter': 100,
+        'micro.solver.tol': 1e-3,
+        'micro[1].solver.max_iter': 10,
+        'micro.dt': 0.1})
+    settings_manager.overlay = Settings({'solver.max_iter': 200})
+
+    settings = settings_manager.get_settings(ref('micro[1]'))
+    assert settings.as_ordered_dict() == {
+        'solver.tol': 1e-3,
+        'solver.max_iter': 10,
+        'micro.solver.tol': 1e-3,
+        'micro[1].solver.max_iter': 10,
+        'dt': 0.1,
+        'micro.dt': 0.1}
+
+    settings = settings_manager.get_settings(ref('micro[2]'), ref('solver'))
+    assert settings.as_ordered_dict() == {
+            'solver.tol': 1e-3, 'solver.max_iter': 200}
+
+    settings = settings_manager.get_settings(ref('macro'), ref('solver'))
+    assert settings.as_ordered_dict() == {
+            'solver.tol': 1e-6, 'solver.max_iter': 200}
+
+    # results are copies
+    settings['solver.tol'] = 0.5
+    settings = settings_manager.get_settings(ref('macro'), ref('solver'))
+    assert settings['solver.tol'] == 1e-6
+
+    settings_manager.overlay = Settings()
+    settings = settings_manager.get_settings(ref('macro'), ref('solver'))
+    assert settings['solver.max_iter'] == 100
+
+    settings_manager.base['solver.max_iter'] = 50
+    settings = settings_manager.get_settings(ref('macro'), ref('solver'))
+    assert settings['solver.max_iter'] == 50
@@ -1,11 +1,15 @@
+from pathlib import Path
 import sys
-from typing import Sequence
+from typing import Optional, Sequence, Tuple
 
 import click
 import ymmsl
-from ymmsl import Identifier, PartialConfiguration
+from ymmsl import Identifier, Model, PartialConfiguration
 
 
+from libmuscle.manager.profile_analysis import (
+        ConduitTraffic, Conduits, CriticalPath, InstanceTimes, ProfileData)
+from libmuscle.manager.trace_export import TraceExporter
 from libmuscle.planner.planner import Planner, Resources
 
 
@@ -107,6 +111,156 @@ def resources(
     sys.exit(0)
 
 
+@muscle3.command(short_help='Analyse the profile of a simulation run')
+@click.argument(
+        'run_dir_or_db', nargs=1, type=click.Path(
+            exists=True, file_okay=True, dir_okay=True, readable=True,
+            resolve_path=True))
+@click.option(
+        '-y', '--ymmsl', 'ymmsl_file', type=click.Path(
+            exists=True, file_okay=True, dir_okay=False, readable=True,
+            resolve_path=True),
+        help='Configuration of the run, for analysing communication.')
+def profile(run_dir_or_db: str, ymmsl_file: Optional[str]) -> None:
+    """Analyse the performance of a simulation run.
+
+    The MUSCLE3 manager records profiling information about each
+    instance in a database named muscle_stats.sqlite in the run
+    directory. This command reads that database and shows where each
+    instance spent its time, how much data was sent over each conduit,
+    and which instances were on the critical path of the simulation.
+
+    Information about conduits and the critical path requires the
+    configuration of the run. If a run directory is given, this is
+    taken from the configuration.ymmsl file saved there by the manager,
+    otherwise it can be specified using the -y option.
+
+    Examples:
+
+      muscle3 profile run_my_model_20220101_120000
+
+      muscle3 profile -y my_model.ymmsl muscle_stats.sqlite
+
+    """
+    db_file, model = _find_profile(run_dir_or_db, ymmsl_file)
+    data = ProfileData(db_file)
+    times = InstanceTimes(data)
+
+    click.echo()
+    click.echo(
+            f'{"Instance":<30} {"Total (s)":>10} {"Compute":>10}'
+            f' {"Send":>10} {"Receive":>10} {"Other":>10}')
+    for oid in sorted(
+            range(len(data.instances)), key=lambda i: data.instances[i]):
+        if data.instances[oid]:
+            click.echo(
+                    f'{data.instances[oid]:<30} {times.total[oid]:>10.3f}'
+                    f' {times.compute[oid]:>10.3f} {times.send[oid]:>10.3f}'
+                    f' {times.receive[oid]:>10.3f}'
+                    f' {times.overhead[oid]:>10.3f}')
+
+    if model is None:
+        sys.exit(0)
+
+    conduits = Conduits(data, model)
+    traffic = ConduitTraffic(data, conduits)
+    throughput = traffic.throughput()
+
+    click.echo()
+    click.echo(
+            f'{"Conduit":<40} {"Messages":>10} {"MB":>10}'
+            f' {"MB/s":>10}')
+    for i, name in enumerate(conduits.names):
+        click.echo(
+                f'{name:<40} {traffic.messages[i]:>10}'
+                f' {traffic.bytes[i] * 1e-6:>10.3f}'
+                f' {throughput[i] * 1e-6:>10.3f}')
+
+    path_info = CriticalPath(data, conduits)
+    click.echo()
+    click.echo(f'Critical path: {path_info.length:.3f} s')
+    click.echo(f'  {"communication":<28} {path_info.communication:>10.3f}')
+    for oid in path_info.compute.argsort()[::-1]:
+        if path_info.compute[oid] > 0.0:
+            click.echo(
+                    f'  {data.instances[oid]:<28}'
+                    f' {path_info.compute[oid]:>10.3f}')
+
+    sys.exit(0)
+
+
+@muscle3.command(short_help='Export a timeline of a simulation run')
+@click.argument(
+        'run_dir_or_db', nargs=1, type=click.Path(
+            exists=True, file_okay=True, dir_okay=True, readable=True,
+            resolve_path=True))
+@click.option(
+        '-y', '--ymmsl', 'ymmsl_file', type=click.Path(
+            exists=True, file_okay=True, dir_okay=False, readable=True,
+            resolve_path=True),
+        help='Configuration of the run, for linking messages.')
+@click.option(
+        '-o', '--output', type=click.Path(
+            file_okay=True, dir_okay=False, writable=True,
+            resolve_path=True),
+        default='muscle3_trace.json', show_default=True,
+        help='File to write the trace to.')
+def trace(run_dir_or_db: str, ymmsl_file: Optional[str], output: str
+          ) -> None:
+    """Export a timeline of a simulation run.
+
+    This converts the profiling information recorded by the MUSCLE3
+    manager into a trace file in the Chrome Trace Event Format, which
+    can be viewed at https://ui.perfetto.dev or in Chrome using
+    chrome://tracing. Each instance is shown on its own track, and
+    each message is shown as an arrow from where it was sent to where
+    it was received.
+
+    The configuration of the run is needed to link sends and receives.
+    If a run directory is given, it is taken from the
+    configuration.ymmsl file saved there by the manager, otherwise it
+    can be specified using the -y option.
+
+    Examples:
+
+      muscle3 trace run_my_model_20220101_120000
+
+      muscle3 trace -y my_model.ymmsl -o trace.json muscle_stats.sqlite
+
+    """
+    db_file, model = _find_profile(run_dir_or_db, ymmsl_file)
+    with open(output, 'w') as f:
+        TraceExporter(db_file, model).export(f)
+    sys.exit(0)
+
+
+def _find_profile(
+        run_dir_or_db: str, ymmsl_file: Optional[str]
+        ) -> Tuple[Path, Optional[Model]]:
+    """Finds the profile database and model of a run.
+
+    Exits with an error message if the database does not exist.
+    """
+    path = Path(run_dir_or_db)
+    if path.is_dir():
+        db_file = path / 'muscle_stats.sqlite'
+        if ymmsl_file is None and (path / 'configuration.ymmsl').exists():
+            ymmsl_file = str(path / 'configuration.ymmsl')
+    else:
+        db_file = path
+
+    if not db_file.exists():
+        click.echo(f'No profile database found at {db_file}', err=True)
+        sys.exit(1)
+
+    model = None    # type: Optional[Model]
+    if ymmsl_file is not None:
+        config = _load_ymmsl_files([ymmsl_file])
+        if isinstance(config.model, Model):
+            model = config.model
+    return db_file, model
+
+
 def _load_ymmsl_files(ymmsl_files: Sequence[str]) -> PartialConfiguration:
     """Loads and merges yMMSL files."""
     configuration = PartialConfiguration()
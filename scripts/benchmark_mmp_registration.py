@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""Measures how fast the manager handles a storm of registrations.
+
+This starts a manager server in this process, and then a number of
+client processes, which together simulate the given number of
+instances. Each client process opens a number of connections to the
+manager, and registers instances over all of them at the same time,
+as happens when a large ensemble starts up.
+
+Example:
+    python3 scripts/benchmark_mmp_registration.py 1000 10000 50000
+"""
+
+import argparse
+import multiprocessing as mp
+from multiprocessing import Process, Queue
+from multiprocessing.synchronize import Barrier
+from pathlib import Path
+import socket
+from tempfile import TemporaryDirectory
+import time
+from typing import cast, List
+
+import msgpack
+from ymmsl import (
+        Component, Conduit, Configuration, Model, Reference, Settings)
+
+from libmuscle.manager.instance_registry import InstanceRegistry
+from libmuscle.manager.logger import Logger
+from libmuscle.manager.mmp_server import MMPServer
+from libmuscle.manager.profile_store import ProfileStore
+from libmuscle.manager.topology_store import TopologyStore
+from libmuscle.mcp.protocol import RequestType, ResponseType
+from libmuscle.mcp.tcp_util import recv_all, recv_int64, send_int64
+
+
+def make_configuration(num_instances: int) -> Configuration:
+    """Creates a macro-micro model with the given number of micros."""
+    model = Model(
+            'benchmark',
+            [
+                Component('macro', 'macro'),
+                Component('micro', 'micro', [num_instances])],
+            [
+                Conduit('macro.out', 'micro.in'),
+                Conduit('micro.out', 'macro.in')])
+    return Configuration(model)
+
+
+def register_request(instance: int) -> bytes:
+    """Creates an encoded registration request for a micro instance."""
+    name = str(Reference('micro') + instance)
+    request = [
+            RequestType.REGISTER_INSTANCE.value, name,
+            ['tcp:10.0.0.1:{}'.format(10000 + instance % 50000)],
+            [['in', 'F_INIT'], ['out', 'O_F']]]
+    return cast(bytes, msgpack.packb(request, use_bin_type=True))
+
+
+def connect(host: str, port: int) -> socket.socket:
+    """Opens a connection to the manager."""
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def run_client(
+        host: str, port: int, instances: List[int], num_connections: int,
+        barrier: Barrier, results: Queue) -> None:
+    """Registers the given instances, spread over some connections.
+
+    Instances are registered in rounds. In each round, one request is
+    sent on every connection, and then all the responses are received.
+    """
+    connections = [connect(host, port) for _ in range(num_connections)]
+    requests = [register_request(i) for i in instances]
+    barrier.wait()
+
+    begin = time.perf_counter()
+    for start in range(0, len(requests), num_connections):
+        batch = requests[start:start + num_connections]
+        for conn, request in zip(connections, batch):
+            send_int64(conn, len(request))
+            conn.sendall(request)
+        for conn, _ in zip(connections, batch):
+            response = msgpack.unpackb(
+                    recv_all(conn, recv_int64(conn)), raw=False)
+            if response[0] != ResponseType.SUCCESS.value:
+                raise RuntimeError(response)
+    end = time.perf_counter()
+
+    for conn in connections:
+        conn.close()
+    results.put((begin, end))
+
+
+def benchmark(
+        num_instances: int, num_processes: int, num_connections: int,
+        log_dir: Path) -> float:
+    """Runs a registration storm against a fresh manager server.
+
+    Args:
+        num_instances: Number of instances to register.
+        num_processes: Number of client processes to use.
+        num_connections: Number of connections per client process.
+        log_dir: Directory to write the manager log to.
+
+    Returns:
+        The wall clock time it took to register all instances.
+    """
+    logger = Logger(log_dir)
+    profile_store = ProfileStore(log_dir / 'muscle_stats.sqlite')
+    registry = InstanceRegistry()
+    topology = TopologyStore(make_configuration(num_instances))
+    server = MMPServer(logger, profile_store, Settings(), registry, topology)
+    port = int(server.get_location().split(',')[0].rsplit(':', 1)[1])
+
+    barrier = mp.Barrier(num_processes + 1)
+    results = Queue()   # type: Queue
+    clients = list()
+    for i in range(num_processes):
+        instances = list(range(i, num_instances, num_processes))
+        conns = max(1, min(num_connections, len(instances)))
+        client = Process(
+                target=run_client,
+                args=('127.0.0.1', port, instances, conns, barrier, results))
+        client.start()
+        clients.append(client)
+
+    barrier.wait()
+    times = [results.get() for _ in clients]
+    for client in clients:
+        client.join()
+
+    server.stop()
+    profile_store.close()
+    logger.close()
+
+    begin = min(t[0] for t in times)   # type: float
+    end = max(t[1] for t in times)     # type: float
+    return end - begin
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+            'num_instances', type=int, nargs='*',
+            default=[1000, 10000, 50000],
+            help='Numbers of instances to simulate')
+    parser.add_argument(
+            '--processes', type=int, default=4,
+            help='Number of client processes')
+    parser.add_argument(
+            '--connections', type=int, default=250,
+            help='Number of connections per client process')
+    args = parser.parse_args()
+
+    print('{:>10}  {:>10}  {:>12}'.format(
+        'instances', 'time (s)', 'instances/s'))
+    with TemporaryDirectory() as tmp_dir:
+        for num_instances in args.num_instances:
+            duration = benchmark(
+                    num_instances, args.processes, args.connections,
+                    Path(tmp_dir))
+            print('{:>10}  {:>10.3f}  {:>12.0f}'.format(
+                num_instances, duration, num_instances / duration))